@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+Parse tests, run with 'python -m pytest' from the repo root, outside Anki.
+"""
+
+from zettel_join.parse import ClozeParser
+
+
+NOTE_ID = 1111111111111
+
+CHILD_BODY = '\n'.join(f'Line {n} with **bold {n}** text.\n' for n in range(20))
+
+# an imported top section, whose children are too big for a chunk together
+MD = ('---\nnote-type: cloze\n---\n\n'
+      f'# Top\n\n<!-- NoteId: {NOTE_ID} -->\n\nTop text **top**.\n\n'
+      + ''.join(f'## Child {n}\n\n{CHILD_BODY}\n' for n in range(3)))
+
+
+def parse(tmp_path, chunk_chars: int):
+    md_file = tmp_path / 'chunked.md'
+    md_file.write_text(MD, encoding='utf-8')
+    return ClozeParser('ZK cloze', update=True, chunk_chars=chunk_chars).parse_file(str(md_file), 'Deck')
+
+
+def test_chunked_parse_same_as_whole_in_update_mode(tmp_path):
+    whole = parse(tmp_path, chunk_chars=0)
+    chunked = parse(tmp_path, chunk_chars=1200)
+    assert whole.note_ids == [NOTE_ID]
+    # the ancestor heading rendered along with each chunk is parsed only once
+    assert chunked.note_ids == whole.note_ids
+    assert [(note.root, note.note_id) for note in chunked.notes] == [(note.root, note.note_id) for note in whole.notes]
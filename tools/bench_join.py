@@ -0,0 +1,286 @@
+"""
+Benchmark the join, end to end and stage by stage:
+ scan, load, make_soup, section, do_cloze_selection, media import, note add and write-back.
+Runs headless on a copy of the kasten and a scratch collection, the kasten given is never modified.
+The results are stored as JSON, so that runs can be compared.
+
+    python bench_join.py --files 500 --depth 3              # on a generated kasten
+    python bench_join.py --kasten path/to/kasten --rounds 5
+    python bench_join.py --files 500 --compare bench-results/<earlier>.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable
+
+import frontmatter
+from anki.collection import Collection
+
+# the add-on package works headless, import it from the repo root
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TOOLS_DIR, '..'))
+from zettel_join import cli  # noqa: E402
+from zettel_join.joint import ClozeJoint  # noqa: E402
+from zettel_join.parse import FileSpec, read  # noqa: E402
+from zettel_join.scan import ZkScanner  # noqa: E402
+from zettel_join.section import SectionTree, insert_after_headings  # noqa: E402
+from zettel_join.writer import NoteWriter  # noqa: E402
+from zettel_join.zk import ZettelKasten  # noqa: E402
+
+from gen_kasten import KastenGenerator, add_options, options_of  # noqa: E402
+
+
+RESULTS_DIR = os.path.join(TOOLS_DIR, 'bench-results')
+PROFILE = 'bench'
+FAKE_NOTE_ID = 1700000000000  # 13 digits, as the NoteId comment requires
+
+
+class Bench:
+    """
+    Time each stage over the whole kasten, several rounds, on the copy in a scratch directory.
+    """
+
+    def __init__(self, kasten: str, work_dir: str, rounds: int):
+        self.kasten = kasten
+        self.work_dir = work_dir
+        self.rounds = rounds
+        self.stages: dict[str, dict] = {}
+        self.joins: dict[str, dict] = {}
+        self.round_no = 0
+
+    def fresh_kasten(self) -> str:
+        """
+        A new copy of the kasten, since a join writes back to the files and the manifest.
+        """
+        self.round_no += 1
+        path = os.path.join(self.work_dir, f'kasten-{self.round_no}')
+        shutil.copytree(self.kasten, path)
+        return path
+
+    def fresh_collection_path(self) -> str:
+        return os.path.join(tempfile.mkdtemp(prefix='col-', dir=self.work_dir), 'collection.anki2')
+
+    def measure(self, stage: str, items: int, run: Callable[[], None], setup: Callable[[], object] = None,
+                teardown: Callable[[object], None] = None):
+        """
+        :param stage: stage name
+        :param items: how many items (files, sections, notes...) a run handles
+        :param run: the timed work, which gets the setup result if setup given
+        :param setup: untimed preparation for each round
+        :param teardown: untimed clean-up for each round, with the setup result
+        """
+        seconds: list[float] = []
+        for _ in range(self.rounds):
+            state = setup() if setup else None
+            t = time.perf_counter()
+            run(state) if setup else run()
+            seconds.append(time.perf_counter() - t)
+            if teardown:
+                teardown(state)
+        self.stages[stage] = summarize(seconds, items)
+        print(f'{stage:20} {self.stages[stage]["median"] * 1000:10.1f} ms'
+              f' {self.stages[stage]["per_item_ms"]:8.3f} ms/item ({items} items)')
+
+    """ ========== ========== ========== ========== ========== ========== ========== ========== ========== ==========
+    stages
+    """
+
+    def run_stages(self):
+        kasten = self.fresh_kasten()
+        parser = ClozeJoint().parser
+        # scan
+        entries = list(ZkScanner(kasten).walk())
+        self.measure('scan', len(entries), lambda: list(ZkScanner(kasten).walk()))
+        # load: read, frontmatter
+        files = [abs_file for abs_file, _, _ in entries]
+        self.measure('load', len(files), lambda: [frontmatter.loads(read(f)) for f in files])
+        posts = [frontmatter.loads(read(f)) for f in files]
+        contents = [parser.do_standardize(post.content) for post in posts if parser.check_joinable(post)]
+        # make_soup: render and parse tree
+        self.measure('make_soup', len(contents), lambda: [parser.make_soup(c) for c in contents])
+        soups = [parser.make_soup(c) for c in contents]
+        # section extraction, the parse tree not modified
+        self.measure('section', len(soups), lambda: [SectionTree(s, c) for s, c in zip(soups, contents)])
+        sections = [section for s, c in zip(soups, contents) for section in SectionTree(s, c)]
+        # cloze selection, without deletion, which modifies the parse tree
+        self.measure('do_cloze_selection', len(sections),
+                     lambda: [parser.do_cloze_selection(parser.parse_text_field_scope(s)) for s in sections])
+        # the collection stages work on the parse results
+        file_specs: list[FileSpec] = [parser.parse_file(abs_file, deck_name) for abs_file, deck_name, _ in entries]
+        file_specs = [spec for spec in file_specs if spec.joinable]
+        note_specs = [(note_spec, spec.deck_name) for spec in file_specs for note_spec in spec.notes]
+        media = [m for note_spec, _ in note_specs for m in note_spec.media]
+
+        def prepare() -> tuple[Collection, ClozeJoint, NoteWriter]:
+            col = Collection(self.fresh_collection_path())
+            joint = ClozeJoint()
+            joint.bind(col)
+            writer = NoteWriter(col)
+            joint.prepare_join(ZettelKasten(kasten, profile=PROFILE), writer=writer)
+            return col, joint, writer
+
+        def close(state: tuple[Collection, ClozeJoint, NoteWriter]):
+            state[0].close()
+
+        def import_media(state: tuple[Collection, ClozeJoint, NoteWriter]):
+            for img, std_name in media:
+                state[1].media_importer.import_file(img, std_name)
+
+        def add_notes(state: tuple[Collection, ClozeJoint, NoteWriter]):
+            _, joint, writer = state
+            for note_spec, deck_name in note_specs:
+                joint.join_note(note_spec, deck_name)
+                writer.flush_if_full()
+            writer.finish()
+
+        def prepare_added() -> tuple[Collection, ClozeJoint, NoteWriter]:
+            # the media imported untimed, so that note add is timed alone
+            state = prepare()
+            import_media(state)
+            return state
+
+        self.measure('media_import', len(media), import_media, prepare, close)
+        self.measure('note_add', len(note_specs), add_notes, prepare_added, close)
+
+        # write-back: comment the (fake) note ids after the headings, and write the file atomically
+        def write_back():
+            for spec in file_specs:
+                insertions = {n.line_start: f'<!-- NoteId: {FAKE_NOTE_ID} -->' for n in spec.notes if n.line_start >= 0}
+                with open(spec.abs_file, 'r', encoding='utf-8', newline='') as f:
+                    content = f.read()
+                ClozeJoint.write(insert_after_headings(content, insertions), spec.abs_file)
+
+        def restore(_):
+            for spec, content in originals:
+                with open(spec.abs_file, 'w', encoding='utf-8', newline='') as f:
+                    f.write(content)
+
+        originals = []
+        for spec in file_specs:
+            with open(spec.abs_file, 'r', encoding='utf-8', newline='') as f:
+                originals.append((spec, f.read()))
+        self.measure('write_back', len(file_specs), lambda _: write_back(), lambda: None, restore)
+
+    """ ========== ========== ========== ========== ========== ========== ========== ========== ========== ==========
+    end to end
+    """
+
+    def run_joins(self):
+        """
+        The headless join, 'cold' on a fresh collection and kasten, 'warm' joining the same again (all unchanged).
+        """
+        for name in ('cold', 'warm'):
+            seconds: list[float] = []
+            results: list[dict] = []
+            for _ in range(self.rounds):
+                kasten = self.fresh_kasten()
+                col_path = self.fresh_collection_path()
+                if name == 'warm':
+                    cli.join(kasten, col_path, profile=PROFILE)
+                t = time.perf_counter()
+                results.append(cli.join(kasten, col_path, profile=PROFILE))
+                seconds.append(time.perf_counter() - t)
+            files = results[0]['files']['scanned']
+            self.joins[name] = summarize(seconds, files)
+            # the stage timings of the median run
+            median_run = sorted(range(len(seconds)), key=seconds.__getitem__)[len(seconds) // 2]
+            self.joins[name].update({k: results[median_run][k] for k in ('notes', 'media', 'files', 'timings')})
+            print(f'join ({name}){"":13} {self.joins[name]["median"] * 1000:10.1f} ms'
+                  f' {self.joins[name]["per_item_ms"]:8.3f} ms/file ({files} files)')
+
+
+def summarize(seconds: list[float], items: int) -> dict:
+    median = statistics.median(seconds)
+    return {
+        'items': items,
+        'min': round(min(seconds), 6),
+        'median': round(median, 6),
+        'max': round(max(seconds), 6),
+        'per_item_ms': round(median / items * 1000, 6) if items else 0.0,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=TOOLS_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(result: dict, earlier: dict):
+    """
+    Print the median of this run against the earlier one
+    """
+    print(f'\nCompared with {earlier.get("commit") or "?"} ({earlier.get("created", "?")}):')
+    rows = [(k, v, earlier.get('stages', {}).get(k)) for k, v in result['stages'].items()]
+    rows += [(f'join ({k})', v, earlier.get('joins', {}).get(k)) for k, v in result['joins'].items()]
+    for name, now, before in rows:
+        if not before or not before['median']:
+            print(f'{name:20} {"":>10}    (no earlier result)')
+            continue
+        speedup = before['median'] / now['median'] if now['median'] else 0.0
+        print(f'{name:20} {before["median"] * 1000:10.1f} -> {now["median"] * 1000:10.1f} ms  x{speedup:.2f}')
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Benchmark the join.')
+    parser.add_argument('--kasten', help='benchmark an existing kasten (copied), instead of a generated one')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--stages', action=argparse.BooleanOptionalAction, default=True, help='run the stages')
+    parser.add_argument('--joins', action=argparse.BooleanOptionalAction, default=True, help='run the joins')
+    parser.add_argument('--out', help='the JSON file of the results, default to bench-results/<time>.json')
+    parser.add_argument('--compare', help='an earlier JSON file of the results to compare with')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log the warnings of the add-on to stderr')
+    # the generator options, for a generated kasten
+    add_options(parser.add_argument_group('generated kasten'))
+    return parser
+
+
+if __name__ == '__main__':
+    args = make_parser().parse_args()
+    logging.basicConfig(level=logging.WARNING if args.verbose else logging.CRITICAL, stream=sys.stderr)
+    created = datetime.datetime.now()
+    with tempfile.TemporaryDirectory(prefix='zk-bench-') as work_dir:
+        gen_options = None
+        kasten = args.kasten
+        if not kasten:
+            gen_options = options_of(args)
+            kasten = os.path.join(work_dir, 'kasten')
+            generator = KastenGenerator(**gen_options)
+            generator.generate(kasten)
+            print(f'Generated {generator.files} files, {generator.image_count} images.')
+        bench = Bench(kasten, work_dir, args.rounds)
+        if args.stages:
+            bench.run_stages()
+        if args.joins:
+            bench.run_joins()
+    result = {
+        'created': created.isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'kasten': os.path.abspath(args.kasten) if args.kasten else None,
+        'generator': gen_options,
+        'rounds': args.rounds,
+        'stages': bench.stages,
+        'joins': bench.joins,
+    }
+    out = args.out if args.out else os.path.join(RESULTS_DIR, f'{created:%Y%m%d-%H%M%S}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=1, ensure_ascii=False)
+    print(f'Results written to "{out}"')
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(result, json.load(f))
@@ -0,0 +1,51 @@
+"""
+Benchmark the markdown render pipeline,
+ building a new Markdown instance per file vs. reusing the render engine.
+"""
+
+import os
+import sys
+import timeit
+
+import markdown
+
+# render.py doesn't depend on Anki, import it directly from the add-on dir
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../zettel_join'))
+from render import RenderEngine, make_extensions  # noqa: E402
+
+
+SAMPLE_DIRS = ['../zettel_join/doc/ex', '../zettel_join/test/sync-test']
+ROUNDS = 200
+
+
+def load_samples() -> list[str]:
+    samples: list[str] = []
+    tools_dir = os.path.dirname(os.path.abspath(__file__))
+    for sample_dir in SAMPLE_DIRS:
+        for root, dirs, files in os.walk(os.path.join(tools_dir, sample_dir)):
+            for file in files:
+                if file.endswith('.md'):
+                    with open(os.path.join(root, file), 'r', encoding='utf-8') as f:
+                        samples.append(f.read())
+    return samples
+
+
+def render_fresh(content: str) -> str:
+    # the former way: a whole new Markdown instance with new extensions per file
+    return markdown.markdown(content, extensions=make_extensions())
+
+
+if __name__ == '__main__':
+    samples = load_samples()
+    engine = RenderEngine()
+    # output must be identical
+    for sample in samples:
+        assert render_fresh(sample) == engine.render(sample), 'render output differs'
+    print(f'Output check: {len(samples)} samples identical.')
+
+    fresh = timeit.timeit(lambda: [render_fresh(s) for s in samples], number=ROUNDS)
+    reused = timeit.timeit(lambda: [engine.render(s) for s in samples], number=ROUNDS)
+    n = ROUNDS * len(samples)
+    print(f'Fresh Markdown per file: {fresh / n * 1000:.3f} ms/file')
+    print(f'Reused render engine:    {reused / n * 1000:.3f} ms/file')
+    print(f'Speedup: {fresh / reused:.2f}x')
@@ -0,0 +1,170 @@
+"""
+Generate a synthetic ZettelKasten for benchmarks,
+ with configurable files, directory depth, headings, clozes, tables, math blocks, fenced code and images.
+The output is deterministic for the same options and seed.
+
+    python gen_kasten.py <out_dir> --files 1000 --depth 3
+"""
+
+import argparse
+import os
+import random
+import struct
+import zlib
+
+WORDS = ('zettel kasten note card slip box idea link index topic source claim evidence question answer '
+         'memory recall review spaced repetition concept theory method example context summary').split()
+
+
+def make_png(seed: int) -> bytes:
+    """
+    A tiny valid PNG (1x1 pixel), whose color differs with the seed
+    """
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    r, g, b = seed & 0xff, (seed >> 8) & 0xff, (seed >> 16) & 0xff
+    raw = zlib.compress(bytes([0, r, g, b]))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', raw) + chunk(b'IEND', b''))
+
+
+class KastenGenerator:
+    """
+    Write a synthetic kasten, every option is per file or per heading on average.
+    """
+
+    def __init__(self, files: int = 100, depth: int = 2, fan_out: int = 4, headings: int = 8, clozes: int = 3,
+                 tables: float = 0.2, math: float = 0.2, code: float = 0.2, images: float = 0.1,
+                 prose: float = 0.3, seed: int = 0):
+        """
+        :param files: how many MD files
+        :param depth: the depth of the directories
+        :param fan_out: how many sub-directories per directory
+        :param headings: headings per file
+        :param clozes: clozes per heading
+        :param tables: tables per heading
+        :param math: math blocks per heading
+        :param code: fenced code blocks per heading
+        :param images: images per heading
+        :param prose: the ratio of the files without 'note-type' (not joinable)
+        :param seed: random seed
+        """
+        self.files = files
+        self.depth = depth
+        self.fan_out = fan_out
+        self.headings = headings
+        self.clozes = clozes
+        self.tables = tables
+        self.math = math
+        self.code = code
+        self.images = images
+        self.prose = prose
+        self.rand = random.Random(seed)
+        self.image_count = 0
+
+    def words(self, n: int) -> str:
+        return ' '.join(self.rand.choice(WORDS) for _ in range(n))
+
+    def times(self, mean: float) -> int:
+        """
+        Round the mean randomly, so that the average is kept
+        """
+        n = int(mean)
+        return n + (1 if self.rand.random() < mean - n else 0)
+
+    def directories(self) -> list[str]:
+        dirs: list[str] = ['']
+        level: list[str] = ['']
+        for d in range(self.depth):
+            level = [os.path.join(parent, f'topic-{d}-{i}') for parent in level for i in range(self.fan_out)]
+            dirs += level
+        return dirs
+
+    def section(self, path: list[int], level: int, file_dir: str) -> list[str]:
+        lines: list[str] = ['#' * level + ' ' + self.words(3).title() + ' ' + '.'.join(map(str, path)), '']
+        sentences: list[str] = []
+        for _ in range(self.clozes):
+            marker = self.rand.choice(['**', '*'])
+            sentences.append(f'{self.words(6)} {marker}{self.words(2)}{marker} {self.words(4)}.')
+        lines += [' '.join(sentences), '']
+        for _ in range(self.times(self.tables)):
+            lines += ['| term | meaning |', '| ---- | ------- |']
+            lines += [f'| {self.words(1)} | {self.words(4)} |' for _ in range(3)]
+            lines.append('')
+        for _ in range(self.times(self.math)):
+            lines += ['$$', r'\sum_{i=1}^{n} x_i^2 = \frac{n(n+1)(2n+1)}{6}', '$$', '']
+        for _ in range(self.times(self.code)):
+            lines += ['```python', 'def f(x):', '    return x * 2  # **not a cloze**', '```', '']
+        for _ in range(self.times(self.images)):
+            self.image_count += 1
+            name = f'img-{self.image_count}.png'
+            with open(os.path.join(file_dir, name), 'wb') as f:
+                f.write(make_png(self.image_count))
+            lines += [f'![{self.words(1)}]({name})', '']
+        lines += ['> ' + self.words(10), '']
+        return lines
+
+    def file_content(self, file_dir: str) -> str:
+        lines: list[str] = []
+        if self.rand.random() >= self.prose:
+            lines += ['---', 'note-type: cloze', f'title: {self.words(3)}', '---', '']
+        else:
+            lines += ['---', f'title: {self.words(3)}', '---', '']
+        h1 = 0
+        for n in range(self.headings):
+            # a h1 every 4 headings, h2 in between
+            if n % 4 == 0:
+                h1 += 1
+                lines += self.section([h1], 1, file_dir)
+            else:
+                lines += self.section([h1, n % 4], 2, file_dir)
+        return '\n'.join(lines)
+
+    def generate(self, out_dir: str):
+        os.makedirs(os.path.join(out_dir, '.root'), exist_ok=True)
+        dirs = self.directories()
+        for d in dirs:
+            os.makedirs(os.path.join(out_dir, d), exist_ok=True)
+        for n in range(self.files):
+            file_dir = os.path.join(out_dir, dirs[n % len(dirs)])
+            with open(os.path.join(file_dir, f'note-{n:06d}.md'), 'w', encoding='utf-8') as f:
+                f.write(self.file_content(file_dir))
+
+
+def add_options(parser: argparse.ArgumentParser):
+    """
+    Add the generator options, shared with the benchmark
+    """
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--fan-out', type=int, default=4)
+    parser.add_argument('--headings', type=int, default=8)
+    parser.add_argument('--clozes', type=int, default=3)
+    parser.add_argument('--tables', type=float, default=0.2)
+    parser.add_argument('--math', type=float, default=0.2)
+    parser.add_argument('--code', type=float, default=0.2)
+    parser.add_argument('--images', type=float, default=0.1)
+    parser.add_argument('--prose', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def options_of(args: argparse.Namespace) -> dict:
+    """
+    The generator options out of the parsed arguments
+    """
+    names = KastenGenerator.__init__.__code__.co_varnames[1:KastenGenerator.__init__.__code__.co_argcount]
+    return {name: getattr(args, name) for name in names}
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Generate a synthetic ZettelKasten.')
+    parser.add_argument('out_dir')
+    add_options(parser)
+    return parser
+
+
+if __name__ == '__main__':
+    args = make_parser().parse_args()
+    generator = KastenGenerator(**options_of(args))
+    generator.generate(args.out_dir)
+    print(f'Generated {args.files} files, {generator.image_count} images in "{args.out_dir}"')
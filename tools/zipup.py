@@ -15,13 +15,13 @@ ADDON_PACKAGE_NAME = f'zettel-join.ankiaddon'
 # noinspection PyUnusedLocal
 def zip_filter(path: str, names: list[str]) -> list[str]:
     """
-    Filter out the test, lib and __pycache__ directory.
+    Filter out the test, lib and __pycache__ directory, and the join report of the last join.
     Besides, AnkiWeb can not accept zip files that contain pycache folders.
     :param path: root directory path, as 'root' in 'os.walk'
     :param names: name list of files and dirs
     :return: filtered name list of files and dirs
     """
-    filter_out: list[str] = ['__pycache__', 'lib', 'test']
+    filter_out: list[str] = ['__pycache__', 'lib', 'test', 'join-report.json', 'join-plan.json']
     return [item for item in filter_out if item in names]
 
 
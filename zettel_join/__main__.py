@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+Headless entry point, see cli.py
+"""
+
+import sys
+
+from .cli import main
+
+# guarded, the parse workers import this module again
+if __name__ == '__main__':
+    sys.exit(main())
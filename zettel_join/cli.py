@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+Command-line interface
+Join a ZK to a collection file headless, without the Anki GUI:
+    python -m zettel_join join <kasten> --collection path/to/collection.anki2
+The counts and timings are written to stdout as JSON, so is the plan of a dry run (--dry-run).
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any
+
+from anki.collection import Collection
+
+from . import config
+from .joint import Dispatcher, get_joints
+from .plan import JoinPlan
+from .timing import JoinReport
+from .writer import NoteWriter
+from .zk import ZettelKasten
+
+
+logger = logging.getLogger(__name__)
+
+
+def default_profile(collection: str) -> str:
+    """
+    The profile name of the collection, which is its folder name in Anki's base folder,
+     so that the manifest is shared with the joins inside Anki.
+    :param collection: The path of the collection file
+    """
+    return os.path.basename(os.path.dirname(os.path.abspath(collection)))
+
+
+def join(kasten: str, collection: str, profile: str = None, force_rescan: bool = False,
+         update: bool = False, dry_run: bool = False) -> dict[str, Any]:
+    """
+    Join the ZK to the collection file, synchronously.
+    :param kasten: ZK directory path
+    :param collection: The path of the collection file
+    :param profile: The Anki profile name, for the manifest and the config. Default to the collection's folder name
+    :param force_rescan: join every file, even if unchanged since last join
+    :param update: update the imported notes whose fields differ from the MD files
+    :param dry_run: plan the join only, the collection and the files untouched
+    :return: the counts and timings (in seconds) of the join, with the plan if dry run
+    """
+    profile = profile if profile else default_profile(collection)
+    timings: dict[str, float] = dict.fromkeys(['open', 'scan', 'parse', 'join', 'finish'], 0.0)
+    start = time.perf_counter()
+    zk = ZettelKasten(kasten, profile=profile)
+    if not zk.path:
+        raise ValueError(f'not a ZK (".root" folder missing): "{kasten}"')
+    col = Collection(collection)
+    try:
+        # all the notes are written in bulk, as a single undoable operation
+        report = JoinReport()
+        plan = JoinPlan() if dry_run else None
+        writer = NoteWriter(col, report=report) if not dry_run else None
+        # a dry run only looks the models up, without creating them
+        joints = get_joints(col, create_models=not dry_run)
+        for joint in joints:
+            joint.prepare_join(zk, force_rescan=force_rescan, writer=writer, update=update, report=report,
+                               plan=plan)
+        timings['open'] = time.perf_counter() - start
+        joined = 0
+        t = time.perf_counter()
+        # one scan for all the joints, each file dispatched to the joint of its note type
+        dispatcher = Dispatcher(joints)
+        jobs_of_joints = dispatcher.scan()
+        timings['scan'] = time.perf_counter() - t
+        for joint, jobs in jobs_of_joints:
+            files = iter(joint.parse_zk(jobs))
+            while True:
+                t = time.perf_counter()
+                file_spec = next(files, None)
+                timings['parse'] += time.perf_counter() - t
+                if file_spec is None:
+                    break
+                t = time.perf_counter()
+                joint.join_file(file_spec)
+                joined += 1
+                timings['join'] += time.perf_counter() - t
+        t = time.perf_counter()
+        for joint in joints:
+            joint.finish_join()
+        if writer:
+            writer.finish()
+        timings['finish'] = time.perf_counter() - t
+    finally:
+        col.close()
+    timings['total'] = time.perf_counter() - start
+    report.finish()
+    stages = report.to_dict(zk.path)
+    result = {
+        'kasten': os.path.abspath(kasten),
+        'collection': os.path.abspath(collection),
+        'profile': profile,
+        'notes': {
+            'added': sum(joint.new_notes_count for joint in joints),
+            'updated': sum(joint.updated_notes_count for joint in joints),
+            'orphans': sum(len(joint.orphan_note_ids) for joint in joints),
+        },
+        'media': {
+            'imported': sum(joint.media_importer.new_count for joint in joints),
+        },
+        'files': {
+            'scanned': dispatcher.scanned,
+            'joined': joined,
+            'hits': sum(joint.manifest.hits for joint in joints),
+            'misses': sum(joint.manifest.misses for joint in joints),
+            'invalidated': sum(joint.manifest.invalidated for joint in joints),
+        },
+        'timings': {stage: round(seconds, 4) for stage, seconds in timings.items()},
+        # where the time went, by stage and the slowest files
+        'stages': stages['stages'],
+        'slowest_files': stages['slowest_files'],
+    }
+    if plan:
+        result['plan'] = plan.to_dict(zk.path)
+    return result
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m zettel_join', description='Join your ZettelKästen to Anki.')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='log to stderr, -v for info, -vv for debug')
+    commands = parser.add_subparsers(dest='command', required=True)
+    join_parser = commands.add_parser('join', help='join a ZK to a collection file')
+    join_parser.add_argument('kasten', help='ZK directory path, which contains a ".root" folder')
+    join_parser.add_argument('-c', '--collection', required=True, help='the collection file (.anki2), '
+                                                                       'which must not be opened in Anki meanwhile')
+    join_parser.add_argument('-p', '--profile', help="the profile name for the manifest and the config, "
+                                                     "default to the collection's folder name")
+    join_parser.add_argument('--force-rescan', action='store_true',
+                             help='join every file, even if unchanged since last join')
+    join_parser.add_argument('--update', action='store_true',
+                             help='update the imported notes whose fields differ from the MD files')
+    join_parser.add_argument('--remove-orphans', action='store_true',
+                             help='remove the notes whose headings have disappeared, with --update only')
+    join_parser.add_argument('--dry-run', action='store_true',
+                             help='print the plan of the join, without touching the collection or the files')
+    join_parser.add_argument('-w', '--workers', type=int, help='how many worker processes to parse with')
+    return parser
+
+
+def main(argv: list[str] = None) -> int:
+    args = make_parser().parse_args(argv)
+    level = [logging.WARNING, logging.INFO, logging.DEBUG][min(args.verbose, 2)]
+    logging.basicConfig(level=level, stream=sys.stderr, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    profile = args.profile if args.profile else default_profile(args.collection)
+    # the same configs as inside Anki, overridden by the arguments
+    config.load_json_config(profile)
+    if args.workers is not None:
+        config.config['parse_workers'] = args.workers
+    if args.remove_orphans:
+        config.config['remove_orphans'] = True
+    try:
+        result = join(args.kasten, args.collection, profile=profile, force_rescan=args.force_rescan,
+                      update=args.update, dry_run=args.dry_run)
+    except ValueError as e:
+        logger.error(f'ZK-join: error, {e}')
+        print(json.dumps({'error': str(e)}))
+        return 1
+    except Exception as e:
+        logger.exception(f'ZK-join: error, {e}')
+        print(json.dumps({'error': str(e)}))
+        return 1
+    print(json.dumps(result, indent=1, ensure_ascii=False))
+    return 0
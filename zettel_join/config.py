@@ -3,8 +3,6 @@ import os
 import json
 from typing import Any
 
-from aqt import mw, gui_hooks
-
 logger = logging.getLogger(__name__)
 
 
@@ -16,14 +14,50 @@ ConfigDict = dict[str, Any]
 
 config: ConfigDict = {}
 
+# default values of the configs which are not set yet
+DEFAULT_CONFIG: ConfigDict = {
+    # Level of the log file: 'DEBUG' logs every heading and image, which slows down big joins
+    'log_level': 'INFO',
+    # Cloze selection rules, in the order of cloze numbers: the tags (with the CSS class, optional) to cloze-delete
+    'cloze_rules': [
+        {'tags': ['strong', 'em', 'td', 'li']},
+        {'tags': ['div'], 'class': 'arithmatex'},
+    ],
+    # Cloze selection: the tags whose contents never get cloze-deleted
+    'cloze_excluded_tags': ['blockquote'],
+    # How many worker processes to parse MD files with, 0 or 1 means parsing in the main process
+    'parse_workers': 0,
+    # MB of memory to parse a file with, the bigger files are parsed in chunks of sections, 0 means no limit
+    'parse_memory_budget': 256,
+    # Update the imported notes whose fields differ from the MD files
+    'update_notes': False,
+    # Remove the notes whose headings have disappeared from the ZK, in update mode only
+    'remove_orphans': False,
+    # Watch mode: milliseconds to wait after the last change before joining
+    'watch_debounce': 1000,
+    # Watch mode: milliseconds between two polls of the directories that can't be watched
+    'watch_poll_interval': 5000,
+}
+
 
-def load_json_config():
+def get_config(key: str) -> Any:
+    """
+    Get the config value, or the default if not set
+    """
+    return config.get(key, DEFAULT_CONFIG.get(key))
+
+
+def load_json_config(profile_name: str = None):
     """
     Load previous config from json file
+    :param profile_name: The Anki profile whose config is loaded, the opened profile if None
     """
+    if profile_name is None:
+        from aqt import mw  # inside Anki only, the add-on works headless as well
+        profile_name = mw.pm.name
     config_json_file: str = os.path.join(
         os.path.dirname(os.path.abspath(__file__)),
-        f'config@{mw.pm.name.replace(" ", "-")}.json'
+        f'config@{profile_name.replace(" ", "-")}.json'
     )
 
     global config
@@ -46,6 +80,3 @@ def save_json_config():
     with open(config['config_json_file'], 'w') as f:
         f.write(json.dumps(config, indent=4))
 
-
-gui_hooks.profile_did_open.append(load_json_config)
-gui_hooks.profile_will_close.append(save_json_config)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+Deck cache
+Resolve the deck names of the join to ids from one query of the collection's decks, rather than a lookup per note.
+"""
+
+import logging
+from typing import Optional
+
+from anki.collection import Collection
+from anki.decks import DeckId
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeckCache:
+    """
+    The ids of the collection's decks by name, loaded at once.
+    A missing deck is created (with its parents) on its first note, and cached then.
+    Invalidated when the decks are renamed or removed in Anki, the next lookup loads them again.
+    """
+
+    col: Collection
+    ids: Optional[dict[str, DeckId]]  # casefolded deck name -> deck id, None if not loaded
+    created: list[str]  # the decks created by the join
+
+    def __init__(self, col: Collection):
+        self.col = col
+        self.ids = None
+        self.created = []
+
+    @staticmethod
+    def key(deck_name: str) -> str:
+        # deck names are case-insensitive in Anki
+        return deck_name.casefold()
+
+    def load(self):
+        """
+        Load the names and ids of all the decks, in one backend call
+        """
+        self.ids = {self.key(deck.name): DeckId(deck.id) for deck in self.col.decks.all_names_and_ids()}
+        logger.debug('Deck-cache: %d decks loaded.', len(self.ids))
+
+    def invalidate(self):
+        if self.ids is not None:
+            logger.info('Deck-cache: decks changed in Anki, cache invalidated.')
+        self.ids = None
+
+    def lookup(self, deck_name: str) -> Optional[DeckId]:
+        """
+        Find the deck, without creating it
+        :return: the deck id, None if not in the collection
+        """
+        if self.ids is None:
+            self.load()
+        return self.ids.get(self.key(deck_name))
+
+    def get(self, deck_name: str) -> DeckId:
+        """
+        Find the deck, or create it (with its parents) if not in the collection
+        :return: the deck id
+        """
+        deck_id = self.lookup(deck_name)
+        if deck_id is None:
+            # also found here if the name differs from the collection's only by Anki's normalization
+            deck_id = self.col.decks.id(deck_name)
+            # loaded again with the parents created, new decks are few
+            self.load()
+            self.ids[self.key(deck_name)] = deck_id
+            self.created.append(deck_name)
+            logger.info(f'Deck-cache: deck "{deck_name}" created, id {deck_id}')
+        return deck_id
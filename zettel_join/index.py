@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+Note index
+The notes of the model in the collection, loaded with one query at the start of the join,
+ which answers the existence and duplicate checks without a round trip for each note.
+"""
+
+import logging
+from typing import Container, Iterable, Optional
+
+from anki.collection import Collection
+from anki.decks import DeckId
+from anki.models import NotetypeDict as Model
+
+
+logger = logging.getLogger(__name__)
+
+
+class NoteIndex:
+    """
+    The notes of a model by id, and by deck and 'root' field.
+    A note whose NoteId comment is lost from the MD file is found by its deck and root,
+     rather than joined again as a duplicate.
+    """
+
+    col: Collection
+    model: Model
+    by_id: dict[int, tuple[Optional[DeckId], str]]  # note id -> (deck id of its first card, root)
+    by_root: dict[tuple[DeckId, str], list[int]]  # (deck id, root) -> note ids, in the order of creation
+    tags: dict[int, list[str]]  # note id -> tags, the notes with tags only
+    owned: set[int]  # the notes recorded for the ZK files, matched only to the sections of their own files
+    claimed: set[int]  # the notes already found in the MD files in the present join
+    stale: bool  # the notes changed in Anki since loaded, to load again
+
+    def __init__(self, col: Collection, model: Model):
+        self.col = col
+        self.model = model
+        self.by_id = {}
+        self.by_root = {}
+        self.tags = {}
+        self.owned = set()
+        self.claimed = set()
+        self.stale = True
+
+    def load(self, owned: Iterable[int] = ()):
+        """
+        Load the notes of the model, in one query
+        :param owned: the ids of the notes recorded for the ZK files
+        """
+        root_ord: int = self.col.models.field_map(self.model)['root'][0]
+        # only the root field is read out of the note fields (separated by \x1f), if it's the first
+        root_sql = "substr(n.flds, 1, instr(n.flds || char(31), char(31)) - 1)" if root_ord == 0 else 'n.flds'
+        # the deck of the note is the deck of its first card, a bare column of min() is taken from the same row
+        rows = self.col.db.all(f'select n.id, {root_sql}, n.tags, c.did, min(c.ord) from notes n '
+                               f'left join cards c on c.nid = n.id where n.mid = ? group by n.id order by n.id',
+                               self.model['id'])
+        self.by_id, self.by_root, self.tags = {}, {}, {}
+        for note_id, root, tags, deck_id, _ in rows:
+            if root_ord:
+                root = root.split('\x1f')[root_ord]
+            self.by_id[note_id] = (deck_id, root)
+            if deck_id is not None:
+                self.by_root.setdefault((deck_id, root), []).append(note_id)
+            if tags.strip():
+                self.tags[note_id] = tags.split()
+        self.owned = set(owned)
+        self.claimed = set()
+        self.stale = False
+        logger.info(f'Note-index: {len(self.by_id)} notes of model "{self.model["name"]}" loaded.')
+
+    def invalidate(self):
+        if not self.stale:
+            logger.info('Note-index: notes changed in Anki, index invalidated.')
+        self.stale = True
+
+    def restart(self, owned: Iterable[int] = ()):
+        """
+        Start another join with the notes kept, e.g. in watch mode, rather than load them again
+        :param owned: the ids of the notes recorded for the ZK files
+        """
+        self.owned = set(owned)
+        self.claimed = set()
+
+    # kept up to date with the notes written by the join, for the next join to start with
+
+    def add(self, note_id: int, deck_id: Optional[DeckId], root: str):
+        """
+        The note added by the join
+        """
+        self.by_id[note_id] = (deck_id, root)
+        if deck_id is not None:
+            self.by_root.setdefault((deck_id, root), []).append(note_id)
+
+    def rename(self, note_id: int, root: str):
+        """
+        The 'root' field of the note updated by the join
+        """
+        deck_id, old_root = self.by_id.get(note_id, (None, ''))
+        same_root = self.by_root.get((deck_id, old_root))
+        if same_root and note_id in same_root:
+            same_root.remove(note_id)
+        self.by_id[note_id] = (deck_id, root)
+        if deck_id is not None:
+            self.by_root.setdefault((deck_id, root), []).append(note_id)
+
+    def remove(self, note_ids: Iterable[int]):
+        """
+        The notes removed by the join
+        """
+        for note_id in note_ids:
+            deck_id, root = self.by_id.pop(note_id, (None, ''))
+            same_root = self.by_root.get((deck_id, root))
+            if same_root and note_id in same_root:
+                same_root.remove(note_id)
+            self.tags.pop(note_id, None)
+
+    def add_tag(self, note_ids: Iterable[int], tag: str):
+        """
+        The notes tagged by the join
+        """
+        for note_id in note_ids:
+            tags = self.tags.setdefault(note_id, [])
+            if tag.casefold() not in (t.casefold() for t in tags):
+                tags.append(tag)
+
+    def __contains__(self, note_id: int) -> bool:
+        return note_id in self.by_id
+
+    def claim(self, note_ids: Iterable[int]):
+        """
+        The notes are found in the MD files, not to be matched to the other sections
+        """
+        self.claimed.update(note_ids)
+
+    def match(self, deck_id: Optional[DeckId], root: str, own: Container[int] = ()) -> Optional[int]:
+        """
+        Find the note of the section without NoteId comment, and claim it.
+        :param deck_id: the deck of the MD file, None if not in the collection
+        :param root: the heading path of the section
+        :param own: the ids of the notes recorded for the MD file
+        :return: the note id, None if not in the collection, or claimed already
+        """
+        if deck_id is None:
+            return None
+        for note_id in self.by_root.get((deck_id, root), ()):
+            if note_id not in self.claimed and (note_id in own or note_id not in self.owned):
+                self.claimed.add(note_id)
+                return note_id
+        return None
+
+    def with_tag(self, tag: str) -> list[int]:
+        """
+        The notes with the tag, or its child tags, case-insensitive as Anki's search 'tag:'
+        """
+        tag = tag.casefold()
+        return [note_id for note_id, tags in self.tags.items()
+                if any(t.casefold() == tag or t.casefold().startswith(tag + '::') for t in tags)]
@@ -6,32 +6,45 @@
 A joint is an import handler, which corresponds to a special file-format as well as a model.
 """
 
-import copy
-import emojis
 import frontmatter
+import functools
+import hashlib
 import logging
-import markdown
 import os
 import re
 import shutil
+from typing import Iterator, Optional
 
-from bs4 import BeautifulSoup, Tag, NavigableString, Comment, ResultSet
-from markdown.extensions import tables
-from pymdownx import arithmatex, superfences
-
-from aqt import mw, gui_hooks
-from aqt.utils import showInfo
+from anki.collection import Collection
 from anki.decks import DeckId
+from anki.errors import NotFoundError
 from anki.models import ModelManager, MODEL_CLOZE
 from anki.models import NotetypeDict as Model
 from anki.models import TemplateDict as Template
 from anki.notes import Note, NoteId
 
+from .config import get_config
+from .deck import DeckCache
+from .index import NoteIndex
+from .manifest import Manifest
+from .media import MediaImporter
+from .parse import ClozeParser, ClozeSelector, FileSpec, NoteSpec, budget_chars, parse_files, read, sniff_note_type
+from .plan import JoinPlan
+from .scan import ZkScanner
+from .section import insert_after_headings, rekey_section
+from .timing import JoinReport
+from .writer import NoteWriter
 from .zk import ZettelKasten
 
 
 logger = logging.getLogger(__name__)
 
+# card templates and css of the models
+TPL_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tpl')
+
+# the 'src' attribute value of <img> tag
+IMG_SRC_RE = re.compile(r'(<img\b[^>]*?\ssrc=")[^"]*')
+
 
 class FileId(int):
     ...
@@ -43,16 +56,53 @@ class Joint:
     """
 
     model_name: str
+    model: Model = None  # the model in the collection, None if missing and not to create
+    col: Collection = None  # the collection joined to, injected (mw.col inside Anki)
     new_notes_count: int
+    updated_notes_count: int
+    orphan_note_ids: list[int]  # the notes whose headings have disappeared from the ZK
+    manifest: Manifest = None
+    writer: NoteWriter = None
+    media_importer: MediaImporter = None
+    decks: DeckCache = None  # the deck ids by name, loaded at the start of the join
+    note_index: NoteIndex = None  # the notes of the model, loaded at the start of the join
+    report: JoinReport = None  # timings of the join stages
+    plan: JoinPlan = None  # what the join would do, if a dry run, which writes nothing
+    force_rescan: bool = False
+    update: bool = False  # update the imported notes as well
+    paths: list[str] = None  # the part of ZK to scan, None for the whole
 
     def __init__(self):
         self.new_notes_count = 0
-        gui_hooks.profile_did_open.append(self.check_model)
+        self.updated_notes_count = 0
+        self.orphan_note_ids = []
 
-    def join_zk(self, zk: ZettelKasten = None, test_mode: bool = False) -> int:
+    def bind(self, col: Collection, create_model: bool = True):
+        """
+        Set the collection to join to, and make sure the model exists in it.
+        :param create_model: create the model if missing, otherwise only look it up, e.g. for a dry run
+        """
+        self.col = col
+        self.check_model(create=create_model)
+
+    def join_zk(self, zk: ZettelKasten = None, test_mode: bool = False, force_rescan: bool = False,
+                writer: NoteWriter = None, update: bool = False, dry_run: bool = False) -> int:
         ...
 
-    def check_model(self, zk: ZettelKasten = None, test_mode: bool = False) -> int: ...
+    # the stages of a join, see ClozeJoint.join_zk(), the files are scanned for all the joints by Dispatcher
+    def prepare_join(self, zk: ZettelKasten, test_mode: bool = False, force_rescan: bool = False,
+                     writer: NoteWriter = None, paths: list[str] = None, update: bool = False,
+                     report: JoinReport = None, plan: JoinPlan = None): ...
+
+    def match_note_type(self, note_type: str) -> bool: ...
+
+    def parse_zk(self, jobs: list[tuple[str, str, Optional[str]]]) -> Iterator[FileSpec]: ...
+
+    def join_file(self, file_spec: FileSpec) -> int: ...
+
+    def finish_join(self, partial: bool = False): ...
+
+    def check_model(self, zk: ZettelKasten = None, test_mode: bool = False, create: bool = True) -> int: ...
 
 
 class MdJoint(Joint):
@@ -66,25 +116,26 @@ class MdJoint(Joint):
         """
         Build up the model and add it to Anki yet
         """
-        mm: ModelManager = mw.col.models
+        mm: ModelManager = self.col.models
         m: Model = mm.new(self.model_name)
         # Add fields
         for fld_name in ['Front', 'Back']:
-            fld = mm.newField(fld_name)
+            fld = mm.new_field(fld_name)
             fld['size'] = 15
             fld['plainText'] = True
-            mm.addField(m, fld)
+            mm.add_field(m, fld)
         # Add card template
-        t: Template = mm.newTemplate('Card 1')
+        t: Template = mm.new_template('Card 1')
         t['qfmt'] = "{{Front}}"
         t['afmt'] = "{{FrontSide}}\n\n<hr id=answer>\n\n{{Back}}"
-        mm.addTemplate(m, t)
+        mm.add_template(m, t)
         # Add css
-        m['css'] = self.read('tpl/basic.css')
+        m['css'] = self.read(os.path.join(TPL_DIR, 'basic.css'))
         # Add the Model (NoteTypeDict) to Anki
         mm.add_dict(notetype=m)
 
-    def join_zk(self, zk: ZettelKasten = None, test_mode: bool = False):
+    def join_zk(self, zk: ZettelKasten = None, test_mode: bool = False, force_rescan: bool = False,
+                writer: NoteWriter = None):
         ...
 
     @staticmethod
@@ -94,38 +145,41 @@ class MdJoint(Joint):
         :param file: The path of the file to read from.
         :return: The text content of the file.
         """
-        try:
-            with open(file, 'r', encoding='utf-8') as f:
-                file_content = f.read()
-                logger.debug(f'File read: done, filepath "{file}"')
-                return file_content
-        except FileNotFoundError:
-            logger.error(f'File read: error, file not found, filepath "{file}"')
-        except IOError as e:
-            logger.error(f'File read: error, {e}, filepath "{file}"')
-        return ''
+        return read(file)
 
     def load(self, file: str) -> frontmatter.Post:
         post = frontmatter.loads(self.read(file))
-        logger.debug(f'File load: Done, frontmatter metadata of above file is {post.metadata}')
+        logger.debug('File load: Done, frontmatter metadata of above file is %s', post.metadata)
         return post
 
     @staticmethod
-    def write(content: str, file: str):
+    def write(content: str, file: str) -> Optional[os.stat_result]:
         """
-        Write text content to a file.
+        Write text content to a file atomically: write a temp file aside, then replace the file with it.
+        The content is written as it is, without newline translation.
         :param content: The text content waiting to write to the file.
         :param file: The path of the file to write to.
+        :return: The stat of the file written, None if failed
         """
+        tmp_file = f'{file}.{os.getpid()}.tmp'
         try:
-            with open(file, 'w', encoding='utf-8') as f:
+            with open(tmp_file, 'w', encoding='utf-8', newline='') as f:
                 f.write(content)
-            logger.debug(f'File-write done: "{file}"')
+            if os.path.exists(file):
+                shutil.copymode(file, tmp_file)
+            # the stat of the content written, replacing keeps it, whatever happens to the file after
+            stat = os.stat(tmp_file)
+            os.replace(tmp_file, file)
+            logger.debug('File-write done: "%s"', file)
+            return stat
         except Exception as e:
             logger.error(f'File-write error: "{file}" {e}')
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            return None
 
     def dump(self, post: frontmatter.Post, file: str):
-        self.write(frontmatter.dumps(post), self.read(file))
+        self.write(frontmatter.dumps(post), file)
 
 
 class ClozeJoint(MdJoint):
@@ -133,8 +187,7 @@ class ClozeJoint(MdJoint):
     model: Model = None
     model_name: str = 'ZK cloze'
 
-    # temp
-    handling_content: str
+    parser: ClozeParser = None
 
     """
     Initialize
@@ -142,10 +195,12 @@ class ClozeJoint(MdJoint):
 
     def __init__(self):
         super().__init__()
+        self.parser = ClozeParser(self.model_name)
 
-    def check_model(self, model_name: str = None, test_mode: bool = False) -> bool:
+    def check_model(self, model_name: str = None, test_mode: bool = False, create: bool = True) -> bool:
         """
         verify if model exists, create model if not
+        :param create: create the model if missing, otherwise leave self.model None, e.g. for a dry run
         :return: False while error happens, otherwise True
         """
         model_name = model_name if model_name else self.model_name
@@ -155,11 +210,15 @@ class ClozeJoint(MdJoint):
         if test_mode:
             self.model_name += ' (test)'
         # Create model if not exists
-        m = mw.col.models.byName(self.model_name)
+        m = self.col.models.by_name(self.model_name)
         if m:
             logger.info(f'Create model: model already exists, model name "{self.model_name}"')
             self.model = m
             return True
+        elif not create:
+            self.model = None
+            logger.info(f'Create model: model "{self.model_name}" not in the collection, left to the join')
+            return True
         else:
             self.create_model(model_name=self.model_name)
             logger.info(f'Create model: Done, model name "{self.model_name}"')
@@ -169,7 +228,7 @@ class ClozeJoint(MdJoint):
         model_name = self.model_name if not model_name else model_name
         logger.info(f'Create model: begin, model name "{model_name}"')
         # create model if not exist
-        mm: ModelManager = mw.col.models  # Using model manager is the only way to add new model
+        mm: ModelManager = self.col.models  # Using model manager is the only way to add new model
         m: Model = mm.new(model_name)
         fields: list[str] = [
             'root',  # the header path inside MD file
@@ -179,18 +238,17 @@ class ClozeJoint(MdJoint):
         m["type"] = MODEL_CLOZE  # as cloze type
         # Add fields
         for fld_name in fields:
-            fld = mm.newField(fld_name)
+            fld = mm.new_field(fld_name)
             fld['size'] = 15
             fld['plainText'] = True
-            mm.addField(m, fld)
+            mm.add_field(m, fld)
         mm.set_sort_index(m, fields.index('root'))
-        # Add card template and css using relative path
-        os.chdir(os.path.dirname(os.path.abspath(__file__)))
-        t: Template = mm.newTemplate('Cloze')
-        t['qfmt'] = self.read('tpl/cloze_front.html')
-        t['afmt'] = self.read('tpl/cloze_back.html')
-        mm.addTemplate(m, t)
-        m['css'] = self.read('tpl/cloze.css')
+        # Add card template and css
+        t: Template = mm.new_template('Cloze')
+        t['qfmt'] = self.read(os.path.join(TPL_DIR, 'cloze_front.html'))
+        t['afmt'] = self.read(os.path.join(TPL_DIR, 'cloze_back.html'))
+        mm.add_template(m, t)
+        m['css'] = self.read(os.path.join(TPL_DIR, 'cloze.css'))
         # Add the Model (NoteTypeDict) to Anki
         mm.add_dict(notetype=m)
         self.model = mm.by_name(model_name)
@@ -200,38 +258,189 @@ class ClozeJoint(MdJoint):
     ZK-level
     """
 
-    def join_zk(self, zk: ZettelKasten = None, test_mode: bool = False) -> int:
+    def join_zk(self, zk: ZettelKasten = None, test_mode: bool = False, force_rescan: bool = False,
+                writer: NoteWriter = None, update: bool = False, dry_run: bool = False) -> int:
+        """
+        Join the ZK to Anki, synchronously.
+        :param zk: The ZK to join
+        :param test_mode: join to the test model
+        :param force_rescan: join every file, even if unchanged since last join
+        :param writer: The note writer shared by the whole join, which will be finished by caller.
+         If None, a new one is created and finished here.
+        :param update: update the imported notes whose fields differ from the MD file
+        :param dry_run: stop after parse and cloze selection, with the plan of the join in self.plan
+        :return: How many notes joined (to join, if dry run)
+        """
+        own_writer = writer is None and not dry_run
+        report = JoinReport()
+        writer = NoteWriter(self.col, report=report) if own_writer else writer
+        self.prepare_join(zk, test_mode=test_mode, force_rescan=force_rescan, writer=writer, update=update,
+                          report=report, plan=JoinPlan() if dry_run else None)
+        # Parse the files (in worker processes if configured), then join them in the same order
+        new_notes_count: int = 0
+        for _, jobs in Dispatcher([self]).scan():
+            for file_spec in self.parse_zk(jobs):
+                new_notes_count += self.join_file(file_spec)
+        self.finish_join()
+        if own_writer:
+            writer.finish()
+        report.finish()
+        logger.info(f'ZK-join: {report.summary(self.zk.path)}')
+        return new_notes_count
+
+    def prepare_join(self, zk: ZettelKasten, test_mode: bool = False, force_rescan: bool = False,
+                     writer: NoteWriter = None, paths: list[str] = None, update: bool = False,
+                     report: JoinReport = None, plan: JoinPlan = None):
+        """
+        Get ready to join the ZK, on the main thread.
+        :param zk: The ZK to join
+        :param test_mode: join to the test model
+        :param force_rescan: join every file, even if unchanged since last join
+        :param writer: The note writer shared by the whole join
+        :param paths: Only scan these files and directories (not recursive) of the ZK, e.g. changed ones in watch mode.
+         If None, the whole ZK is scanned.
+        :param update: update the imported notes whose fields differ from the MD file
+        :param report: The timings of the join stages, shared by the whole join. If None, a new one is created.
+        :param plan: Make it a dry run, which collects the plan rather than writes, shared by the whole join.
+         The writer is not used then.
+        """
         self.zk = zk
+        self.paths = paths
         if test_mode:
-            self.check_model(test_mode=test_mode)
+            # a dry run only looks the model up
+            self.check_model(test_mode=test_mode, create=plan is None)
+        self.parser.model_name = self.model_name
+        self.parser.update = update
+        self.parser.selector = ClozeSelector(get_config('cloze_rules'), get_config('cloze_excluded_tags'))
+        self.parser.chunk_chars = budget_chars(get_config('parse_memory_budget'))
         logger.info(f'ZK-join: start using {self.__class__}, map to model "{self.model_name}"')
-        # Traverse the ZK
-        new_notes_count: int = 0
-        for root, dirs, files in os.walk(self.zk.path):
-            # Get the relative path of the current directory
-            rel_dir = os.path.relpath(root, self.zk.path)
-            # !Attention! dirs and files are just basename without path
-            # Filter out hidden directories, hidden or non-MD files
-            dirs[:] = [d for d in dirs if not d.startswith('.')]
-            files = [f for f in files if f.endswith(self.FILE_TYPE) and not f.startswith('.')]
-            if not files:
-                logger.debug(f'ZK-join: Skip dir {rel_dir} since no MD files included.')
-                continue
-            logger.debug(f'ZK-join: Handling with dir "{rel_dir}".')
-            # for media-import purpose. Image filepath is relative.
-            os.chdir(root)
-            # Generate deck_name
-            deck_name: str = rel_dir.replace(os.sep, '::') if rel_dir != '.' else 'Default'
-            # Calculate depth, warning if depth > 3
-            depth = 0 if rel_dir == '.' else len(rel_dir.split(os.sep))  # os.sep is '\'
-            if depth > 3:
-                logger.warning(f'ZK-join: bad practise, current dir is "{depth}-level-deep" in zk, more than 3.')
-            # Traverse the files
-            for file in files:
-                abs_file = os.path.join(root, file)  # get the abs path
-                new_notes_count += self.join_file(abs_file, deck_name)
-        logger.info(f'ZK-join: finish using {self.__class__}, with {new_notes_count} joined.\n')
-        return new_notes_count
+        self.new_notes_count = 0
+        self.updated_notes_count = 0
+        self.orphan_note_ids = []
+        self.force_rescan = force_rescan
+        self.update = update
+        self.writer = writer
+        self.report = report if report else JoinReport()
+        self.plan = plan
+        self.media_importer = MediaImporter(self.col)
+        manifest_path: str = self.zk.manifest_path(self.model_name)
+        if self.keep_loaded(manifest_path):
+            # a join of a few paths (watch mode) starts with what the join before loaded, which scales with the ZK
+            self.manifest.restart()
+            if self.note_index.stale:
+                self.note_index.load(owned=self.manifest.present_note_ids(seen_only=False))
+            else:
+                self.note_index.restart(owned=self.manifest.present_note_ids(seen_only=False))
+            logger.info('ZK-join: manifest, decks and notes kept from the join before.')
+        else:
+            # every deck of the collection at once, rather than a lookup for each note
+            self.decks = DeckCache(self.col)
+            self.decks.load()
+            # Load the manifest of joined files, unchanged files will be skipped unless force-rescan
+            self.manifest = Manifest(manifest_path, self.zk.path)
+            # the notes of the model at once, rather than a search for each note
+            self.note_index = NoteIndex(self.col, self.model)
+            if self.model is not None:
+                self.note_index.load(owned=self.manifest.present_note_ids(seen_only=False))
+        if force_rescan:
+            logger.info('ZK-join: force full rescan, manifest ignored.')
+        if self.model is None and plan is not None:
+            # a dry run on a collection without the model, which has no notes of it yet
+            plan.add_model(self.model_name)
+
+    def keep_loaded(self, manifest_path: str) -> bool:
+        """
+        Check if the manifest, decks and notes loaded by the join before can be kept:
+         for a join of a few paths only, not a dry run, of the same ZK, collection and model
+        """
+        return (self.paths is not None and self.plan is None and self.manifest is not None
+                and self.manifest.path == manifest_path and self.decks is not None and self.decks.col is self.col
+                and self.note_index is not None and self.note_index.col is self.col
+                and self.note_index.model is self.model and self.model is not None)
+
+    def match_note_type(self, note_type: str) -> bool:
+        """
+        Check if the 'note-type' of the frontmatter is joined by this joint
+        :param note_type: 'note-type' of the frontmatter, '' if missing
+        """
+        return self.parser.match_note_type(note_type)
+
+    def parse_zk(self, jobs: list[tuple[str, str, Optional[str]]]) -> Iterator[FileSpec]:
+        """
+        Parse the files in the order of jobs. Without collection access, safe to run in background.
+        :param jobs: list of (absolute file path, deck name, note type sniffed by the scan)
+        :return: iterator of FileSpec
+        """
+        # the sections unchanged since last join are skipped, unless force-rescan
+        known_sections = None if self.force_rescan else {
+            abs_file: self.manifest.section_hashes(abs_file) for abs_file, *_ in jobs
+        }
+        return parse_files(self.parser, jobs, workers=get_config('parse_workers'), known_sections=known_sections)
+
+    def finish_join(self, partial: bool = False):
+        """
+        Write the rest of the notes, and save the manifest, on the main thread.
+        :param partial: The join stopped by an error, whose scan may be incomplete:
+         the joined files are still recorded, but the orphans are left to the next join, and no entry is pruned.
+        """
+        if self.plan:
+            if not partial:
+                self.plan.orphans += self.find_orphans()
+            self.plan.remove_orphans = self.update and get_config('remove_orphans')
+            logger.info(f'ZK-join: dry run finished using {self.__class__}, nothing written. '
+                        f'Files {self.manifest.summary()}.\n')
+            return
+        self.writer.flush()
+        if partial:
+            # the files not seen may be there still, their notes are no orphans
+            self.orphan_note_ids = []
+            logger.warning('ZK-join: stopped by error, orphans not checked, manifest not pruned.')
+        else:
+            self.check_orphans()
+        # a partial scan hasn't seen the other files, keep their entries
+        self.manifest.save(prune=self.paths is None and not partial)
+        logger.info(f'ZK-join: finish using {self.__class__}, with {self.new_notes_count} joined, '
+                    f'{self.updated_notes_count} updated, {len(self.orphan_note_ids)} orphaned, '
+                    f'{self.media_importer.new_count} media imported, files {self.manifest.summary()}.\n')
+
+    ORPHAN_TAG = 'zk-orphan'
+
+    def check_orphans(self):
+        """
+        Find the notes whose headings have disappeared from the ZK.
+        They are tagged to be found in the browser, or removed if configured (in update mode only).
+        """
+        remove: bool = self.update and get_config('remove_orphans')
+        self.orphan_note_ids = self.find_orphans()
+        if not self.orphan_note_ids:
+            return
+        if remove:
+            self.col.remove_notes(self.orphan_note_ids)
+            self.note_index.remove(self.orphan_note_ids)
+            logger.info(f'ZK-join: {len(self.orphan_note_ids)} orphan notes removed, '
+                        f'note ids {self.orphan_note_ids}')
+        else:
+            self.col.tags.bulk_add(self.orphan_note_ids, self.ORPHAN_TAG)
+            self.note_index.add_tag(self.orphan_note_ids, self.ORPHAN_TAG)
+            logger.warning(f'ZK-join: {len(self.orphan_note_ids)} orphan notes whose headings have disappeared, '
+                           f'tagged "{self.ORPHAN_TAG}", note ids {self.orphan_note_ids}')
+
+    def find_orphans(self) -> list[int]:
+        """
+        Find the notes whose headings have disappeared from the ZK, without touching them.
+        :return: the ids of the orphan notes in the collection, with the ones tagged earlier if to remove them
+        """
+        note_ids: set[int] = set(self.orphan_note_ids)
+        if self.paths is None:
+            # the files deleted or renamed
+            note_ids.update(self.manifest.unseen_note_ids())
+        # the headings moved to another file
+        note_ids -= self.manifest.present_note_ids(seen_only=self.paths is None)
+        # the notes removed in Anki already are no orphans, the ones tagged earlier are removed as well
+        note_ids = {note_id for note_id in note_ids if note_id in self.note_index}
+        if self.update and get_config('remove_orphans'):
+            note_ids.update(self.note_index.with_tag(self.ORPHAN_TAG))
+        return sorted(note_ids)
 
     """ ========== ========== ========== ========== ========== ========== ========== ========== ========== ========== 
     file-level
@@ -239,94 +448,196 @@ class ClozeJoint(MdJoint):
 
     FILE_TYPE = '.md'
 
-    def join_file(self, abs_file: str, deck_name: str) -> int:
-        """
-        Join MD file.
-        :param abs_file: The absolute path of the file to join
-        :param deck_name: The name of the deck where the MD file is joined to
-        """
-        logger.debug(f'File-join: Handling with "{os.path.basename(abs_file)}"')
-        post = self.load(abs_file)
-        # Skip to next file if not joinable
-        if not self.check_joinable(post):
-            logger.info(f'File-join: Skip file since it is not joinable.')
+    def join_file(self, file_spec: FileSpec) -> int:
+        """
+        Join the parsed MD file to the collection, on the main thread.
+        :param file_spec: The parse result of the MD file
+        :return: How many notes joined
+        """
+        logger.debug('File-join: Handling with "%s"', file_spec.abs_file)
+        # the parse stages, timed where the file parsed (maybe a worker process)
+        self.report.add_file(file_spec.abs_file, file_spec.timings)
+        if self.plan:
+            return self.plan_file(file_spec)
+        # Traverse the parsed notes, which are queued to the writer
+        joined: list[tuple[NoteSpec, Note]] = []
+        restored: list[NoteSpec] = []
+        updated_count: int = 0
+        if file_spec.joinable:
+            restored = self.find_notes(file_spec)
+            for note_spec in file_spec.notes:
+                if not note_spec.note_id:
+                    joined.append((note_spec, self.join_note(note_spec, file_spec.deck_name, file_spec.abs_file)))
+                elif self.update:
+                    # the notes found by the index are parsed in update mode only
+                    updated_count += self.update_note(note_spec, file_spec.abs_file)
+            logger.info('File-join: Done, with %d notes joined, %d notes updated.', len(joined), updated_count)
+        else:
+            logger.info('File-join: Skip file since it is not joinable.')
+        # Finally, comment the source file if new-notes imported and record it, as soon as the notes get their ids
+        self.writer.defer(functools.partial(self.finish_file, file_spec, joined, restored))
+        self.writer.flush_if_full()
+        self.new_notes_count += len(joined)
+        self.updated_notes_count += updated_count
+        return len(joined)
+
+    def plan_file(self, file_spec: FileSpec) -> int:
+        """
+        Plan the join of the parsed MD file, reading the collection only, the file untouched.
+        :param file_spec: The parse result of the MD file
+        :return: How many notes to join
+        """
+        self.plan.files += 1
+        if not file_spec.joinable:
             return 0
-        # join MD note
-        post.content = self.do_standardize(post.content)
-        soup: BeautifulSoup = self.make_soup(post.content)
-        # temp
-        self.handling_content = post.content
-        new_notes_count: int = 0
-        # Traverse headings
-        for heading in soup.find_all(self.HEADING_TAG_NAMES):
-            if self.join_note(heading, deck_name):
-                new_notes_count += 1
-        logger.info(f'File-join: Done, with {new_notes_count} notes joined.')
-        # Finally, comment the source file if new-notes imported
+        abs_file = file_spec.abs_file
+        added: list[NoteSpec] = []
+        restored: list[NoteSpec] = self.find_notes(file_spec)
+        for note_spec in restored:
+            self.plan.restore_note(abs_file, note_spec.root, note_spec.note_id)
+        for note_spec in file_spec.notes:
+            if note_spec.note_id and not self.update:
+                continue
+            for img, std_name in note_spec.media:
+                size = self.media_importer.plan_file(img, std_name)
+                if size:
+                    self.plan.add_media(img, std_name, size)
+            if not note_spec.note_id:
+                self.plan.add_note(abs_file, note_spec.root, file_spec.deck_name, note_spec.cloze_count)
+                added.append(note_spec)
+                continue
+            note = self.get_own_note(note_spec.note_id)
+            changed = self.changed_fields(note, note_spec, note_spec.text, note_spec.extra) if note else {}
+            if changed and note_spec.media:
+                # the media filenames are decided while imported, compare without them
+                changed = {name: value for name, value in changed.items()
+                           if IMG_SRC_RE.sub(r'\1', value) != IMG_SRC_RE.sub(r'\1', note[name])}
+            if changed:
+                self.plan.update_note(abs_file, note_spec.root, note_spec.note_id, list(changed))
+        if added:
+            self.plan_deck(file_spec.deck_name)
+        if added or restored:
+            self.plan.rewrite_file(abs_file, sum(1 for note_spec in added + restored if note_spec.line_start >= 0))
+        # the headings removed from the file since last join
+        self.orphan_note_ids += self.manifest.lost_note_ids(
+            abs_file, file_spec.note_ids + [note_spec.note_id for note_spec in restored])
+        return len(added)
+
+    def plan_deck(self, deck_name: str):
+        """
+        Plan the deck and its parents to create, if not in the collection
+        """
+        parts = deck_name.split('::')
+        for n in range(1, len(parts) + 1):
+            name = '::'.join(parts[:n])
+            if self.decks.lookup(name) is None:
+                self.plan.add_deck(name)
+
+    def find_notes(self, file_spec: FileSpec) -> list[NoteSpec]:
+        """
+        Find the notes of the sections without NoteId comment in the collection, whose comments are lost.
+        :param file_spec: The parse result of the MD file, the note specs found get the ids of the notes
+        :return: the note specs found
+        """
+        # the notes commented in the file are not matched to the other sections
+        self.note_index.claim(file_spec.note_ids)
+        deck_id: Optional[DeckId] = self.decks.lookup(file_spec.deck_name)
+        own: set[int] = set(self.manifest.recorded_note_ids(file_spec.abs_file))
+        found: list[NoteSpec] = []
+        for note_spec in file_spec.notes:
+            if note_spec.note_id:
+                continue
+            note_id = self.note_index.match(deck_id, note_spec.root, own)
+            if note_id:
+                logger.info(f'Note-join: NoteId comment lost, note found in the collection by its root, '
+                            f'note id {note_id}: "{note_spec.root}"')
+                note_spec.note_id = note_id
+                found.append(note_spec)
+        return found
+
+    def finish_file(self, file_spec: FileSpec, joined: list[tuple[NoteSpec, Note]], restored: list[NoteSpec] = ()):
+        """
+        Comment the source file with the ids of the notes, then record it, after the notes written.
+        :param file_spec: The parse result of the MD file
+        :param joined: the note specs and the notes added from them
+        :param restored: the note specs whose NoteId comments were lost, with the ids of the notes found
+        """
+        written: bool = self.write_back(file_spec, joined, restored) if joined or restored else True
+        self.record_file(file_spec, joined, restored, stale=not written)
+
+    def record_file(self, file_spec: FileSpec, joined: list[tuple[NoteSpec, Note]], restored: list[NoteSpec] = (),
+                    stale: bool = False):
+        """
+        Record the joined file in the manifest, with the ids of its notes.
+        :param file_spec: The parse result of the MD file
+        :param joined: the note specs and the notes added from them
+        :param restored: the note specs whose NoteId comments were lost, with the ids of the notes found
+        :param stale: the file is not written back, to be joined again next time,
+         when the notes are found by the note index and their comments restored
+        """
+        commented: list[tuple[NoteSpec, int]] = [(note_spec, note_spec.note_id) for note_spec in restored]
+        commented += [(note_spec, note.id) for note_spec, note in joined]
+        note_ids: list[int] = file_spec.note_ids + [note_id for _, note_id in commented]
+        # the headings removed from the file since last join
+        self.orphan_note_ids += self.manifest.lost_note_ids(file_spec.abs_file, note_ids)
+        # the notes added, for the next join which keeps the index
+        deck_id: Optional[DeckId] = self.decks.lookup(file_spec.deck_name) if joined else None
+        for note_spec, note in joined:
+            self.note_index.add(note.id, deck_id, note_spec.root)
+        # the sections of the new notes are commented with their ids now
+        sections: dict[str, str] = dict(file_spec.sections)
+        for note_spec, note_id in commented:
+            if note_spec.section_key in sections:
+                sections[rekey_section(note_spec.section_key, note_id)] = sections.pop(note_spec.section_key)
+        if stale:
+            self.manifest.record(file_spec.abs_file, file_spec.size, 0, '', note_ids, file_spec.note_type)
+            return
+        self.manifest.record(file_spec.abs_file, file_spec.size, file_spec.mtime_ns, file_spec.digest, note_ids,
+                             file_spec.note_type, sections)
+
+    def write_back(self, file_spec: FileSpec, joined: list[tuple[NoteSpec, Note]], restored: list[NoteSpec] = ()):
+        """
+        Comment the source file with the ids of the joined notes, all in one linear rewrite.
+        :param file_spec: The parse result of the MD file
+        :param joined: the note specs and the notes added from them
+        :param restored: the note specs whose NoteId comments were lost, with the ids of the notes found
+        :return: False if cancelled or failed, True if written (the file spec updated to the file written)
+         or nothing to write
+        """
+        abs_file = file_spec.abs_file
         file_id = ...
-        if new_notes_count > 0:
-            self.comment_fileid(abs_file, file_id)
-            # temp
-            post.content = self.handling_content
-            self.dump(post, abs_file)
-        return new_notes_count
-
-    def check_joinable(self, post: frontmatter.Post) -> bool:
-        """
-        Check the frontmatter metadata, see if joinable with current Joint
-        :param post: frontmatter.Post
-        :return: True if joinable, otherwise False
-        """
-        # try to fetch 'note-type'
-        try:
-            note_type: str = str(post['note-type'])
-            logger.debug(f'File-join: "note-type" is "{note_type}" in the frontmatter.')
-            # judge if match current joint
-            if note_type == self.model_name or \
-                    note_type in self.model_name:
-                return True
-            else:
+        self.comment_fileid(abs_file, file_id)
+        # there must be blank lines around the comment,
+        #  or the comment will be parsed as part of next element in markdown
+        commented: list[tuple[NoteSpec, int]] = [(note_spec, note_spec.note_id) for note_spec in restored]
+        commented += [(note_spec, note.id) for note_spec, note in joined]
+        insertions: dict[int, str] = {
+            note_spec.line_start: f'<!-- NoteId: {note_id} -->'
+            for note_spec, note_id in commented if note_spec.line_start >= 0
+        }
+        if len(insertions) < len(commented):
+            logger.warning(f'File-join: {len(commented) - len(insertions)} NoteId comments missing, '
+                           f'source line of heading unknown.')
+        if not insertions:
+            return True
+        with self.report.span('write_back', abs_file):
+            try:
+                with open(abs_file, 'rb') as f:
+                    data = f.read()
+            except OSError as e:
+                logger.warning(f'File-join: write back cancelled, {e}, file "{abs_file}"')
+                return False
+            if hashlib.sha1(data).hexdigest() != file_spec.digest:
+                logger.warning(f'File-join: write back cancelled, file modified since parsed: "{abs_file}"')
                 return False
-        except KeyError:  # note-type key not exists
-            logger.debug(f'File-join: "note-type" metadata missing in the frontmatter.')
+            content = insert_after_headings(data.decode('utf-8'), insertions)
+            stat = self.write(content, abs_file)
+        if stat is None:
             return False
-
-    @staticmethod
-    def do_standardize(content: str) -> str:
-        """
-        standardize markdown content to avoid some render error.
-        :param content: MD content
-        :return: standardized MD content
-        """
-        # replace ':emoji-alia:' to emoji
-        content = emojis.encode(content)
-        return content
-
-    @staticmethod
-    def make_soup(content: str) -> BeautifulSoup:
-        """
-        Transfer md file to html, then using bs4 to parse
-        :param content: md file content
-        :return: beautifulsoup (parse tree) of the file
-        """
-        extensions: list[markdown.Extension] = []
-        # add table extension
-        table_ext = tables.TableExtension()
-        table_ext.setConfig('use_align_attribute', True)
-        extensions.append(table_ext)
-        # add math extension
-        math_ext = arithmatex.ArithmatexExtension()
-        math_ext.setConfig('preview', False)
-        math_ext.setConfig('generic', True)
-        # not wrap while parse md, add manually after cloze deletion
-        math_ext.setConfig('tex_block_wrap', ['', ''])
-        extensions.append(math_ext)
-        # add fenced-code extension
-        fenced_code_ext = superfences.SuperFencesCodeExtension()
-        extensions.append(fenced_code_ext)
-        # parse markdown with extensions
-        html = markdown.markdown(content, extensions=extensions)
-        return BeautifulSoup(html, 'html.parser')
+        file_spec.size, file_spec.mtime_ns = stat.st_size, stat.st_mtime_ns
+        file_spec.digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        logger.debug('File-join: %d NoteId commented after headings.', len(insertions))
+        return True
 
     def comment_fileid(self, abs_file: str, file_id: FileId) -> None:
         """
@@ -361,252 +672,106 @@ class ClozeJoint(MdJoint):
     note-level
     """
 
-    HEADING_TAG_NAMES: list[str] = [f'h{n}' for n in range(1, 7)]
-
-    def join_note(self, note_heading: Tag, deck_name: str = None) -> int:
+    def join_note(self, note_spec: NoteSpec, deck_name: str = None, abs_file: str = None) -> Note:
         """
-        Join MD file sections to Anki notes
-        :param note_heading: bs4-tag of heading from the parse tree, which corresponds to an Anki-note
+        Join the parsed MD file section to Anki note
+        :param note_spec: The parse result of the heading section, which corresponds to an Anki-note
         :param deck_name: The name of the deck where the MD file is joined to
-        :return: How many cloze-deletions made
-        """
-        # get heading root (heading path)
-        root_field = self.parse_root_field(note_heading)
-        logger.info(f'Note-join: Handling with note-heading: "{root_field}"')
-        # Check if the note has been imported (commented with note_id)
-        noteid = self.get_commented_noteid(note_heading)
-        if noteid:
-            logger.debug(f'Note-join: note already imported: "{root_field}"')
-            return 0
-        # parse note scope
-        note_scope: BeautifulSoup = self.get_note_scope(note_heading)
-        extra_field_scope = self.parse_extra_field_scope(note_scope)
-        text_field_scope = self.parse_text_field_scope(note_scope)
-        # cloze deletion
-        new_cloze_count: int = 0
-        for cloze_tag in self.do_cloze_selection(cloze_scope=text_field_scope):
-            if self.do_cloze_deletion(cloze_tag, new_cloze_count + 1):
-                new_cloze_count += 1
-        # check if the note has cloze-deletion
-        if not new_cloze_count:
-            logger.debug(f'Note-join: no cloze-deletion found, skip.')
-            return 0
-        # Import media files
-        self.do_media_import(extra_field_scope, deck_name)
-        self.do_media_import(text_field_scope, deck_name)
-        # Create a note
-        note = Note(mw.col, self.model)
-        note['root'] = root_field
-        note['Text'] = str(text_field_scope).strip()
-        note['Extra'] = str(extra_field_scope).strip()
-        if '⭐' in root_field:
-            note.tags.append('marked')
-        # add note to deck, and the note object will get assigned with id
-        deck_id: DeckId = mw.col.decks.id(deck_name)  # find deck or create if not exist
-        mw.col.add_note(note, deck_id)
-        self.add_noteid_comment(note_heading, note.id)
-        logger.info(f'Note-Join: Done, {new_cloze_count} cloze-deletions made, note.id: {note.id}')
-        return new_cloze_count
-
-    def get_note_scope(self, note_heading: Tag, recursive: bool = False) -> BeautifulSoup:
-        """
-        get the note scope of soup from the parse tree (a header corresponds to a note)
-        :param note_heading: heading bs4-tag from the parse tree, which corresponds to Anki-note
-        :param recursive: if True, include subheadings with their content
-        :return: BeautifulSoup instance of the note scope, note-heading excluded
-        """
-        # check tag name
-        if note_heading.name not in self.HEADING_TAG_NAMES:
-            raise ValueError(f'heading tag supposed, but <{note_heading.name}> tag get')
-        # setup stop condition (while encounter the specific tag, stop parsing)
-        if recursive:
-            stop = self.HEADING_TAG_NAMES[:self.HEADING_TAG_NAMES.index(note_heading.name) + 1]
-        else:
-            stop = self.HEADING_TAG_NAMES
-        stop.append('hr')  # <hr> tag is also one of stop tag
-        # generate heading/note scope
-        note_scope: BeautifulSoup = BeautifulSoup('', 'html.parser')
-        sibling = note_heading.next_sibling  # !Attention! .next_sibling might return NavigableString
-        while sibling and sibling.name not in stop:
-            if sibling.name in stop:
-                break
-            note_scope.append(copy.copy(sibling))
-            sibling = sibling.next_sibling
-        return note_scope
-
-    def parse_root_field(self, note_heading: Tag) -> str:
-        index = self.HEADING_TAG_NAMES.index(note_heading.name)
-        heading_strs: list[str] = []
-        for n in range(index):
-            heading_strs.append(note_heading.find_previous_sibling(self.HEADING_TAG_NAMES[n]).text)
-        # Finally add itself
-        heading_strs.append(note_heading.text)
-        return '.'.join(heading_strs)
+        :param abs_file: The MD file, which the timings are attributed to
+        :return: The note queued to the writer (id assigned after flushed)
+        """
+        logger.debug('Note-join: Handling with note-heading: "%s"', note_spec.root)
+        text, extra = self.make_fields(note_spec, abs_file)
+        with self.report.span('note', abs_file):
+            # Create a note
+            note = Note(self.col, self.model)
+            note['root'] = note_spec.root
+            note['Text'] = text
+            note['Extra'] = extra
+            note.tags += note_spec.tags
+            # queue note to deck, and the note object will get assigned with id while the writer flushed
+            deck_id: DeckId = self.decks.get(deck_name)  # find deck or create if not exist
+            self.writer.add(note, deck_id)
+        logger.debug('Note-Join: Done, %d cloze-deletions made, note queued.', note_spec.cloze_count)
+        return note
+
+    def update_note(self, note_spec: NoteSpec, abs_file: str = None) -> bool:
+        """
+        Update the imported note if its fields differ from the MD file section.
+        :param note_spec: The parse result of the heading section, with the id of the imported note
+        :param abs_file: The MD file, which the timings are attributed to
+        :return: True if the note is queued to update, False if unchanged or not found
+        """
+        with self.report.span('note', abs_file):
+            note = self.get_own_note(note_spec.note_id)
+            if not note:
+                return False
+        text, extra = self.make_fields(note_spec, abs_file)
+        with self.report.span('note', abs_file):
+            changed = self.changed_fields(note, note_spec, text, extra)
+            if not changed:
+                return False
+            for name, value in changed.items():
+                note[name] = value
+            self.writer.update(note)
+            if 'root' in changed:
+                self.note_index.rename(note_spec.note_id, changed['root'])
+        logger.info('Note-update: fields %s changed, note queued. note id %d', list(changed), note_spec.note_id)
+        return True
 
-    @staticmethod
-    def parse_extra_field_scope(note_scope: BeautifulSoup) -> BeautifulSoup:
+    def get_own_note(self, note_id: int) -> Optional[Note]:
         """
-        Extract the blockquote tags to extra field
-        :param note_scope: BeautifulSoup instance of the note scope
-        :return: BeautifulSoup instance of extra field scope
+        :param note_id: The id of the imported note
+        :return: The note, None if not found or of another model
         """
-        extra_field_scope: BeautifulSoup = BeautifulSoup()
-        # Find all the blockquote tags, join them as the extra field
-        for tag in note_scope.find_all('blockquote', recursive=False):
-            extra_field_scope.append(tag)
-        return extra_field_scope
+        # the index holds the notes of the model only
+        if note_id not in self.note_index:
+            logger.warning(f'Note-update: note not found (removed in Anki?) or of another model, note id {note_id}')
+            return None
+        try:
+            return self.col.get_note(NoteId(note_id))
+        except NotFoundError:
+            logger.warning(f'Note-update: note not found (removed in Anki?), note id {note_id}')
+            return None
 
     @staticmethod
-    def parse_text_field_scope(note_scope: BeautifulSoup) -> BeautifulSoup:
+    def changed_fields(note: Note, note_spec: NoteSpec, text: str, extra: str) -> dict[str, str]:
         """
-        Parse the text field scope
-        :param note_scope: BeautifulSoup instance of the note scope
-        :return: BeautifulSoup instance of text field scope
+        :return: the fields of the note which differ from the MD file section, mapped to the new values
         """
-        # check if blockquote tags has been extracted
-        bq_tags = note_scope.find_all('blockquote', recursive=False)
-        if bq_tags:
-            for tag in bq_tags:
-                tag.decompose()
-            logger.warning(f'Note-join: blockquote tags decomposed (without included in "Extra" field)')
-        return note_scope
+        fields: dict[str, str] = {'root': note_spec.root, 'Text': text, 'Extra': extra}
+        return {name: value for name, value in fields.items() if note[name] != value}
 
-    @staticmethod
-    def do_media_import(soup: BeautifulSoup, deck_name: str) -> int:
+    def make_fields(self, note_spec: NoteSpec, abs_file: str = None) -> tuple[str, str]:
         """
-        Import media file to Anki collection (media folder).
-        For now, only image media supported.
-        :param soup: the BeautifulSoup that contains img tags
-        :param deck_name: The name of the deck where the MD file is joined to
-        :return: How many media files imported
-        """
-        # Since folders inside the media folder are not supported,
-        #  import img file directly to media folder with standard name,
-        #  and modify 'src' attribute of <img> tag to filename
-        img_tags = soup.find_all('img')
-        new_img_count: int = 0
-        for img_tag in img_tags:
-            src = img_tag.get('src', None)
-            # continue if src attribute missing
-            if not src:
-                logger.debug(f'Media-Import: add img failed, src attr missing, src="{src}"')
-                continue
-            if not os.path.isabs(src):
-                img = os.path.abspath(src)  # img path
-            else:
-                img = src
-            # continue if file not exist
-            if not os.path.exists(img):
-                logger.debug(f'Media-Import: add img failed, image file not exist, img path "{img}"')
-                continue
-            img_name = os.path.basename(img)
-            # create a copy with standardized name
-            std_name = '.'.join(deck_name.split(sep='::') + [img_name])
-            std_img = os.path.join(os.path.dirname(img), std_name)
-            shutil.copyfile(img, std_img)
-            # modify 'src' attribute of <img> tag
-            img_tag['src'] = std_name
-            # Anki will add basename of path to the media folder, renaming if not unique
-            #  which could be found under `%APPDATA%\Anki2`
-            if not mw.col.media.have(std_name):
-                mw.col.media.addFile(std_img)
-                new_img_count += 1
-                logger.debug(f'Media-Import: add img success, img filename "{std_name}"')
-            else:
-                logger.debug(f'Media-Import: img already imported, skip. img filename "{std_name}"')
-            # delete copied file
-            os.remove(std_img)
-        # return
-        return new_img_count
-
-    def add_noteid_comment(self, note_heading: Tag, note_id: NoteId):
-        """
-        Add comment with NoteId after the heading line
-        :param note_heading:
-        :param note_id:
-        :return:
-        """
-        re.sub(
-            r'(\n*#+\s*{}\s*\n\n)'.format(note_heading.text),
-            r'\1' + f'<!-- NoteId: {note_id} -->\n\n',
-            self.handling_content)
-        # there must be two '\n' at the end of the pattern,
-        #  or the comment will be parsed as part of next element in markdown2
-        logger.debug(f'Importing MD - NoteId commented after heading "{note_heading.text}".')
-
-    @staticmethod
-    def get_commented_noteid(note_heading: Tag) -> NoteId:
-        """
-        Get the noteid from the comment right after the heading tag
-        :param note_heading:
-        :return:
+        Import the media files of the note, then make the Text and Extra fields.
+        :param note_spec: The parse result of the heading section
+        :param abs_file: The MD file, which the timings are attributed to
+        :return: Text and Extra fields, with 'src' attribute of <img> tag modified if imported with another name
         """
-        comm = note_heading.next_sibling
-        while comm and isinstance(comm, NavigableString):
-            if isinstance(comm, Comment):
-                break
-            else:
-                comm = comm.next_sibling
-        else:
-            return NoteId(0)
-        m = re.fullmatch(
-            r'\s*NoteId:\s*(?P<note_id>[0-9]{13})\s*',
-            comm,
-            flags=re.IGNORECASE
-        )
-        note_id = NoteId(m.group('note_id')) if m else None
-        return note_id
-
-    """ ========== ========== ========== ========== ========== ========== ========== ========== ========== ========== 
-    cloze-level
-    """
-
-    @staticmethod
-    def do_cloze_selection(cloze_scope: BeautifulSoup) -> ResultSet:
-        """
-        Select cloze on the text field
-        :param cloze_scope: BeautifulSoup instance of the note scope
-        :return: ResultSet of cloze tags
-        """
-        # replace blockquote tags with placeholder, to avoid select cloze-deletion in blockquote tags
-        blockquote_tags = cloze_scope.find_all('blockquote')
-        ph_count: int = 0
-        for bq_tag in blockquote_tags:
-            ph_count += 1
-            ph_tag = cloze_scope.new_tag('blockquote')
-            ph_tag['id'] = f'ph-{ph_count}'
-            bq_tag.replace_with(ph_tag)
-        # find all cloze-deletion, avoid including child tag, skip if empty
-        cloze_tags: ResultSet = cloze_scope.find_all(['strong', 'em', 'td', 'li'])
-        cloze_tags += cloze_scope.select('div.arithmatex')
-        # replace the blockquote placeholders with the original
-        ph_count = 0
-        for bq_tag in blockquote_tags:
-            ph_count += 1
-            ph_tag = cloze_scope.select_one(f'blockquote#ph-{ph_count}')
-            ph_tag.replace_with(bq_tag)
-        return cloze_tags
+        text, extra = note_spec.text, note_spec.extra
+        if not note_spec.media:
+            return text, extra
+        with self.report.span('media', abs_file):
+            renamed = self.do_media_import(note_spec.media)
+        for std_name, fname in renamed.items():
+            text = text.replace(f'src="{std_name}"', f'src="{fname}"')
+            extra = extra.replace(f'src="{std_name}"', f'src="{fname}"')
+        return text, extra
 
-    @staticmethod
-    def do_cloze_deletion(cloze_tag: Tag, cloze_no: int) -> bool:
+    def do_media_import(self, media: list[tuple[str, str]]) -> dict[str, str]:
         """
-        Do cloze-deletion on the text field
-        :param cloze_tag: Tag waiting for cloze-deletion
-        :param cloze_no: cloze number which is unique in the note
-        :return: True if cloze deletion was successful, False otherwise
+        Import media file to Anki collection (media folder).
+        For now, only image media supported.
+        :param media: list of (absolute image path, standard media filename) from the parse stage
+        :return: the standard filenames which are imported with another name, mapped to that name
         """
-        if not cloze_tag.string:  # skip empty tag
-            return False
-        elif cloze_tag.string.strip() == '':  # skip empty tag
-            return False
-        if len(cloze_tag.contents) > 1:  # skip if including child tag(s)
-            return False
-        cloze_tag.string = '{{c' + str(cloze_no) + ':: ' + cloze_tag.string + '}}'
-        # add math wrap manually
-        if cloze_tag.has_attr('class') and cloze_tag.attrs['class'] == 'arithmatex':
-            cloze_tag.contents[0].insert_before('\\[')
-            cloze_tag.contents[-1].insert_after('\\]')
-        return True
+        renamed: dict[str, str] = {}
+        for img, std_name in media:
+            fname = self.media_importer.import_file(img, std_name)
+            if fname != std_name:
+                renamed[std_name] = fname
+        return renamed
 
 
 """ ========== ========== ========== ========== ========== ========== ========== ========== ========== ========== 
@@ -614,24 +779,156 @@ module-level functions
 """
 
 # Add joints in this function, manually
-JOINTS: list[Joint] = [
-    ClozeJoint(),
+JOINT_CLASSES: list[type] = [
+    ClozeJoint,
 ]
 
+# the joints, created on first use rather than at add-on import
+_joints: list[Joint] = []
 
-def join(path: str, test_mode: bool = False):
+
+class Dispatcher:
     """
-    Join your ZettelKästen to Anki
+    Scan the ZK once for all the joints, and dispatch each file to the joint of its 'note-type'.
+    Adding a joint adds neither a walk of the ZK nor a read of the files.
     """
-    if not path:
-        return
+
+    joints: list[Joint]
+    registry: dict[str, Optional[Joint]]  # 'note-type' -> the joint, None if no joint for it
+    scanned: int  # files scanned, unchanged files included
+
+    def __init__(self, joints: list[Joint]):
+        """
+        :param joints: the joints prepared for the same join, in order.
+         The first joint of a file type parses the files of the type that no joint is found for,
+         to record them as not joinable.
+        """
+        self.joints = joints
+        self.registry = {}
+        for joint in joints:
+            self.registry.setdefault(joint.model_name, joint)
+        self.scanned = 0
+
+    def lookup(self, note_type: Optional[str]) -> Optional[Joint]:
+        """
+        :param note_type: 'note-type' of the frontmatter, '' if missing, None if undecided
+        :return: the joint of the note type, None if no joint for it or undecided
+        """
+        if note_type is None:
+            return None
+        if note_type not in self.registry:
+            self.registry[note_type] = next((j for j in self.joints if j.match_note_type(note_type)), None)
+        return self.registry[note_type]
+
+    def owner(self, abs_file: str) -> Optional[Joint]:
+        """
+        :return: the joint which joined the file last time, None if new
+        """
+        return next((joint for joint in self.joints if abs_file in joint.manifest), None)
+
+    def scan(self) -> list[tuple[Joint, list[tuple[str, str, Optional[str]]]]]:
+        """
+        Traverse the ZK, collect the files to parse for each joint.
+        Without collection access, safe to run in background.
+        :return: list of (joint, jobs) in the order of the joints,
+         jobs as list of (absolute file path, deck name, note type sniffed), parsed without sniffing again
+        """
+        first: Joint = self.joints[0]
+        jobs: dict[Joint, list[tuple[str, str, Optional[str]]]] = {joint: [] for joint in self.joints}
+        # one walk for the joints of the same file type
+        for file_type in dict.fromkeys(joint.FILE_TYPE for joint in self.joints):
+            default: Joint = next(joint for joint in self.joints if joint.FILE_TYPE == file_type)
+            scanner = ZkScanner(first.zk.path, file_type)
+            # watch mode, only the changed files and directories
+            entries = scanner.walk() if first.paths is None else scanner.scan_paths(first.paths)
+            with first.report.span('scan'):
+                for abs_file, deck_name, stat in entries:
+                    self.scanned += 1
+                    joint, note_type = self.dispatch(abs_file, stat, default)
+                    if joint is not None:
+                        jobs[joint].append((abs_file, deck_name, note_type))
+        return list(jobs.items())
+
+    def dispatch(self, abs_file: str, stat: os.stat_result, default: Joint) -> tuple[Optional[Joint], Optional[str]]:
+        """
+        Find the joint to parse the file with. The unchanged file is skipped by the manifest of its joint,
+         the note type of the others is sniffed from the frontmatter.
+        :param default: the joint to parse the file if no joint is found for it
+        :return: (the joint, None if the file is skipped; 'note-type' of the frontmatter, None if undecided)
+        """
+        force_rescan: bool = default.force_rescan
+        owner = self.owner(abs_file)
+        if owner is not None and not force_rescan and owner.manifest.is_unchanged(abs_file, stat):
+            logger.debug('ZK-join: Skip file "%s" since unchanged after last join.', abs_file)
+            return None, None
+        # even rescan, the file unchanged after last join is not opened again
+        cached = owner.manifest.cached_note_type(abs_file, stat) if owner is not None and force_rescan else None
+        note_type = cached if cached is not None else sniff_note_type(abs_file)
+        joint = self.lookup(note_type)
+        if joint is not None and joint.FILE_TYPE != default.FILE_TYPE:
+            joint = None
+        if joint is None:
+            if cached is not None:
+                logger.debug('ZK-join: Skip file "%s" since not joinable, unchanged after last join.', abs_file)
+                return None, cached
+            # not joinable or undecided, left to the full parse, by the joint which joined it last time
+            joint = owner if owner is not None and owner.FILE_TYPE == default.FILE_TYPE else default
+        if owner is not None and owner is not joint:
+            owner.manifest.release(abs_file)
+        if owner is not joint and not force_rescan:
+            joint.manifest.count_miss(abs_file)
+        return joint, note_type
+
+
+def get_joints(col: Collection = None, create_models: bool = True) -> list[Joint]:
+    """
+    :param col: bind the joints to the collection if given, unless bound already
+    :param create_models: create the models missing from the collection, False for a dry run, which writes nothing
+    :return: the joints, in the order of JOINT_CLASSES
+    """
+    if not _joints:
+        _joints.extend(joint_class() for joint_class in JOINT_CLASSES)
+    if col is not None:
+        for j in _joints:
+            # bound by a dry run, the model may be missing still
+            if j.col is not col or (create_models and j.model is None):
+                j.bind(col, create_model=create_models)
+    return _joints
+
+
+def invalidate_decks():
+    """
+    The decks renamed or removed in Anki, forget the deck ids cached by name
+    """
+    for j in _joints:
+        if j.decks is not None:
+            j.decks.invalidate()
+
+
+def invalidate_notes():
+    """
+    The notes changed in Anki, the notes indexed by the joints are stale
+    """
+    for j in _joints:
+        if j.note_index is not None:
+            j.note_index.invalidate()
+
+
+def join(path: str = None, test_mode: bool = False, force_rescan: bool = False, update: bool = None,
+         dry_run: bool = False):
+    """
+    Join your ZettelKästen to Anki, in background
+    :param path: ZK directory path, ask user to choose if empty
+    :param test_mode: join to the test models
+    :param force_rescan: join every file, even if unchanged since last join
+    :param update: update the imported notes whose fields differ from the MD files, None for the config
+    :param dry_run: show the plan of the join, without touching the collection or the files
+    """
+    from aqt import mw  # inside Anki only
+    from .task import JoinTask
     zk: ZettelKasten = ZettelKasten(path)
-    logger.info(f'ZK-join: Handling with ZK "{zk.path}".\n')
-    new_notes_count: int = 0
-    for joint in JOINTS:
-        # calculate how many cards imported
-        new_notes_count += joint.join_zk(zk, test_mode=test_mode)
-    logger.info(f'ZK-join: Done, {new_notes_count} notes imported.\n\n')
-    showInfo(f'ZK-join finished, with {new_notes_count} notes imported.')
-    # refresh the deck browser
-    mw.deckBrowser.refresh()
+    if not zk.path:
+        return
+    # a dry run only looks the models up, without creating them
+    joints = get_joints(mw.col, create_models=not dry_run)
+    JoinTask(zk, joints, test_mode=test_mode, force_rescan=force_rescan, update=update, dry_run=dry_run).start()
@@ -1,27 +1,71 @@
 """
 Logging set up
+The records are put on a queue by the calling thread, and written to the log file by a background thread,
+ so the join never waits for the file I/O.
 """
 
+import atexit
 import logging
 import os
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 logger = logging.getLogger(__name__)
 
 
-# Set the working directory to the current Python script
+# The log file is next to the Python script, whatever the working directory is
 #   while copy addon files to Anki using batch, cwd is the Project's root dir like "D:\PycharmProjects\KBjoint"
 #   while open Anki directly, cwd is Anki's installation dir like "D:\Program Files\Anki"
 pwd = os.getcwd()
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
-log_file_path = os.path.join(os.getcwd(), 'DEBUG.log')
+log_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'DEBUG.log')
 
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    datefmt='%m-%d %H:%M',
-                    filename=log_file_path,
-                    filemode='w')
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_DATE_FORMAT = '%m-%d %H:%M'
+# the log file rotates when it's full, with the older ones kept as 'DEBUG.log.1', 'DEBUG.log.2'...
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+DEFAULT_LEVEL = logging.INFO
+
+# the logger of the add-on package, the loggers of its modules propagate to it
+package_logger = logging.getLogger(__name__.rpartition('.')[0])
+
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+file_handler = RotatingFileHandler(log_file_path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                   encoding='utf-8', delay=True)
+file_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+listener = QueueListener(log_queue, file_handler)
+
+
+def setup():
+    """
+    Start logging to the file, a new file for each session (the last one kept as backup).
+    """
+    if os.path.exists(log_file_path) and os.path.getsize(log_file_path):
+        file_handler.doRollover()
+    package_logger.addHandler(QueueHandler(log_queue))
+    package_logger.setLevel(DEFAULT_LEVEL)
+    # kept out of the loggers of Anki and the other add-ons
+    package_logger.propagate = False
+    listener.start()
+    # write the rest of the queue before exit
+    atexit.register(listener.stop)
+
+
+def set_level(level: str):
+    """
+    Set the level of the add-on's logging, e.g. from the config
+    :param level: level name, such as 'DEBUG', 'INFO' or 'WARNING'
+    """
+    level_no = logging.getLevelName(str(level).upper())
+    if not isinstance(level_no, int):
+        logger.warning(f'Logging: unknown level "{level}", keep "{logging.getLevelName(package_logger.level)}"')
+        return
+    package_logger.setLevel(level_no)
+    logger.info(f'Logging: level set to "{logging.getLevelName(level_no)}"')
+
+
+setup()
 
 # log the module's CWD
 logger.debug(f'CWD: {pwd}\n')
-logger.debug(f'Initializing logging - CWD: {os.getcwd()}')
 logger.info(f'Initializing logging - log file path: {log_file_path}\n')
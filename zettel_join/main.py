@@ -0,0 +1,145 @@
+"""
+Set up the Add-on inside Anki: logging, modules and the menu items.
+The joints (and the parse libraries they import) are loaded on the first join, not at Anki's startup.
+"""
+
+import logging
+import sys
+
+from aqt import mw, gui_hooks
+from aqt.qt import QAction, qconnect
+from anki.utils import version_with_build, int_version
+
+# logging setup
+from . import log
+# download package to local library, in background
+from . import modules
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+def set_log_level():
+    """
+    Log at the level of the opened profile's config
+    """
+    log.set_level(config.get_config('log_level'))
+
+
+gui_hooks.profile_did_open.append(config.load_json_config)
+gui_hooks.profile_did_open.append(set_log_level)
+gui_hooks.profile_will_close.append(config.save_json_config)
+
+
+def on_operation_did_execute(changes, handler):
+    """
+    The decks or notes changed in Anki, the deck ids and the notes cached by the joints are stale
+    """
+    # nothing cached if never joined
+    if f'{__package__}.joint' not in sys.modules:
+        return
+    from . import joint
+    if changes.deck:
+        joint.invalidate_decks()
+    # the notes added, removed, edited or tagged, or their cards moved
+    if changes.note or changes.note_text or changes.card or changes.tag or changes.notetype:
+        joint.invalidate_notes()
+
+
+gui_hooks.operation_did_execute.append(on_operation_did_execute)
+
+modules.install_in_background()
+
+# Version Check
+logger.info(f"Current Anki version is: {version_with_build()}")
+if int_version() >= 231000:
+    ...
+
+# Import test modules if exist
+##################################################
+try:
+    from . import test
+except ImportError as e:
+    logger.info(f"Importing test module: {e}.\n")
+else:
+    logger.info("Importing test module: done.\n")
+
+
+# Add 'ZK Join' menu item
+##################################################
+def zk_join():
+    """
+    Join your knowledge base to Anki
+    """
+    if modules.ready():
+        from . import joint
+        joint.join()
+
+
+def zk_join_full():
+    """
+    Join your knowledge base to Anki, unchanged files included
+    """
+    if modules.ready():
+        from . import joint
+        joint.join(force_rescan=True)
+
+
+def zk_join_update():
+    """
+    Join your knowledge base to Anki, and update the imported notes modified in it
+    """
+    if modules.ready():
+        from . import joint
+        joint.join(update=True)
+
+
+def zk_join_dry_run():
+    """
+    Show what a join would do, without touching the collection or the files
+    """
+    if modules.ready():
+        from . import joint
+        joint.join(dry_run=True)
+
+
+def zk_watch(checked: bool):
+    """
+    Join your knowledge base to Anki, and keep joining the changed files
+    """
+    if not checked:
+        # nothing to stop if never watched
+        if f'{__package__}.watch' in sys.modules:
+            from . import watch
+            watch.unwatch()
+    elif not modules.ready():
+        watch_action.setChecked(False)
+    else:
+        from . import watch
+        if not watch.watch():
+            watch_action.setChecked(False)
+
+
+# create a new menu item
+action = QAction('ZK Join', mw)
+# set it to call testFunction when it's clicked
+qconnect(action.triggered, zk_join)
+# and add it to the tools menu
+mw.form.menuTools.addAction(action)
+# the same with full rescan
+action = QAction('ZK Join (full rescan)', mw)
+qconnect(action.triggered, zk_join_full)
+mw.form.menuTools.addAction(action)
+# the same with note update
+action = QAction('ZK Join (update notes)', mw)
+qconnect(action.triggered, zk_join_update)
+mw.form.menuTools.addAction(action)
+# the plan of the join, nothing written
+action = QAction('ZK Join (dry run)', mw)
+qconnect(action.triggered, zk_join_dry_run)
+mw.form.menuTools.addAction(action)
+# watch mode, opt-in
+watch_action = QAction('ZK Watch', mw)
+watch_action.setCheckable(True)
+qconnect(watch_action.toggled, zk_watch)
+mw.form.menuTools.addAction(watch_action)
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+Manifest
+A persistent record of the joined files, which makes it possible to skip unchanged files
+ before reading and parsing them.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class Manifest:
+    """
+    Manifest of the joined files, keyed by file path (relative to the ZK root).
+    Each entry stores the file's size, mtime_ns, content hash, 'note-type' of the frontmatter,
+     the ids of the notes joined from it and the hashes of its sections.
+    """
+
+    path: str
+    root: str
+    entries: dict[str, dict]
+    dirty: set[str]  # the keys of the entries changed since saved
+    journaled: int  # how many entries appended to the journal since the manifest written in whole
+
+    # the journal is merged into the manifest once longer than the manifest, or than this at least
+    JOURNAL_MIN: int = 1000
+
+    # statistics of the present join
+    hits: int
+    misses: int
+    invalidated: int
+
+    def __init__(self, path: str, root: str):
+        """
+        :param path: The path of the manifest json file
+        :param root: The ZK root path, which the keys are relative to
+        """
+        self.path = path
+        self.root = root
+        self.entries = {}
+        self.dirty = set()
+        self.journaled = 0
+        self.seen: set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.load()
+
+    @property
+    def journal_path(self) -> str:
+        # the entries changed by the partial joins, appended as JSON lines rather than the manifest written in whole
+        return f'{self.path}.journal'
+
+    def restart(self):
+        """
+        Start another join with the entries kept, e.g. in watch mode, rather than load them again
+        """
+        self.seen = set()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def key(self, abs_file: str) -> str:
+        return os.path.relpath(abs_file, self.root).replace(os.sep, '/')
+
+    @staticmethod
+    def hash_file(abs_file: str) -> str:
+        """
+        Hash the content of the file.
+        :param abs_file: The absolute path of the file to hash
+        :return: hex digest of the file content
+        """
+        with open(abs_file, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def load(self):
+        """
+        Load the manifest from json file, start with an empty one if missing or broken.
+        """
+        if not os.path.exists(self.path):
+            logger.info(f'Manifest load: file not found, start with empty manifest "{self.path}"')
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+            logger.info(f'Manifest load: done, {len(self.entries)} entries from "{self.path}"')
+        except (IOError, ValueError) as e:
+            logger.error(f'Manifest load: error, {e}, start with empty manifest "{self.path}"')
+            self.entries = {}
+        self.load_journal()
+
+    def load_journal(self):
+        """
+        Apply the entries appended to the journal after the manifest written, a broken line ends it.
+        """
+        if not os.path.exists(self.journal_path):
+            return
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    key, entry = json.loads(line)
+                    self.entries[key] = entry
+                    self.journaled += 1
+        except (IOError, ValueError) as e:
+            # e.g. the last line cut by a crash, the files of the lines lost are joined again as changed
+            logger.warning(f'Manifest load: journal broken after {self.journaled} entries, {e}')
+            # the next save writes the manifest in whole, rather than appends after the broken line
+            self.journaled = sys.maxsize
+            return
+        logger.info(f'Manifest load: {self.journaled} entries from the journal "{self.journal_path}"')
+
+    def save(self, prune: bool = True):
+        """
+        Write the manifest to json file, the entries of files no longer seen are dropped.
+        After a partial scan, only the entries changed are appended to the journal, while it's short.
+        :param prune: False if only a part of the ZK is scanned, then nothing is dropped
+        """
+        if not prune and self.journaled + len(self.dirty) <= max(self.JOURNAL_MIN, len(self.entries)):
+            self.save_journal()
+            return
+        if prune and self.seen:
+            self.entries = {k: v for k, v in self.entries.items() if k in self.seen}
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                # without indentation, the manifest is as big as the ZK
+                json.dump(self.entries, f, separators=(',', ':'))
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self.dirty = set()
+            self.journaled = 0
+            logger.info(f'Manifest save: done, {len(self.entries)} entries to "{self.path}"')
+        except IOError as e:
+            logger.error(f'Manifest save: error, {e}, manifest path "{self.path}"')
+
+    def save_journal(self):
+        """
+        Append the entries changed since saved to the journal
+        """
+        if not self.dirty:
+            logger.info('Manifest save: nothing changed.')
+            return
+        try:
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps([key, self.entries[key]], separators=(',', ':')) + '\n'
+                             for key in sorted(self.dirty) if key in self.entries)
+            logger.info(f'Manifest save: {len(self.dirty)} entries to the journal "{self.journal_path}"')
+            self.journaled += len(self.dirty)
+            self.dirty = set()
+        except IOError as e:
+            logger.error(f'Manifest save: error, {e}, journal path "{self.journal_path}"')
+
+    def is_unchanged(self, abs_file: str, stat: os.stat_result = None) -> bool:
+        """
+        Check if the file is unchanged since its last join.
+        The size and mtime_ns are compared first, the content hash is compared only when the mtime differs.
+        :param abs_file: The absolute path of the file to check
+        :param stat: stat result of the file if already known
+        :return: True if unchanged (hit), otherwise False (miss or invalidated)
+        """
+        key = self.key(abs_file)
+        self.seen.add(key)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False
+        stat = stat if stat else os.stat(abs_file)
+        if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            self.hits += 1
+            return True
+        if entry['size'] == stat.st_size and entry['hash'] and entry['hash'] == self.hash_file(abs_file):
+            # touched but not modified
+            entry['mtime_ns'] = stat.st_mtime_ns
+            self.dirty.add(key)
+            self.hits += 1
+            return True
+        self.invalidated += 1
+        return False
+
+    def count_miss(self, abs_file: str):
+        """
+        Count the file as new to the manifest (a miss), which is joined by the manifest's joint now.
+        """
+        self.seen.add(self.key(abs_file))
+        self.misses += 1
+
+    def release(self, abs_file: str):
+        """
+        The file is joined by another joint now: its entry is pruned, and its notes become orphans.
+        """
+        self.seen.discard(self.key(abs_file))
+
+    def __contains__(self, abs_file: str) -> bool:
+        return self.key(abs_file) in self.entries
+
+    def record(self, abs_file: str, size: int, mtime_ns: int, digest: str, note_ids: list[int] = None,
+               note_type: str = None, sections: dict[str, str] = None):
+        """
+        Record the state of a joined file, as it was parsed (and written back), rather than as it is now:
+         the file modified since then is joined again next time.
+        :param abs_file: The absolute path of the joined file
+        :param size: The size of the file
+        :param mtime_ns: The mtime of the file, 0 to join it again next time (e.g. write back failed)
+        :param digest: The hash of the file content, '' if unknown, then compared by size and mtime only
+        :param note_ids: The ids of the notes in the file
+        :param note_type: 'note-type' of the frontmatter, '' if missing, None if unknown
+        :param sections: The hashes of the sections in the file, keyed by NoteId and heading path
+        """
+        key = self.key(abs_file)
+        self.seen.add(key)
+        self.dirty.add(key)
+        self.entries[key] = {
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'hash': digest,
+            'note_ids': note_ids if note_ids else [],
+            'note_type': note_type,
+            'sections': sections if sections else {},
+        }
+
+    def section_hashes(self, abs_file: str) -> dict[str, str]:
+        """
+        The hashes of the sections recorded for the file last time, {} if not recorded.
+        """
+        return self.entries.get(self.key(abs_file), {}).get('sections', {})
+
+    def cached_note_type(self, abs_file: str, stat: os.stat_result = None) -> Optional[str]:
+        """
+        Get the 'note-type' recorded for the file, if its size and mtime_ns are the same as recorded.
+        :param abs_file: The absolute path of the file
+        :param stat: stat result of the file if already known
+        :return: 'note-type' of the frontmatter, '' if missing, None if not cached or the file changed
+        """
+        key = self.key(abs_file)
+        entry = self.entries.get(key)
+        if entry is None or entry.get('note_type') is None:
+            return None
+        stat = stat if stat else os.stat(abs_file)
+        if entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            return None
+        self.seen.add(key)
+        return entry['note_type']
+
+    def lost_note_ids(self, abs_file: str, note_ids: list[int]) -> list[int]:
+        """
+        The note ids recorded for the file last time, which are gone from the file now.
+        :param abs_file: The absolute path of the file
+        :param note_ids: The ids of the notes in the file now
+        """
+        entry = self.entries.get(self.key(abs_file), {})
+        present = set(note_ids)
+        return [note_id for note_id in entry.get('note_ids', []) if note_id not in present]
+
+    def recorded_note_ids(self, abs_file: str) -> list[int]:
+        """
+        The note ids recorded for the file last time, [] if not recorded.
+        """
+        return self.entries.get(self.key(abs_file), {}).get('note_ids', [])
+
+    def present_note_ids(self, seen_only: bool = True) -> set[int]:
+        """
+        The note ids recorded for the files seen in the present join, or for all the files if not seen_only.
+        """
+        return {note_id for key, entry in self.entries.items() if not seen_only or key in self.seen
+                for note_id in entry.get('note_ids', [])}
+
+    def unseen_note_ids(self) -> list[int]:
+        """
+        The note ids recorded for the files not seen in the present join (deleted or renamed), before pruned.
+        """
+        return [note_id for key, entry in self.entries.items() if key not in self.seen
+                for note_id in entry.get('note_ids', [])]
+
+    def summary(self) -> str:
+        return f'{self.hits} unchanged (hit), {self.misses} new (miss), {self.invalidated} modified (invalidated)'
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+Media importer
+Import media files to the collection's media folder, deduplicated by content hash.
+"""
+
+import hashlib
+import logging
+import os
+
+from anki.collection import Collection
+
+
+logger = logging.getLogger(__name__)
+
+
+class MediaImporter:
+    """
+    Write media bytes straight to the media folder, without temporary copies.
+    An in-memory index of the content hashes makes every image read and hashed only once per join.
+    """
+
+    col: Collection
+    hash_index: dict[str, str]  # content hash -> media filename
+    path_index: dict[str, str]  # absolute source path -> media filename
+    new_count: int
+
+    def __init__(self, col: Collection):
+        self.col = col
+        self.hash_index = {}
+        self.path_index = {}
+        self.new_count = 0
+
+    def import_file(self, src: str, std_name: str) -> str:
+        """
+        Import a media file, unless the same content is imported already.
+        :param src: The absolute path of the media file
+        :param std_name: The desired filename in the media folder
+        :return: The filename in the media folder, which could differ from std_name
+        """
+        fname = self.path_index.get(src)
+        if fname:
+            return fname
+        with open(src, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        fname = self.hash_index.get(digest)
+        if fname:
+            logger.debug('Media-Import: same content imported already, media filename "%s"', fname)
+        elif self.is_imported(std_name, data, digest):
+            fname = std_name
+            logger.debug('Media-Import: img already imported, skip. img filename "%s"', std_name)
+        else:
+            # Anki renames the file if the name is taken by different content
+            fname = self.col.media.write_data(std_name, data)
+            self.new_count += 1
+            logger.debug('Media-Import: add img success, img filename "%s"', fname)
+        self.hash_index[digest] = fname
+        self.path_index[src] = fname
+        return fname
+
+    def plan_file(self, src: str, std_name: str) -> int:
+        """
+        Check if the media file would be imported, the same as import_file() but without writing it.
+        :param src: The absolute path of the media file
+        :param std_name: The desired filename in the media folder
+        :return: The bytes that would be written, 0 if the same content is imported already
+        """
+        if src in self.path_index:
+            return 0
+        with open(src, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        size = 0 if digest in self.hash_index or self.is_imported(std_name, data, digest) else len(data)
+        self.hash_index.setdefault(digest, std_name)
+        self.path_index[src] = std_name
+        return size
+
+    def is_imported(self, fname: str, data: bytes, digest: str) -> bool:
+        """
+        Check if the media folder already has the file with the same content
+        """
+        if not self.col.media.have(fname):
+            return False
+        path = os.path.join(self.col.media.dir(), fname)
+        if os.path.getsize(path) != len(data):
+            return False
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest() == digest
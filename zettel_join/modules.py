@@ -1,7 +1,11 @@
 """
 Install packages to local libray since they are not included in Anki
+The check is cheap (no import, no pip), the install runs in background and never blocks Anki's startup.
 """
 
+import functools
+import importlib
+import importlib.util
 import logging
 import os
 import subprocess
@@ -26,28 +30,75 @@ INDEX_URL = 'https://mirrors.aliyun.com/pypi/simple'
 # -t, --target <dir>
 #   Install packages into <dir>. By default, this will not replace existing files/folders in <dir>.
 #   Use --upgrade to replace existing packages in <dir> with new versions.
-TARGET_DIR = 'lib'
+TARGET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
 
+# the install is running in background
+installing: bool = False
 
-def check_modules():
+
+def check_modules() -> list[str]:
     """
-    check if modules exist, install module if not
+    Check if the modules can be imported, without importing them
+    :return: names of the missing modules
     """
-    logger.debug(f'CWD: {os.getcwd()}')
     # sys.path contains a list of directories that the interpreter will search in for the required module.
-    sys.path.append(os.path.join(os.getcwd(), TARGET_DIR))
-    logger.info(f'Import module - add path to sys.path: {sys.path[-1]}')
-    # download modules
-    for module_name in MODULE_MAP.keys():
-        if os.path.exists(os.path.join(TARGET_DIR, module_name)):
-            logger.debug(f'Import module - modules already exist: "{module_name}".')
-        else:
-            logger.info(
-                f'Import module - module not found, install package with pip: "{MODULE_MAP[module_name]}".')
-            command = ['pip', 'install', '-i', INDEX_URL, '--target', TARGET_DIR, MODULE_MAP[module_name]]
-            subprocess.check_call(command)
-            # todo not let the command-line show up while install package, and print the output to log
-    logger.debug('Import module finished.\n')
-
-
-check_modules()
+    if TARGET_DIR not in sys.path:
+        sys.path.append(TARGET_DIR)
+        logger.info(f'Import module - add path to sys.path: {sys.path[-1]}')
+    # the packages installed since last check are found
+    importlib.invalidate_caches()
+    missing: list[str] = [name for name in MODULE_MAP if importlib.util.find_spec(name) is None]
+    logger.debug(f'Import module - missing modules: {missing}')
+    return missing
+
+
+def install_packages(packages: list[str]):
+    """
+    Install the packages with pip, the output goes to the log
+    """
+    command = ['pip', 'install', '-i', INDEX_URL, '--target', TARGET_DIR] + packages
+    logger.info(f'Import module - install packages with pip: {packages}.')
+    # no console window shows up on Windows
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                            creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+    logger.info(f'Import module - pip output:\n{result.stdout}')
+    result.check_returncode()
+
+
+def install_in_background() -> bool:
+    """
+    Install the missing packages in background, inside Anki.
+    :return: False if nothing to install
+    """
+    global installing
+    missing = check_modules()
+    if not missing or installing:
+        return False
+    from aqt import mw
+    installing = True
+    mw.taskman.run_in_background(
+        functools.partial(install_packages, [MODULE_MAP[name] for name in missing]),
+        on_installed,
+    )
+    return True
+
+
+def on_installed(future):
+    global installing
+    installing = False
+    try:
+        future.result()
+        logger.info('Import module finished.\n')
+    except Exception as e:
+        logger.error(f'Import module - install failed, {e}')
+
+
+def ready() -> bool:
+    """
+    Check if the modules are ready to join with, install the missing ones (again, if failed before) if not
+    """
+    if not installing and not install_in_background():
+        return True
+    from aqt.utils import tooltip
+    tooltip('ZK Join: installing the required packages, please try again later.')
+    return False
@@ -0,0 +1,743 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+Parse stage of the join
+Turn MD files into picklable note specs. Nothing here depends on Anki,
+ so files could be parsed in worker processes while the main process does the collection writes.
+"""
+
+import frontmatter
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import yaml
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional
+
+from bs4 import BeautifulSoup, PageElement, Tag, NavigableString, Comment
+
+from .preprocess import Preprocessor
+from .render import RenderEngine
+from .section import Section, SectionTree, SourceSection, blank_sections, chunk_sections, chunk_source, split_source
+from .timing import Span, Timings
+
+
+logger = logging.getLogger(__name__)
+
+
+# The memory to parse a char of MD: rendered HTML, the parse tree and the note texts, measured ~60 bytes
+PARSE_BYTES_PER_CHAR = 64
+
+
+def budget_chars(budget_mb: int) -> int:
+    """
+    :param budget_mb: the memory budget of parsing a file in MB, 0 for no limit
+    :return: the MD chars that can be parsed at once within the budget, 0 for no limit
+    """
+    return budget_mb * 1024 * 1024 // PARSE_BYTES_PER_CHAR if budget_mb and budget_mb > 0 else 0
+
+
+class NoteSpec:
+    """
+    Everything needed to create an Anki-note from a heading section, picklable.
+    """
+
+    __slots__ = ('root', 'text', 'extra', 'tags', 'media', 'heading', 'line_start', 'line_end', 'cloze_count',
+                 'note_id', 'section_key')
+
+    root: str
+    text: str
+    extra: str
+    tags: list[str]
+    media: list[tuple[str, str]]  # (absolute image path, standard media filename)
+    heading: str  # heading text
+    line_start: int  # source line span of the section in the MD file (frontmatter included), -1 if unavailable
+    line_end: int
+    cloze_count: int
+    note_id: int  # id of the imported note (commented after the heading), 0 for new note
+    section_key: str  # the key of the section hash, '' if unavailable
+
+    def __init__(self, root: str, text: str, extra: str, tags: list[str], media: list[tuple[str, str]],
+                 heading: str, line_start: int, line_end: int, cloze_count: int, note_id: int = 0,
+                 section_key: str = ''):
+        self.root = root
+        self.text = text
+        self.extra = extra
+        self.tags = tags
+        self.media = media
+        self.heading = heading
+        self.line_start = line_start
+        self.line_end = line_end
+        self.cloze_count = cloze_count
+        self.note_id = note_id
+        self.section_key = section_key
+
+
+class FileSpec:
+    """
+    The parse result of a MD file, picklable.
+    """
+
+    __slots__ = ('abs_file', 'deck_name', 'mtime_ns', 'joinable', 'note_type', 'metadata', 'notes', 'note_ids',
+                 'sections', 'timings', 'size', 'digest')
+
+    abs_file: str
+    deck_name: str
+    mtime_ns: int  # mtime of the file while parsed, recorded in the manifest
+    joinable: bool
+    note_type: Optional[str]  # 'note-type' of the frontmatter, '' if missing, None if unknown
+    metadata: dict  # frontmatter metadata
+    notes: list[NoteSpec]  # new notes to add, the already-imported included only in update mode
+    note_ids: list[int]  # ids of all the imported notes commented in the file
+    sections: dict[str, str]  # hashes of all the sections, keyed by NoteId and heading path, {} if unavailable
+    timings: Timings  # seconds of each parse stage
+    size: int  # size of the file while parsed
+    digest: str  # hash of the bytes parsed, to check if modified before written back, '' if not read in whole
+
+    def __init__(self, abs_file: str, deck_name: str, mtime_ns: int = 0, joinable: bool = False,
+                 note_type: Optional[str] = None, metadata: dict = None, notes: list[NoteSpec] = None,
+                 note_ids: list[int] = None, sections: dict[str, str] = None, timings: Timings = None,
+                 size: int = 0, digest: str = ''):
+        self.abs_file = abs_file
+        self.deck_name = deck_name
+        self.mtime_ns = mtime_ns
+        self.joinable = joinable
+        self.note_type = note_type
+        self.metadata = metadata if metadata else {}
+        self.notes = notes if notes else []
+        self.note_ids = note_ids if note_ids else []
+        self.sections = sections if sections else {}
+        self.timings = timings if timings else {}
+        self.size = size
+        self.digest = digest
+
+
+def read(file: str) -> str:
+    """
+    Open the file and read the text content.
+    :param file: The path of the file to read from.
+    :return: The text content of the file.
+    """
+    try:
+        with open(file, 'r', encoding='utf-8') as f:
+            file_content = f.read()
+            logger.debug('File read: done, filepath "%s"', file)
+            return file_content
+    except FileNotFoundError:
+        logger.error(f'File read: error, file not found, filepath "{file}"')
+    except IOError as e:
+        logger.error(f'File read: error, {e}, filepath "{file}"')
+    return ''
+
+
+def read_source(file: str) -> tuple[str, str]:
+    """
+    Read the text content, with the hash of the bytes read, which the file is recorded by.
+    :param file: The path of the file to read from.
+    :return: The text content of the file (newlines translated, the same as read()) and the hash,
+     '' and '' if unreadable
+    """
+    try:
+        with open(file, 'rb') as f:
+            data = f.read()
+        logger.debug('File read: done, filepath "%s"', file)
+    except FileNotFoundError:
+        logger.error(f'File read: error, file not found, filepath "{file}"')
+        return '', ''
+    except IOError as e:
+        logger.error(f'File read: error, {e}, filepath "{file}"')
+        return '', ''
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n'), hashlib.sha1(data).hexdigest()
+
+
+# Frontmatter sniffing, read no more than the leading YAML block
+SNIFF_CHUNK_SIZE: int = 4096
+SNIFF_MAX_SIZE: int = 65536
+FRONTMATTER_BOUNDARY_RE = re.compile(r'^-{3,}\s*$', flags=re.MULTILINE)  # the same as python-frontmatter
+# a top-level 'note-type' key with a plain or simply quoted scalar value
+NOTE_TYPE_RE = re.compile(r'^note-type[ \t]*:[ \t]*(?P<value>.*?)[ \t]*$', flags=re.MULTILINE)
+PLAIN_SCALAR_RE = re.compile(r'[\w][\w .()\-]*|\'[^\'\n]*\'|"[^"\\\n]*"')
+
+
+def sniff_note_type(abs_file: str) -> Optional[str]:
+    """
+    Get the 'note-type' of the frontmatter, with a bounded read of the leading YAML block only.
+    A cheap scan is enough for the simple block, YAML is loaded (the block only) if the value is not a plain scalar.
+    :param abs_file: The absolute path of the MD file
+    :return: the note type, '' if no frontmatter or no 'note-type' in it,
+     None if undecided (block too long, or unreadable), which is left to the full parse
+    """
+    try:
+        with open(abs_file, 'rb') as f:
+            head = f.read(SNIFF_CHUNK_SIZE)
+            # python-frontmatter strips the text before detecting the block
+            if not head.lstrip(b'\xef\xbb\xbf \t\r\n').startswith(b'---'):
+                return ''
+            while True:
+                text = head.decode('utf-8', errors='ignore').lstrip('\ufeff').strip()
+                boundaries = list(FRONTMATTER_BOUNDARY_RE.finditer(text))
+                if len(boundaries) >= 2 and boundaries[0].start() == 0:
+                    break
+                chunk = f.read(SNIFF_CHUNK_SIZE)
+                if not chunk or len(head) >= SNIFF_MAX_SIZE:
+                    return None
+                head += chunk
+    except IOError as e:
+        logger.error(f'File-sniff: error, {e}, filepath "{abs_file}"')
+        return None
+    block = text[boundaries[0].end():boundaries[1].start()]
+    if 'note-type' not in block:
+        return ''
+    m = NOTE_TYPE_RE.search(block)
+    if m and PLAIN_SCALAR_RE.fullmatch(m.group('value')):
+        return m.group('value').strip('\'"')
+    # complex block, e.g. quoted key, block scalar or anchor
+    try:
+        metadata = yaml.safe_load(block)
+    except yaml.YAMLError:
+        return None
+    if not isinstance(metadata, dict) or 'note-type' not in metadata:
+        return ''
+    return str(metadata['note-type'])
+
+
+class ClozeSelector:
+    """
+    The cloze selection rules, compiled once, which select the cloze tags in a single walk over the scope.
+    Picklable, so that it's shared with the worker processes.
+    """
+
+    # the same as the default config
+    DEFAULT_RULES: list[dict] = [
+        {'tags': ['strong', 'em', 'td', 'li']},
+        {'tags': ['div'], 'class': 'arithmatex'},
+    ]
+    DEFAULT_EXCLUDED_TAGS: list[str] = ['blockquote']
+
+    rule_count: int
+    by_name: dict[str, list[tuple[int, Optional[str]]]]  # tag name -> (rule index, CSS class required)
+    excluded_tags: frozenset[str]  # the subtrees never walked into
+
+    def __init__(self, rules: list[dict] = None, excluded_tags: list[str] = None):
+        """
+        :param rules: in the order of cloze numbers, each as {'tags': [tag names], 'class': CSS class (optional)}.
+         In a rule, the tags are selected in document order.
+        :param excluded_tags: the tags whose contents never get cloze-deleted
+        """
+        rules = self.DEFAULT_RULES if rules is None else rules
+        excluded_tags = self.DEFAULT_EXCLUDED_TAGS if excluded_tags is None else excluded_tags
+        self.rule_count = len(rules)
+        self.by_name = {}
+        for index, rule in enumerate(rules):
+            for name in rule.get('tags', []):
+                self.by_name.setdefault(name, []).append((index, rule.get('class')))
+        self.excluded_tags = frozenset(excluded_tags)
+
+    def select(self, scope: list[PageElement]) -> list[Tag]:
+        """
+        Walk the scope in document order, the excluded subtrees pruned
+        :param scope: nodes to select in, the top-level nodes themselves included
+        :return: the selected tags, grouped by rule in order, each group in document order
+        """
+        selected: list[list[Tag]] = [[] for _ in range(self.rule_count)]
+        stack: list[PageElement] = list(reversed(scope))
+        while stack:
+            node = stack.pop()
+            if not isinstance(node, Tag) or node.name in self.excluded_tags:
+                continue
+            for index, class_ in self.by_name.get(node.name, ()):
+                if class_ is None or class_ in node.get('class', ()):
+                    selected[index].append(node)
+                    break
+            stack.extend(reversed(node.contents))
+        return [tag for group in selected for tag in group]
+
+
+def find_all_in(scope: list[PageElement], name, class_: str = None) -> list[Tag]:
+    """
+    find_all() over a list of nodes, the top-level nodes themselves included
+    :param scope: nodes to search in
+    :param name: tag name or list of tag names to find
+    :param class_: CSS class the tags must have, optional
+    :return: list of found tags in document order
+    """
+    names: list[str] = name if isinstance(name, list) else [name]
+    found: list[Tag] = []
+    for node in scope:
+        if not isinstance(node, Tag):
+            continue
+        if node.name in names and (class_ is None or class_ in node.get('class', [])):
+            found.append(node)
+        found += node.find_all(names, class_=class_) if class_ else node.find_all(names)
+    return found
+
+
+class ClozeParser:
+    """
+    Parse MD files for the cloze model.
+    """
+
+    model_name: str
+    update: bool  # parse the already-imported notes as well, to update them
+    render_engine: RenderEngine
+    preprocessor: Preprocessor
+    selector: ClozeSelector
+    chunk_chars: int  # the bigger files are parsed in chunks of this many chars at most, 0 for no limit
+    timings: Timings  # seconds of each parse stage of the present file
+
+    def __init__(self, model_name: str, update: bool = False, selector: ClozeSelector = None, chunk_chars: int = 0):
+        self.model_name = model_name
+        self.update = update
+        self.selector = selector if selector else ClozeSelector()
+        self.chunk_chars = chunk_chars
+        self.render_engine = RenderEngine()
+        self.preprocessor = Preprocessor()
+        self.timings = {}
+
+    """ ========== ========== ========== ========== ========== ========== ========== ========== ========== ==========
+    file-level
+    """
+
+    def parse_file(self, abs_file: str, deck_name: str, known_sections: dict[str, str] = None,
+                   note_type: Optional[str] = None) -> FileSpec:
+        """
+        Parse MD file to note specs.
+        The sections unchanged since last join are skipped before rendering, so are the imported ones if not update.
+        :param abs_file: The absolute path of the file to parse
+        :param deck_name: The name of the deck where the MD file is joined to
+        :param known_sections: the section hashes recorded at last join, None to parse every section
+        :param note_type: 'note-type' sniffed from the frontmatter by the scan, None if undecided (or not sniffed)
+        :return: FileSpec, with joinable False if the file is not for the model
+        """
+        logger.debug('File-parse: Handling with "%s"', abs_file)
+        self.timings = timings = {}
+        with Span(timings, 'read'):
+            # before read, so the file is recorded as modified if modified while read
+            stat = os.stat(abs_file)
+            mtime_ns, size = stat.st_mtime_ns, stat.st_size
+        # Skip if not joinable, without reading the whole file
+        if note_type is not None and not self.match_note_type(note_type):
+            logger.info('File-parse: Skip file since it is not joinable.')
+            return FileSpec(abs_file, deck_name, mtime_ns, note_type=note_type, timings=timings, size=size)
+        with Span(timings, 'read'):
+            raw, digest = read_source(abs_file)
+        with Span(timings, 'frontmatter'):
+            post = frontmatter.loads(raw)
+        logger.debug('File load: Done, frontmatter metadata of above file is %s', post.metadata)
+        note_type = str(post['note-type']) if 'note-type' in post.metadata else ''
+        if not self.check_joinable(post):
+            logger.info('File-parse: Skip file since it is not joinable.')
+            return FileSpec(abs_file, deck_name, mtime_ns, note_type=note_type, timings=timings, size=size,
+                            digest=digest)
+        # the content is the stripped tail of the raw text, count the lines before it (frontmatter included)
+        line_offset = raw.count('\n', 0, len(raw.rstrip()) - len(post.content))
+        # Split the source into sections, and skip the ones which can't make any change
+        with Span(timings, 'section'):
+            sources: list[SourceSection] = split_source(post.content, self.section_salt())
+            changed: list[SourceSection] = [s for s in sources if not self.is_skippable(s, known_sections)]
+        sections: dict[str, str] = {source.key: source.digest for source in sources}
+        if sources and not changed:
+            logger.info('File-parse: Done, all the %d sections skipped.', len(sources))
+            return FileSpec(abs_file, deck_name, mtime_ns, True, note_type, post.metadata,
+                            note_ids=[source.note_id for source in sources if source.note_id], sections=sections,
+                            timings=timings, size=size, digest=digest)
+        file_dir = os.path.dirname(abs_file)
+        to_parse: set[SourceSection] = set(changed)
+        notes: list[NoteSpec] = []
+        note_ids: list[int] = []
+        parsed: Optional[set[SourceSection]] = None
+        streamed = False
+        if self.chunk_chars and len(post.content) > self.chunk_chars and sources:
+            # too big to parse at once within the memory budget
+            parsed = self.parse_chunks(post.content, sources, to_parse, file_dir, deck_name, notes, note_ids)
+            streamed = parsed is not None
+            if not streamed:
+                logger.warning('File-parse: sections mismatch, the file is parsed at once, beyond the memory budget.')
+                notes, note_ids = [], []
+        if not streamed:
+            parsed = self.parse_whole(post.content, sources, to_parse, file_dir, deck_name, notes, note_ids)
+        if parsed is None:
+            # the sections not told apart in the source, no hash recorded
+            sections = {}
+        else:
+            # the ids of the notes not parsed, the others found after their headings
+            note_ids += [source.note_id for source in sources if source.note_id and source not in parsed]
+        for note in notes:
+            if note.line_start >= 0:
+                note.line_start += line_offset
+                note.line_end += line_offset
+        logger.info('File-parse: Done, with %d notes parsed, %d of %d sections skipped%s.',
+                    len(notes), len(sources) - len(parsed) if parsed is not None else 0, len(sources),
+                    ', streamed' if streamed else '')
+        return FileSpec(abs_file, deck_name, mtime_ns, True, note_type, post.metadata, notes, note_ids, sections,
+                        timings, size, digest)
+
+    def parse_whole(self, content: str, sources: list[SourceSection], to_parse: set[SourceSection], file_dir: str,
+                    deck_name: str, notes: list[NoteSpec], note_ids: list[int]) -> Optional[set[SourceSection]]:
+        """
+        Parse the sections of the MD content at once. The sections to parse are rendered,
+         along with the headings of their ancestors for the heading paths, the others are blanked out.
+        :param content: MD content
+        :param sources: the source sections of the content
+        :param to_parse: the source sections to parse
+        :param file_dir: The directory of the MD file, which relative image paths are resolved against
+        :param deck_name: The name of the deck where the MD file is joined to
+        :param notes: the note specs parsed are appended to
+        :param note_ids: the ids of the imported notes parsed are appended to
+        :return: the source sections parsed, None if the headings not split in the source as rendered,
+         then every section is parsed
+        """
+        rendered: set[SourceSection] = set(to_parse)
+        for source in to_parse:
+            parent = source.parent
+            while parent and parent not in rendered:
+                rendered.add(parent)
+                parent = parent.parent
+        blanked = content
+        if len(to_parse) < len(sources):
+            blanked = blank_sections(content, [s for s in sources if s in rendered and s not in to_parse],
+                                     [s for s in sources if s not in rendered])
+        tree = self.make_tree(blanked)
+        tree_sources: list[SourceSection] = [s for s in sources if s in rendered]
+        if len(tree) != len(tree_sources) and blanked is not content:
+            # the whole content is rendered again
+            logger.info('File-parse: sections mismatch, parse every section.')
+            tree.decompose()
+            tree = self.make_tree(content)
+            tree_sources = sources
+            to_parse = set(sources)
+        aligned = len(tree) == len(tree_sources)
+        self.parse_tree(tree, tree_sources if aligned else [], to_parse, file_dir, deck_name, notes, note_ids)
+        tree.decompose()
+        return to_parse if aligned else None
+
+    def parse_chunks(self, content: str, sources: list[SourceSection], to_parse: set[SourceSection], file_dir: str,
+                     deck_name: str, notes: list[NoteSpec], note_ids: list[int]) -> Optional[set[SourceSection]]:
+        """
+        Parse the sections of the MD content chunk by chunk, each rendered alone with the headings of its ancestors.
+        The parse tree of a chunk is freed before the next one, which bounds the memory by the chunk size.
+        The parameters are the same as parse_whole().
+        :return: the source sections parsed, None if the headings of a chunk not split in the source as rendered
+        """
+        lines = content.split('\n')
+        for chunk in chunk_sections([s for s in sources if s in to_parse], lines, self.chunk_chars):
+            chunk_content, chunk_sources = chunk_source(lines, chunk)
+            tree = self.make_tree(chunk_content)
+            if len(tree) != len(chunk_sources):
+                tree.decompose()
+                return None
+            # the ancestors are there for the heading paths only, parsed in their own (earlier) chunk if to parse
+            self.parse_tree(tree, chunk_sources, set(chunk), file_dir, deck_name, notes, note_ids)
+            tree.decompose()
+            logger.debug('File-parse: chunk of %d sections parsed, %d chars.', len(chunk), len(chunk_content))
+        return to_parse
+
+    def parse_tree(self, tree: SectionTree, tree_sources: list[SourceSection], to_parse: set[SourceSection],
+                   file_dir: str, deck_name: str, notes: list[NoteSpec], note_ids: list[int]):
+        """
+        Parse the sections of the tree to note specs.
+        :param tree: the section tree rendered
+        :param tree_sources: the source sections matching the sections of the tree, [] if unknown to parse every one
+        :param to_parse: the source sections to parse, the others in the tree are there for the heading paths
+        :param file_dir: The directory of the MD file, which relative image paths are resolved against
+        :param deck_name: The name of the deck where the MD file is joined to
+        :param notes: the note specs parsed are appended to
+        :param note_ids: the ids of the imported notes parsed are appended to
+        """
+        for n, section in enumerate(tree):
+            source = tree_sources[n] if tree_sources else None
+            if source and source not in to_parse:
+                continue
+            # Check if the note has been imported (commented with note_id)
+            note_id = self.get_commented_noteid(section.heading)
+            if note_id:
+                note_ids.append(note_id)
+                if not self.update:
+                    logger.debug('Note-parse: note already imported: "%s"', section.root)
+                    continue
+            if source:
+                # the line span in the source, rather than in the content rendered
+                section.line_start, section.line_end = source.line_start, source.line_end
+            note = self.parse_note(section, file_dir, deck_name, note_id)
+            if note:
+                note.section_key = source.key if source else ''
+                notes.append(note)
+
+    def make_tree(self, content: str) -> SectionTree:
+        """
+        Standardize, render and split the MD content into sections
+        :param content: MD content
+        :return: the section tree, with source line spans if the headings match
+        """
+        # standardize keeps the lines, so the source line spans stay valid
+        with Span(self.timings, 'standardize'):
+            content = self.do_standardize(content)
+        soup: BeautifulSoup = self.make_soup(content)
+        with Span(self.timings, 'section'):
+            return SectionTree(soup, content)
+
+    def section_salt(self) -> str:
+        """
+        The parser settings which the notes depend on, hashed along with the sections
+        """
+        return repr((self.update, sorted(self.selector.by_name.items()), sorted(self.selector.excluded_tags)))
+
+    def is_skippable(self, source: SourceSection, known_sections: Optional[dict[str, str]]) -> bool:
+        """
+        Check if the section can be skipped before rendering
+        :param source: the section of the source
+        :param known_sections: the section hashes recorded at last join
+        :return: True if unchanged since last join, or imported already while not update
+        """
+        if source.note_id and not self.update:
+            return True
+        return known_sections is not None and known_sections.get(source.key) == source.digest
+
+    def check_joinable(self, post: frontmatter.Post) -> bool:
+        """
+        Check the frontmatter metadata, see if joinable with current Joint
+        :param post: frontmatter.Post
+        :return: True if joinable, otherwise False
+        """
+        # try to fetch 'note-type'
+        try:
+            note_type: str = str(post['note-type'])
+            logger.debug('File-parse: "note-type" is "%s" in the frontmatter.', note_type)
+            # judge if match current joint
+            return self.match_note_type(note_type)
+        except KeyError:  # note-type key not exists
+            logger.debug('File-parse: "note-type" metadata missing in the frontmatter.')
+            return False
+
+    def match_note_type(self, note_type: str) -> bool:
+        """
+        Check if the 'note-type' of the frontmatter matches current Joint
+        :param note_type: 'note-type' of the frontmatter, '' if missing
+        """
+        if not note_type:
+            return False
+        return note_type == self.model_name or note_type in self.model_name
+
+    def do_standardize(self, content: str) -> str:
+        """
+        standardize markdown content to avoid some render error.
+        e.g. replace ':emoji-alia:' to emoji, code and math untouched.
+        :param content: MD content
+        :return: standardized MD content
+        """
+        return self.preprocessor.run(content)
+
+    def make_soup(self, content: str) -> BeautifulSoup:
+        """
+        Transfer md file to html, then using bs4 to parse
+        :param content: md file content
+        :return: beautifulsoup (parse tree) of the file
+        """
+        # parse markdown with the reused render engine
+        with Span(self.timings, 'render'):
+            html = self.render_engine.render(content)
+        with Span(self.timings, 'soup'):
+            return BeautifulSoup(html, 'html.parser')
+
+    """ ========== ========== ========== ========== ========== ========== ========== ========== ========== ==========
+    note-level
+    """
+
+    def parse_note(self, section: Section, file_dir: str, deck_name: str, note_id: int = 0) -> Optional[NoteSpec]:
+        """
+        Parse MD file section to note spec
+        :param section: heading section from the section tree, which corresponds to an Anki-note
+        :param file_dir: The directory of the MD file, which relative image paths are resolved against
+        :param deck_name: The name of the deck where the MD file is joined to
+        :param note_id: The id of the imported note commented after the heading, 0 if not imported yet
+        :return: NoteSpec, None if no cloze-deletion found
+        """
+        # get heading root (heading path)
+        root_field = section.root
+        logger.debug('Note-parse: Handling with note-heading: "%s"', root_field)
+        # parse note scope
+        extra_field_scope = self.parse_extra_field_scope(section)
+        text_field_scope = self.parse_text_field_scope(section)
+        # cloze deletion
+        new_cloze_count: int = 0
+        with Span(self.timings, 'cloze'):
+            for cloze_tag in self.do_cloze_selection(cloze_scope=text_field_scope):
+                if self.do_cloze_deletion(cloze_tag, new_cloze_count + 1):
+                    new_cloze_count += 1
+        # check if the note has cloze-deletion
+        if not new_cloze_count:
+            logger.debug('Note-parse: no cloze-deletion found, skip.')
+            return None
+        # Media files referred, which are imported in the collection stage
+        media = self.parse_media(extra_field_scope, file_dir, deck_name)
+        media += self.parse_media(text_field_scope, file_dir, deck_name)
+        tags: list[str] = ['marked'] if '⭐' in root_field else []
+        return NoteSpec(
+            root=root_field,
+            text=''.join(str(node) for node in text_field_scope).strip(),
+            extra=''.join(str(node) for node in extra_field_scope).strip(),
+            tags=tags,
+            media=media,
+            heading=section.heading.text,
+            line_start=section.line_start,
+            line_end=section.line_end,
+            cloze_count=new_cloze_count,
+            note_id=note_id,
+        )
+
+    @staticmethod
+    def parse_extra_field_scope(section: Section) -> list[PageElement]:
+        """
+        Extract the blockquote tags to extra field
+        :param section: heading section of the note
+        :return: nodes of extra field scope
+        """
+        # Find all the top-level blockquote tags, join them as the extra field
+        return [node for node in section.body if node.name == 'blockquote']
+
+    @staticmethod
+    def parse_text_field_scope(section: Section) -> list[PageElement]:
+        """
+        Parse the text field scope
+        :param section: heading section of the note
+        :return: nodes of text field scope, top-level blockquote tags excluded (which belong to "Extra" field),
+         top-level comments excluded as well (e.g. NoteId comment)
+        """
+        return [node for node in section.body if node.name != 'blockquote' and not isinstance(node, Comment)]
+
+    @staticmethod
+    def parse_media(scope: list[PageElement], file_dir: str, deck_name: str) -> list[tuple[str, str]]:
+        """
+        Find the media files referred in the scope, for now, only image media supported.
+        Since folders inside the media folder are not supported,
+         the 'src' attribute of <img> tag is modified to the standard media filename.
+        :param scope: the nodes that contain img tags
+        :param file_dir: The directory of the MD file, which relative image paths are resolved against
+        :param deck_name: The name of the deck where the MD file is joined to
+        :return: list of (absolute image path, standard media filename)
+        """
+        media: list[tuple[str, str]] = []
+        for img_tag in find_all_in(scope, 'img'):
+            src = img_tag.get('src', None)
+            # continue if src attribute missing
+            if not src:
+                logger.debug('Media-parse: img src attr missing, src="%s"', src)
+                continue
+            img = os.path.normpath(os.path.join(file_dir, src))  # join() keeps src if absolute
+            # continue if file not exist
+            if not os.path.exists(img):
+                logger.debug('Media-parse: image file not exist, img path "%s"', img)
+                continue
+            std_name = '.'.join(deck_name.split(sep='::') + [os.path.basename(img)])
+            img_tag['src'] = std_name
+            media.append((img, std_name))
+        return media
+
+    @staticmethod
+    def get_commented_noteid(note_heading: Tag) -> int:
+        """
+        Get the noteid from the comment right after the heading tag
+        :param note_heading:
+        :return: note id, 0 if not commented
+        """
+        comm = note_heading.next_sibling
+        while comm and isinstance(comm, NavigableString):
+            if isinstance(comm, Comment):
+                break
+            else:
+                comm = comm.next_sibling
+        else:
+            return 0
+        m = re.fullmatch(
+            r'\s*NoteId:\s*(?P<note_id>[0-9]{13})\s*',
+            comm,
+            flags=re.IGNORECASE
+        )
+        note_id = int(m.group('note_id')) if m else 0
+        return note_id
+
+    """ ========== ========== ========== ========== ========== ========== ========== ========== ========== ==========
+    cloze-level
+    """
+
+    def do_cloze_selection(self, cloze_scope: list[PageElement]) -> list[Tag]:
+        """
+        Select cloze on the text field
+        :param cloze_scope: nodes of the text field scope
+        :return: list of cloze tags, in the order of cloze numbers
+        """
+        # avoid selecting cloze-deletion in blockquote tags (by default config)
+        return self.selector.select(cloze_scope)
+
+    @staticmethod
+    def do_cloze_deletion(cloze_tag: Tag, cloze_no: int) -> bool:
+        """
+        Do cloze-deletion on the text field
+        :param cloze_tag: Tag waiting for cloze-deletion
+        :param cloze_no: cloze number which is unique in the note
+        :return: True if cloze deletion was successful, False otherwise
+        """
+        if not cloze_tag.string:  # skip empty tag
+            return False
+        elif cloze_tag.string.strip() == '':  # skip empty tag
+            return False
+        if len(cloze_tag.contents) > 1:  # skip if including child tag(s)
+            return False
+        cloze_tag.string = '{{c' + str(cloze_no) + ':: ' + cloze_tag.string + '}}'
+        # add math wrap manually
+        if cloze_tag.has_attr('class') and cloze_tag.attrs['class'] == 'arithmatex':
+            cloze_tag.contents[0].insert_before('\\[')
+            cloze_tag.contents[-1].insert_after('\\]')
+        return True
+
+
+""" ========== ========== ========== ========== ========== ========== ========== ========== ========== ==========
+module-level functions
+"""
+
+# the parser of a worker process, set up by the pool initializer
+_worker_parser: ClozeParser = None
+
+
+def _init_worker(model_name: str, update: bool, selector: ClozeSelector, chunk_chars: int):
+    global _worker_parser
+    _worker_parser = ClozeParser(model_name, update, selector, chunk_chars)
+
+
+def _parse_in_worker(abs_file: str, deck_name: str, known_sections: Optional[dict[str, str]],
+                     note_type: Optional[str]) -> FileSpec:
+    return _worker_parser.parse_file(abs_file, deck_name, known_sections, note_type)
+
+
+def parse_files(parser: ClozeParser, jobs: list[tuple[str, str, Optional[str]]], workers: int = 0,
+                known_sections: dict[str, dict[str, str]] = None) -> Iterator[FileSpec]:
+    """
+    Parse the files in the order of jobs, serially or with a process pool.
+    :param parser: the parser used in serial mode, whose settings are shared with the workers
+    :param jobs: list of (absolute file path, deck name, note type sniffed by the scan)
+    :param workers: How many worker processes to use, 0 or 1 means parsing in the present process
+    :param known_sections: the section hashes recorded at last join, by absolute file path
+    :return: iterator of FileSpec, in the same order as jobs
+    """
+    known_sections = known_sections if known_sections else {}
+    if workers <= 1 or len(jobs) <= 1:
+        for abs_file, deck_name, note_type in jobs:
+            yield parser.parse_file(abs_file, deck_name, known_sections.get(abs_file), note_type)
+        return
+    logger.info(f'File-parse: parsing {len(jobs)} files with {workers} worker processes.')
+    # spawn rather than fork, forking the Qt process (with its threads) is unsafe
+    ex = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(parser.model_name, parser.update, parser.selector, parser.chunk_chars))
+    try:
+        files, deck_names, note_types = zip(*jobs)
+        # map() keeps the order, so the output is the same as the serial path
+        yield from ex.map(_parse_in_worker, files, deck_names, [known_sections.get(f) for f in files], note_types,
+                          chunksize=max(1, len(jobs) // (workers * 4)))
+    finally:
+        # drop the pending files if the iterator is closed early (join cancelled)
+        ex.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+Join plan
+What a join would do, collected by a dry run: scan, parse and cloze selection run as usual,
+ while the collection is only read, and neither the media folder nor the MD files are written.
+"""
+
+import json
+import logging
+import math
+import os
+from typing import Optional
+
+from .timing import rel_file
+from .writer import NoteWriter
+
+
+logger = logging.getLogger(__name__)
+
+
+# The plan of the last dry run, next to the log file
+PLAN_FILE: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'join-plan.json')
+
+
+class JoinPlan:
+    """
+    The notes, media, decks and files a join would write, and the cost of writing them.
+    """
+
+    chunk_size: int  # how many notes the writer writes in one backend call
+    adds: list[dict]  # the notes to add: file, root, deck, clozes
+    updates: list[dict]  # the imported notes to update: file, root, note id, fields changed
+    restores: list[dict]  # the notes whose NoteId comments are lost, found in the collection: file, root, note id
+    orphans: list[int]  # the ids of the notes whose headings have disappeared
+    remove_orphans: bool  # the orphans are removed rather than tagged
+    media: dict[str, tuple[str, int]]  # absolute image path -> (media filename, bytes), the new ones only
+    decks: list[str]  # the decks to create, parents first
+    models: list[str]  # the models to create, missing from the collection
+    rewrites: dict[str, tuple[int, int]]  # absolute file path -> (NoteId comments to insert, file bytes)
+    files: int  # how many files parsed
+
+    def __init__(self, chunk_size: int = NoteWriter.CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.adds = []
+        self.updates = []
+        self.restores = []
+        self.orphans = []
+        self.remove_orphans = False
+        self.media = {}
+        self.decks = []
+        self.models = []
+        self.rewrites = {}
+        self.files = 0
+
+    def add_note(self, abs_file: str, root: str, deck_name: str, cloze_count: int):
+        self.adds.append({'file': abs_file, 'root': root, 'deck': deck_name, 'clozes': cloze_count})
+
+    def update_note(self, abs_file: str, root: str, note_id: int, fields: list[str]):
+        self.updates.append({'file': abs_file, 'root': root, 'note_id': note_id, 'fields': fields})
+
+    def restore_note(self, abs_file: str, root: str, note_id: int):
+        self.restores.append({'file': abs_file, 'root': root, 'note_id': note_id})
+
+    def add_media(self, src: str, fname: str, size: int):
+        self.media[src] = (fname, size)
+
+    def add_deck(self, deck_name: str):
+        if deck_name not in self.decks:
+            self.decks.append(deck_name)
+
+    def add_model(self, model_name: str):
+        if model_name not in self.models:
+            self.models.append(model_name)
+
+    def rewrite_file(self, abs_file: str, comment_count: int):
+        self.rewrites[abs_file] = (comment_count, os.path.getsize(abs_file))
+
+    def cost(self) -> dict:
+        """
+        The estimated cost of the writes: the backend calls, and the bytes written to disk
+        """
+        calls = math.ceil(len(self.adds) / self.chunk_size) + math.ceil(len(self.updates) / self.chunk_size)
+        calls += len(self.decks) + len(self.models) + (1 if self.orphans else 0)
+        return {
+            'backend_calls': calls,
+            'notes_written': len(self.adds) + len(self.updates),
+            'media_bytes': sum(size for _, size in self.media.values()),
+            'rewrite_bytes': sum(size for _, size in self.rewrites.values()),
+        }
+
+    def to_dict(self, root: str = None) -> dict:
+        """
+        :param root: the ZK root, which the file paths are shown relative to
+        """
+        return {
+            'files': self.files,
+            'add': [dict(note, file=rel_file(note['file'], root)) for note in self.adds],
+            'update': [dict(note, file=rel_file(note['file'], root)) for note in self.updates],
+            'restore': [dict(note, file=rel_file(note['file'], root)) for note in self.restores],
+            'orphans': {'action': 'remove' if self.remove_orphans else 'tag', 'note_ids': self.orphans},
+            'media': [{'file': rel_file(src, root), 'name': fname, 'bytes': size}
+                      for src, (fname, size) in self.media.items()],
+            'decks': self.decks,
+            'models': self.models,
+            'rewrite': [{'file': rel_file(abs_file, root), 'comments': count, 'bytes': size}
+                        for abs_file, (count, size) in self.rewrites.items()],
+            'cost': self.cost(),
+        }
+
+    def summary(self) -> str:
+        """
+        The text plan, counts only
+        """
+        cost = self.cost()
+        lines = [
+            f'ZK-join dry run, {self.files} files parsed, nothing written.',
+            f'Notes: {len(self.adds)} to add, {len(self.updates)} to update, '
+            f'{len(self.orphans)} orphans to {"remove" if self.remove_orphans else "tag"}, '
+            f'{len(self.restores)} lost NoteId comments to restore.',
+            f'Media: {len(self.media)} to import ({cost["media_bytes"] / 1024:.0f} KB).',
+            f'Decks: {len(self.decks)} to create{": " + ", ".join(self.decks[:5]) if self.decks else ""}'
+            f'{"..." if len(self.decks) > 5 else ""}.',
+            f'Models: {len(self.models)} to create{": " + ", ".join(self.models) if self.models else ""}.',
+            f'Files: {len(self.rewrites)} to rewrite with NoteId comments ({cost["rewrite_bytes"] / 1024:.0f} KB).',
+            f'Write cost: {cost["backend_calls"]} backend calls, {cost["notes_written"]} notes written.',
+        ]
+        return '\n'.join(lines)
+
+    def save(self, path: str = PLAN_FILE, root: str = None) -> Optional[str]:
+        """
+        Write the plan as JSON
+        :return: the path written, None if failed
+        """
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.to_dict(root), f, indent=1, ensure_ascii=False)
+            logger.info(f'Join-plan: written to "{path}"')
+            return path
+        except IOError as e:
+            logger.error(f'Join-plan: error, {e}, plan file "{path}"')
+            return None
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+Preprocessing pipeline
+Normalize the MD content before rendering. The content is split once into protected regions
+ (frontmatter, fenced code, math, inline code) and processable ones, then each stage runs over the processable ones.
+Stages never add or remove lines, so the source line spans stay valid.
+"""
+
+import functools
+import logging
+import re
+
+
+logger = logging.getLogger(__name__)
+
+
+# (text, protected)
+Region = tuple[str, bool]
+
+# a closed frontmatter at the start, otherwise it's a thematic break
+FRONTMATTER_RE = re.compile(r'-{3,}[ \t]*\r?\n(?:.*\n)*?-{3,}[ \t]*(?:\r?\n|\r?\Z)')
+# the first line of fenced code, or of math block as arithmatex: '$$...$$' or '\begin{env}...\end{env}'
+BLOCK_START_RE = re.compile(r'^ {0,3}(?:(?P<fence>`{3,}|~{3,})|(?P<math>\$\$)|\\begin\{(?P<env>[a-z]+\*?)\})',
+                            flags=re.MULTILINE)
+# inline code, and inline math as arithmatex: '$...$' or '\(...\)', matched at the candidate chars only
+INLINE_START_RE = re.compile(r'[`$\\]')
+INLINE_PROTECTED_RE = re.compile(
+    r'(?P<escape>\\[\\$`])'
+    r'|(?P<ticks>`+)(?!`).+?(?<!`)(?P=ticks)(?!`)'
+    r'|\$(?!\s)(?:\\.|[^\\$\n])+?(?<!\s)\$'
+    r'|\\\(.+?\\\)'
+)
+
+
+class PreprocessStage:
+    """
+    A stage of the pipeline, with its patterns compiled once.
+    """
+
+    name: str = ''
+    # the stage is skipped for the region without this text, '' to run on every region
+    trigger: str = ''
+
+    def __call__(self, text: str) -> str:
+        return text
+
+
+class EmojiStage(PreprocessStage):
+    """
+    Replace ':emoji-alias:' with emoji, looking up the shortcodes in one table.
+    """
+
+    name = 'emoji'
+    trigger = ':'
+
+    SHORTCODE_RE = re.compile(r':[a-z0-9_+\-]+:')
+
+    def __init__(self, aliases: dict[str, str] = None):
+        """
+        :param aliases: ':alias:' mapped to emoji, default to the aliases of the emojis package
+        """
+        if aliases is None:
+            from emojis.db import get_emoji_aliases
+            aliases = get_emoji_aliases()
+        self.aliases = aliases
+
+    def __call__(self, text: str) -> str:
+        parts: list[str] = []
+        start = 0  # the text before is done
+        pos = 0  # where to search from
+        while True:
+            m = self.SHORTCODE_RE.search(text, pos)
+            if not m:
+                break
+            emoji = self.aliases.get(m.group())
+            if emoji:
+                parts += [text[start:m.start()], emoji]
+                start = pos = m.end()
+            else:
+                # the closing colon could open the next shortcode, like ':not-alias:smile:'
+                pos = m.end() - 1
+        if not parts:
+            return text
+        parts.append(text[start:])
+        return ''.join(parts)
+
+
+class Preprocessor:
+    """
+    Run the stages over the processable regions of the MD content, which is split only once.
+    """
+
+    stages: list[PreprocessStage]
+
+    def __init__(self, stages: list[PreprocessStage] = None):
+        """
+        :param stages: the stages in order, default to default_stages()
+        """
+        self.stages = stages if stages is not None else default_stages()
+
+    def run(self, content: str) -> str:
+        if not self.stages:
+            return content
+        parts: list[str] = []
+        for text, protected in split_regions(content):
+            if not protected:
+                for stage in self.stages:
+                    if stage.trigger in text:
+                        text = stage(text)
+            parts.append(text)
+        return ''.join(parts)
+
+
+def default_stages() -> list[PreprocessStage]:
+    # Add stages here, in order
+    return [
+        EmojiStage(),
+    ]
+
+
+def split_regions(content: str) -> list[Region]:
+    """
+    Split the MD content into protected and processable regions in one pass, joined they are the content as it is.
+    Protected: frontmatter, fenced code, math blocks, inline code and inline math.
+    :param content: MD content
+    :return: list of (text, protected), adjacent regions of the same kind merged
+    """
+    regions: list[Region] = []
+    pos = 0
+    m = FRONTMATTER_RE.match(content)
+    if m:
+        regions.append((m.group(), True))
+        pos = m.end()
+    while True:
+        m = BLOCK_START_RE.search(content, pos)
+        if not m:
+            break
+        if m.start() > pos:
+            regions += split_inline(content[pos:m.start()])
+        end, closed = block_end(content, m)
+        # unclosed, not a block for markdown either
+        regions += [(content[m.start():end], True)] if closed else split_inline(content[m.start():end])
+        pos = end
+    if pos < len(content):
+        regions += split_inline(content[pos:])
+    return merge(regions)
+
+
+def block_end(content: str, start: re.Match) -> tuple[int, bool]:
+    """
+    :param content: MD content
+    :param start: the match of BLOCK_START_RE
+    :return: the end of the block's closing line (newline included) and True,
+     or the end of the first line and False if unclosed
+    """
+    line_end = content.find('\n', start.end())
+    line_end = len(content) if line_end < 0 else line_end + 1
+    fence = start.group('fence')
+    if fence:
+        m = fence_closing_re(fence[0], len(fence)).search(content, line_end)
+        return (m.end(), True) if m else (line_end, False)
+    end_mark = '$$' if start.group('math') else f'\\end{{{start.group("env")}}}'
+    if end_mark in content[start.end():line_end]:
+        return line_end, True  # in one line
+    closing = content.find(end_mark, line_end)
+    if closing < 0:
+        return line_end, False
+    closing = content.find('\n', closing)
+    return (len(content) if closing < 0 else closing + 1), True
+
+
+@functools.lru_cache(maxsize=None)
+def fence_closing_re(char: str, length: int) -> re.Pattern:
+    # the closing fence: the same char, no shorter, nothing else in the line
+    return re.compile(rf'^ {{0,3}}{re.escape(char)}{{{length},}}[ \t]*(?:\r?\n|\r?\Z)', flags=re.MULTILINE)
+
+
+def split_inline(text: str) -> list[Region]:
+    """
+    Split the inline code and inline math out of the text
+    """
+    regions: list[Region] = []
+    start = 0  # the text before is split
+    pos = 0  # where to search from
+    while True:
+        candidate = INLINE_START_RE.search(text, pos)
+        if not candidate:
+            break
+        m = INLINE_PROTECTED_RE.match(text, candidate.start())
+        if not m:
+            # skip the whole backtick run, its length decides the closing one
+            pos = candidate.start() + 1
+            while text.startswith('`', pos) and text[pos - 1] == '`':
+                pos += 1
+            continue
+        if m.lastgroup == 'escape':
+            pos = m.end()
+            continue
+        if m.start() > start:
+            regions.append((text[start:m.start()], False))
+        regions.append((m.group(), True))
+        start = pos = m.end()
+    if start < len(text):
+        regions.append((text[start:], False))
+    return regions
+
+
+def merge(regions: list[Region]) -> list[Region]:
+    merged: list[Region] = []
+    for text, protected in regions:
+        if merged and merged[-1][1] == protected:
+            merged[-1] = (merged[-1][0] + text, protected)
+        else:
+            merged.append((text, protected))
+    return merged
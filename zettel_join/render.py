@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+Markdown render engine
+Build the markdown pipeline (with its extensions and processors) once, then reuse it across files.
+"""
+
+import logging
+import threading
+
+import markdown
+from markdown.extensions import tables
+from pymdownx import arithmatex, superfences
+
+
+logger = logging.getLogger(__name__)
+
+
+def make_extensions() -> list[markdown.Extension]:
+    """
+    Create the markdown extensions used for rendering MD notes
+    :return: list of configured extension instances
+    """
+    extensions: list[markdown.Extension] = []
+    # add table extension
+    table_ext = tables.TableExtension()
+    table_ext.setConfig('use_align_attribute', True)
+    extensions.append(table_ext)
+    # add math extension
+    math_ext = arithmatex.ArithmatexExtension()
+    math_ext.setConfig('preview', False)
+    math_ext.setConfig('generic', True)
+    # not wrap while parse md, add manually after cloze deletion
+    math_ext.setConfig('tex_block_wrap', ['', ''])
+    extensions.append(math_ext)
+    # add fenced-code extension
+    fenced_code_ext = superfences.SuperFencesCodeExtension()
+    extensions.append(fenced_code_ext)
+    return extensions
+
+
+class RenderEngine:
+    """
+    Keep one configured markdown.Markdown instance per thread, and reset it between documents.
+    A Markdown instance holds per-document state, so it is never shared across threads.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def md(self) -> markdown.Markdown:
+        """
+        The Markdown instance of current thread, created at first use
+        """
+        md = getattr(self._local, 'md', None)
+        if md is None:
+            md = markdown.Markdown(extensions=make_extensions())
+            self._local.md = md
+            logger.debug(f'Render engine: Markdown instance created for thread "{threading.current_thread().name}"')
+        return md
+
+    def render(self, content: str) -> str:
+        """
+        Transfer md content to html
+        :param content: md content
+        :return: html string
+        """
+        md = self.md
+        try:
+            return md.convert(content)
+        finally:
+            md.reset()
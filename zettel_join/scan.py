@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+ZK scanner
+Traverse the ZK with os.scandir, yield the files to join as a stream, with gitignore-style '.zkignore' rules.
+Nothing here depends on the process state (no os.chdir), so it's safe to run in background.
+"""
+
+import logging
+import os
+import re
+from typing import Iterator, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+# (absolute file path, deck name, stat result)
+ScanEntry = tuple[str, str, os.stat_result]
+
+
+class IgnoreRule:
+    """
+    A line of '.zkignore', in the syntax of '.gitignore'.
+    """
+
+    __slots__ = ('regex', 'negate', 'dir_only')
+
+    regex: re.Pattern  # matches the path relative to the directory of the '.zkignore'
+    negate: bool  # '!pattern', re-include what's ignored by the earlier rules
+    dir_only: bool  # 'pattern/', match directories only
+
+    def __init__(self, regex: re.Pattern, negate: bool, dir_only: bool):
+        self.regex = regex
+        self.negate = negate
+        self.dir_only = dir_only
+
+    @classmethod
+    def parse(cls, line: str) -> Optional['IgnoreRule']:
+        """
+        :param line: a line of '.zkignore'
+        :return: the rule, None for blank line or comment
+        """
+        line = line.rstrip('\r\n').rstrip(' ')
+        if not line or line.startswith('#'):
+            return None
+        negate = line.startswith('!')
+        if negate or line.startswith('\\'):
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if not line:
+            return None
+        # a pattern with slash is relative to the directory of '.zkignore', otherwise it matches at any level
+        anchored = '/' in line
+        body = translate(line.lstrip('/'))
+        return cls(re.compile(body if anchored else f'(?:.*/)?{body}'), negate, dir_only)
+
+
+def translate(pattern: str) -> str:
+    """
+    Translate the glob pattern of '.gitignore' to regex.
+    :param pattern: glob pattern, with '/' as separator
+    :return: regex string
+    """
+    i, n = 0, len(pattern)
+    out: list[str] = []
+    while i < n:
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == n:
+            out.append('/.*')
+            i += 3
+        elif pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            out.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            out.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            j = pattern.index(']', i + 2)
+            chars = pattern[i + 1:j]
+            out.append('[' + ('^' + chars[1:] if chars.startswith('!') else chars).replace('\\', '\\\\') + ']')
+            i = j + 1
+        else:
+            if pattern[i] == '\\' and i + 1 < n:
+                i += 1
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(out)
+
+
+class ZkScanner:
+    """
+    Scan the ZK for the files to join, hidden entries and the ones ignored by '.zkignore' skipped.
+    The stat results come from os.DirEntry, which is cached (free on Windows, where the directory listing has them).
+    """
+
+    IGNORE_FILE = '.zkignore'
+
+    root: str
+    suffix: str
+    rules: dict[str, list[IgnoreRule]]  # relative directory ('' for root) -> rules of its '.zkignore'
+
+    def __init__(self, root: str, suffix: str = '.md'):
+        """
+        :param root: The ZK root path
+        :param suffix: the file extension of the files to join
+        """
+        self.root = root
+        self.suffix = suffix
+        self.rules = {}
+
+    def walk(self) -> Iterator[ScanEntry]:
+        """
+        Traverse the whole ZK, directories in depth-first order, files in name order.
+        """
+        yield from self.scan(self.root, recursive=True)
+
+    def scan_paths(self, paths: list[str]) -> Iterator[ScanEntry]:
+        """
+        Scan only the given files and directories of the ZK, the work scales with the paths, not with the ZK.
+        :param paths: absolute paths of files, or directories whose own files are scanned (not recursive)
+        """
+        # group the files by directory, so that each directory is listed once
+        dir_names: dict[str, Optional[set[str]]] = {}
+        for path in paths:
+            if os.path.isdir(path):
+                dir_names[path] = None
+            elif os.path.isfile(path):
+                names = dir_names.setdefault(os.path.dirname(path), set())
+                if names is not None:
+                    names.add(os.path.basename(path))
+            # deleted ones are left to the next full join
+        for abs_dir, names in dir_names.items():
+            rel_dir = self.rel_path(abs_dir)
+            if rel_dir is None or self.is_dir_excluded(rel_dir):
+                continue
+            yield from self.scan(abs_dir, names=names)
+
+    def scan(self, abs_dir: str, names: set[str] = None, recursive: bool = False) -> Iterator[ScanEntry]:
+        """
+        Scan a directory of the ZK, which is supposed to be not excluded.
+        :param abs_dir: absolute path of the directory
+        :param names: only the files with these basenames, None for all
+        :param recursive: scan the sub-directories as well
+        """
+        stack: list[str] = [abs_dir]
+        while stack:
+            top = stack.pop()
+            rel_dir = self.rel_path(top)
+            try:
+                with os.scandir(top) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError as e:
+                logger.error(f'ZK-scan: error, {e}, directory "{top}"')
+                continue
+            if any(entry.name == self.IGNORE_FILE for entry in entries):
+                self.load_rules(rel_dir)
+            deck_name: str = rel_dir.replace('/', '::') if rel_dir else 'Default'
+            sub_dirs: list[str] = []
+            warned = False
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                rel_path = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+                if entry.is_dir():
+                    if recursive and not self.is_ignored(rel_path, True):
+                        sub_dirs.append(entry.path)
+                    continue
+                if not entry.name.endswith(self.suffix) or (names is not None and entry.name not in names):
+                    continue
+                if self.is_ignored(rel_path, False):
+                    logger.debug('ZK-scan: Skip file "%s" since ignored.', rel_path)
+                    continue
+                if not warned:
+                    # Calculate depth, warning if depth > 3
+                    depth = rel_dir.count('/') + 1 if rel_dir else 0
+                    if depth > 3:
+                        logger.warning(f'ZK-scan: bad practise, dir "{rel_dir}" is "{depth}-level-deep" in zk, '
+                                       f'more than 3.')
+                    warned = True
+                try:
+                    yield entry.path, deck_name, entry.stat()
+                except OSError as e:
+                    logger.error(f'ZK-scan: error, {e}, file "{entry.path}"')
+            # depth-first, in name order
+            stack += reversed(sub_dirs)
+
+    def rel_path(self, abs_path: str) -> Optional[str]:
+        """
+        :return: the path relative to the ZK root with '/' as separator, '' for root, None if outside the ZK
+        """
+        rel_path = os.path.relpath(abs_path, self.root)
+        if rel_path == '.':
+            return ''
+        if rel_path == '..' or rel_path.startswith('..' + os.sep):
+            return None
+        return rel_path.replace(os.sep, '/')
+
+    def load_rules(self, rel_dir: str):
+        path = os.path.join(self.root, rel_dir, self.IGNORE_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.rules[rel_dir] = [rule for rule in map(IgnoreRule.parse, f) if rule]
+            logger.debug(f'ZK-scan: {len(self.rules[rel_dir])} ignore rules loaded from "{path}"')
+        except IOError as e:
+            logger.error(f'ZK-scan: error, {e}, ignore file "{path}"')
+            self.rules[rel_dir] = []
+
+    def is_ignored(self, rel_path: str, is_dir: bool) -> bool:
+        """
+        Check the path against the rules of the '.zkignore' files in its parent directories, the last match wins.
+        The rules of the parent directories are supposed to be loaded.
+        :param rel_path: path relative to the ZK root, with '/' as separator
+        :param is_dir: if the path is a directory
+        """
+        ignored = False
+        parts = rel_path.split('/')
+        for depth in range(len(parts)):
+            rules = self.rules.get('/'.join(parts[:depth]))
+            if not rules:
+                continue
+            sub_path = '/'.join(parts[depth:])
+            for rule in rules:
+                if rule.dir_only and not is_dir:
+                    continue
+                if rule.regex.fullmatch(sub_path):
+                    ignored = not rule.negate
+        return ignored
+
+    def is_dir_excluded(self, rel_dir: str) -> bool:
+        """
+        Check if the directory or any of its parents is hidden or ignored, loading the rules on the way.
+        :param rel_dir: path relative to the ZK root, with '/' as separator
+        """
+        if rel_dir and any(part.startswith('.') for part in rel_dir.split('/')):
+            return True
+        parts = rel_dir.split('/') if rel_dir else []
+        for depth in range(len(parts) + 1):
+            parent = '/'.join(parts[:depth])
+            if parent not in self.rules:
+                if os.path.isfile(os.path.join(self.root, parent, self.IGNORE_FILE)):
+                    self.load_rules(parent)
+                else:
+                    self.rules[parent] = []
+            if depth and self.is_ignored(parent, True):
+                return True
+        return False
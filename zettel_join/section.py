@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+Section tree
+Split the parse tree into heading sections in one linear pass, without copying any node.
+"""
+
+import hashlib
+import logging
+import re
+from typing import Iterator
+
+from bs4 import BeautifulSoup, PageElement, Tag
+
+
+logger = logging.getLogger(__name__)
+
+
+HEADING_TAG_NAMES: list[str] = [f'h{n}' for n in range(1, 7)]
+# while encounter the stop tag, the section (note scope) ends
+STOP_TAG_NAMES: list[str] = HEADING_TAG_NAMES + ['hr']
+
+# ATX heading like '## heading ##', up to 3 leading spaces allowed
+ATX_HEADING_RE = re.compile(r' {0,3}(?P<marks>#{1,6})(?:[ \t]+(?P<text>.*?))?(?:[ \t]+#+)?[ \t]*')
+# Setext heading underline like '===' (h1) or '---' (h2)
+SETEXT_UNDERLINE_RE = re.compile(r' {0,3}(?P<underline>=+|-+)[ \t]*')
+FENCE_RE = re.compile(r' {0,3}(?P<fence>`{3,}|~{3,})')
+# lines that can't be a part of paragraph (thus can't be setext heading text)
+NON_PARAGRAPH_RE = re.compile(r'(?: {4}|\t| {0,3}(?:>|<|\$\$|\||[-*+][ \t]|\d+[.)][ \t]))')
+# the comment of the imported note's id, which is inserted after the heading
+NOTE_ID_COMMENT_RE = re.compile(r'[ \t]*<!--\s*NoteId:\s*(?P<note_id>[0-9]{13})\s*-->\s*', flags=re.IGNORECASE)
+# link reference definition like '[id]: url', which the links of any section may refer to
+LINK_REFERENCE_RE = re.compile(r' {0,3}\[[^\]]+\]:')
+
+
+class Section:
+    """
+    A heading section of MD file, which corresponds to an Anki-note.
+    The body is a range of the top-level nodes shared by all the sections of the file.
+    """
+
+    __slots__ = ('path', 'level', 'heading', 'nodes', 'start', 'end', 'line_start', 'line_end',
+                 'parent', 'children')
+
+    path: list[str]  # heading texts from the top level down to itself
+    level: int  # 1-6, as h1-h6
+    heading: Tag
+    nodes: list[PageElement]  # the top-level nodes of the parse tree
+    start: int  # body node range [start, end), heading excluded
+    end: int
+    line_start: int  # source line span [line_start, line_end), heading line included, 0-based
+    line_end: int
+    parent: 'Section'
+    children: list['Section']
+
+    def __init__(self, heading: Tag, path: list[str], nodes: list[PageElement], start: int, parent: 'Section'):
+        self.heading = heading
+        self.level = int(heading.name[1])
+        self.path = path
+        self.nodes = nodes
+        self.start = start
+        self.end = start
+        self.line_start = -1
+        self.line_end = -1
+        self.parent = parent
+        self.children = []
+
+    @property
+    def body(self) -> list[PageElement]:
+        """
+        The body nodes of the section, shared with the parse tree (not copied)
+        """
+        return self.nodes[self.start:self.end]
+
+    @property
+    def root(self) -> str:
+        """
+        The heading path joined as 'root' field
+        """
+        return '.'.join(self.path)
+
+    def __repr__(self) -> str:
+        return f'<Section h{self.level} "{self.root}" nodes[{self.start}:{self.end}]>'
+
+
+class SectionTree:
+    """
+    Sections of a MD file, built in a single pass over the top-level nodes of the parse tree.
+    """
+
+    soup: BeautifulSoup
+    nodes: list[PageElement]
+    sections: list[Section]  # in document order
+    roots: list[Section]  # top sections of the tree
+
+    def __init__(self, soup: BeautifulSoup, content: str = None):
+        """
+        :param soup: the parse tree of the MD file
+        :param content: the MD content that the parse tree rendered from, for source line spans
+        """
+        self.soup = soup
+        self.nodes = list(soup.children)
+        self.sections = []
+        self.roots = []
+        self.build()
+        if content is not None:
+            self.map_lines(content)
+
+    def build(self):
+        stack: list[Section] = []  # the ancestors of the present heading
+        present: Section = None  # the section whose body is being collected
+        for i, node in enumerate(self.nodes):
+            name = node.name
+            if name not in STOP_TAG_NAMES:
+                continue
+            if present:
+                present.end = i
+                present = None
+            if name == 'hr':
+                continue
+            level = int(name[1])
+            while stack and stack[-1].level >= level:
+                stack.pop()
+            parent = stack[-1] if stack else None
+            path = (parent.path if parent else []) + [node.text]
+            present = Section(node, path, self.nodes, i + 1, parent)
+            if parent:
+                parent.children.append(present)
+            else:
+                self.roots.append(present)
+            stack.append(present)
+            self.sections.append(present)
+        if present:
+            present.end = len(self.nodes)
+
+    def map_lines(self, content: str):
+        """
+        Map each section to its source line span, matching the headings in document order.
+        :param content: the MD content
+        """
+        heading_lines = scan_heading_lines(content)
+        if len(heading_lines) != len(self.sections):
+            logger.warning(f'Section tree: source headings ({len(heading_lines)}) mismatch '
+                           f'parsed headings ({len(self.sections)}), line spans unavailable.')
+            return
+        line_count = content.count('\n') + 1
+        for n, section in enumerate(self.sections):
+            section.line_start = heading_lines[n]
+            section.line_end = heading_lines[n + 1] if n + 1 < len(heading_lines) else line_count
+
+    def decompose(self):
+        """
+        Free the parse tree now, which is full of reference cycles, rather than whenever garbage collected.
+        The sections are gone with it.
+        """
+        self.sections = []
+        self.roots = []
+        self.nodes = []
+        self.soup.decompose()
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def __len__(self) -> int:
+        return len(self.sections)
+
+
+class SourceSection:
+    """
+    A heading section of the MD source, split without rendering, to tell if it has changed since last join.
+    """
+
+    __slots__ = ('path', 'level', 'line_start', 'body_start', 'line_end', 'note_id', 'digest', 'parent')
+
+    path: list[str]  # source heading texts from the top level down to itself
+    level: int
+    line_start: int  # source line span [line_start, line_end), the same as Section
+    body_start: int  # the first line of body, after the heading and the NoteId comment (blank lines skipped)
+    line_end: int
+    note_id: int  # id of the imported note commented after the heading, 0 if not imported yet
+    digest: str  # hash of the section source, NoteId comment excluded
+    parent: 'SourceSection'
+
+    def __init__(self, path: list[str], level: int, line_start: int, parent: 'SourceSection'):
+        self.path = path
+        self.level = level
+        self.line_start = line_start
+        self.body_start = line_start
+        self.line_end = line_start
+        self.note_id = 0
+        self.digest = ''
+        self.parent = parent
+
+    @property
+    def key(self) -> str:
+        """
+        The key of the section hash, by its NoteId and heading path
+        """
+        return section_key(self.note_id, self.path)
+
+    def __repr__(self) -> str:
+        return f'<SourceSection h{self.level} "{".".join(self.path)}" lines[{self.line_start}:{self.line_end}]>'
+
+
+def section_key(note_id: int, path: list[str]) -> str:
+    return f'{note_id}:{".".join(path)}'
+
+
+def rekey_section(key: str, note_id: int) -> str:
+    """
+    The key of the same section, after commented with the id of the note imported from it
+    """
+    return f'{note_id}:{key.partition(":")[2]}'
+
+
+def split_source(content: str, salt: str = '') -> list[SourceSection]:
+    """
+    Split the MD content into heading sections at the source level, and hash each section.
+    The NoteId comment (with the blank lines around) is left out of the hash, so writing it back changes nothing.
+    :param content: MD content
+    :param salt: hashed along with every section, e.g. the parser settings which the notes depend on
+    :return: the sections in document order, matching the sections of SectionTree if the headings match
+    """
+    lines = content.split('\n')
+    headings = scan_headings(content)
+    # the links of a section refer to the definitions anywhere in the file
+    salt += ''.join(line for line in lines if LINK_REFERENCE_RE.match(line))
+    sections: list[SourceSection] = []
+    stack: list[SourceSection] = []
+    for n, (line_start, level, text, head_lines) in enumerate(headings):
+        while stack and stack[-1].level >= level:
+            stack.pop()
+        parent = stack[-1] if stack else None
+        path = (parent.path if parent else []) + [text]
+        section = SourceSection(path, level, line_start, parent)
+        section.line_end = headings[n + 1][0] if n + 1 < len(headings) else len(lines)
+        body_start = min(line_start + head_lines, section.line_end)
+        while body_start < section.line_end:
+            line = lines[body_start]
+            m = NOTE_ID_COMMENT_RE.fullmatch(line)
+            if m and not section.note_id:
+                section.note_id = int(m.group('note_id'))
+            elif line.strip():
+                break
+            body_start += 1
+        section.body_start = body_start
+        h = hashlib.blake2b(salt.encode('utf-8'), digest_size=10)
+        h.update('\n'.join(lines[line_start:line_start + head_lines] + lines[body_start:section.line_end])
+                 .encode('utf-8'))
+        section.digest = h.hexdigest()
+        stack.append(section)
+        sections.append(section)
+    return sections
+
+
+def blank_sections(content: str, bodies: list[SourceSection], wholes: list[SourceSection]) -> str:
+    """
+    Blank out the sections, for rendering the rest only.
+    The link reference definitions are kept, and so is the line count, thus the source line spans stay the same.
+    :param content: MD content
+    :param bodies: the sections (of the content) whose bodies are blanked out, the headings and NoteId comments kept
+    :param wholes: the sections (of the content) blanked out as a whole
+    :return: the new content
+    """
+    lines = content.split('\n')
+    spans = [(section.body_start, section.line_end) for section in bodies]
+    spans += [(section.line_start, section.line_end) for section in wholes]
+    for start, end in spans:
+        for n in range(start, end):
+            if lines[n] and not LINK_REFERENCE_RE.match(lines[n]):
+                lines[n] = ''
+    return '\n'.join(lines)
+
+
+def chunk_sections(sections: list[SourceSection], lines: list[str], max_chars: int) -> Iterator[list[SourceSection]]:
+    """
+    Group the sections into chunks of no more than max_chars of source, a bigger section makes a chunk alone.
+    :param sections: the sections in document order
+    :param lines: the lines of the MD content
+    :param max_chars: the source size of a chunk at most
+    :return: iterator of the chunks, in document order
+    """
+    chunk: list[SourceSection] = []
+    size = 0
+    for section in sections:
+        section_size = sum(len(line) + 1 for line in lines[section.line_start:section.line_end])
+        if chunk and size + section_size > max_chars:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(section)
+        size += section_size
+    if chunk:
+        yield chunk
+
+
+def chunk_source(lines: list[str], chunk: list[SourceSection]) -> tuple[str, list[SourceSection]]:
+    """
+    The MD content of a chunk, to be rendered alone: the sections with the headings of their ancestors
+     (for the heading paths), and the link reference definitions of the whole content.
+    :param lines: the lines of the MD content
+    :param chunk: the sections in document order
+    :return: the content, and the sections in it (the ancestors included) in document order
+    """
+    parts: list[str] = []
+    included: list[SourceSection] = []
+    seen: set[SourceSection] = set()
+    for section in chunk:
+        ancestors: list[SourceSection] = []
+        parent = section.parent
+        while parent and parent not in seen:
+            ancestors.append(parent)
+            parent = parent.parent
+        for ancestor in reversed(ancestors):
+            parts += lines[ancestor.line_start:ancestor.body_start] + ['']
+            included.append(ancestor)
+            seen.add(ancestor)
+        # separated by a blank line, or a setext heading could be taken as a part of the paragraph before it
+        parts += lines[section.line_start:section.line_end] + ['']
+        included.append(section)
+        seen.add(section)
+    parts += [line for line in lines if LINK_REFERENCE_RE.match(line)]
+    return '\n'.join(parts), included
+
+
+def scan_heading_lines(content: str) -> list[int]:
+    """
+    Scan the MD content for the lines of top-level headings, fenced code skipped.
+    For setext heading (single line of text only, as python-markdown), the line of its text is returned.
+    :param content: MD content
+    :return: 0-based line numbers of the headings, in document order
+    """
+    return [line for line, _, _, _ in scan_headings(content)]
+
+
+def scan_headings(content: str) -> list[tuple[int, int, str, int]]:
+    """
+    Scan the MD content for the top-level headings, fenced code skipped.
+    :param content: MD content
+    :return: list of (0-based line number, level, heading source text, how many lines), in document order.
+     For setext heading, the line of its text, which is followed by the underline.
+    """
+    headings: list[tuple[int, int, str, int]] = []
+    fence: str = ''
+    para_start: int = -1  # the first line of present paragraph, which could be setext heading text
+    lines = content.split('\n')
+    for n, line in enumerate(lines):
+        m = FENCE_RE.match(line)
+        if fence:
+            if m and m.group('fence')[0] == fence[0] and len(m.group('fence')) >= len(fence) \
+                    and not line.strip().strip(fence[0]):
+                fence = ''
+            continue
+        if m:
+            fence = m.group('fence')
+            para_start = -1
+            continue
+        m = ATX_HEADING_RE.fullmatch(line)
+        if m:
+            headings.append((n, len(m.group('marks')), (m.group('text') or '').strip(), 1))
+            para_start = -1
+            continue
+        m = SETEXT_UNDERLINE_RE.fullmatch(line) if para_start == n - 1 else None
+        if m:
+            level = 1 if m.group('underline')[0] == '=' else 2
+            headings.append((para_start, level, lines[para_start].strip(), 2))
+            para_start = -1
+        elif not line.strip() or NON_PARAGRAPH_RE.match(line):
+            para_start = -1
+        elif para_start < 0:
+            para_start = n
+    return headings
+
+
+def insert_after_headings(content: str, insertions: dict[int, str]) -> str:
+    """
+    Insert text after the headings in one linear pass, separated from the heading and the next line with blank lines.
+    The line endings of the content are preserved.
+    :param content: MD content
+    :param insertions: the 0-based line of heading (for setext heading, the line of its text) mapped to the text
+    :return: the new content
+    """
+    lines = content.split('\n')
+    # the line after which the text is inserted, the underline for setext heading
+    targets: dict[int, str] = {}
+    for n, text in insertions.items():
+        if n < len(lines) and ATX_HEADING_RE.fullmatch(lines[n].rstrip('\r')):
+            targets[n] = text
+        elif n + 1 < len(lines) and SETEXT_UNDERLINE_RE.fullmatch(lines[n + 1].rstrip('\r')):
+            targets[n + 1] = text
+        else:
+            logger.warning(f'Heading insertion: line {n} is not a heading, insertion skipped.')
+    out: list[str] = []
+    for n, line in enumerate(lines):
+        out.append(line)
+        if n in targets:
+            nl = '\r' if line.endswith('\r') else ''
+            out.append(nl)
+            out.append(targets[n] + nl)
+            if n + 1 >= len(lines) or lines[n + 1].strip():
+                out.append(nl)
+    return '\n'.join(out)
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+Join task
+Run the join in background without freezing Anki: scan and parse in a background thread,
+ while the collection mutations stay on the main thread.
+"""
+
+import functools
+import logging
+import threading
+import time
+from typing import Optional
+
+from aqt import mw
+from aqt.operations import QueryOp
+from aqt.utils import showInfo, tooltip
+
+from .config import get_config
+from .joint import Dispatcher
+from .parse import FileSpec
+from .plan import JoinPlan
+from .timing import JoinReport
+from .writer import NoteWriter
+from .zk import ZettelKasten
+
+
+logger = logging.getLogger(__name__)
+
+
+class JoinProgress:
+    """
+    Counters of a running join, reported to the progress window at a throttled rate.
+    """
+
+    UPDATE_INTERVAL: float = 0.25  # seconds between two progress updates
+
+    def __init__(self):
+        self.scanned = 0  # files scanned, unchanged files included
+        self.total = 0  # files to parse
+        self.parsed = 0
+        self.joined = 0  # files joined to the collection
+        self.notes = 0
+        self.media = 0
+        self.start_time = time.monotonic()
+        self.last_update = 0.0
+
+    def eta(self) -> Optional[float]:
+        """
+        Estimated seconds remaining, based on the files joined so far
+        """
+        if not self.joined or not self.total:
+            return None
+        elapsed = time.monotonic() - self.start_time
+        return elapsed / self.joined * (self.total - self.joined)
+
+    def label(self) -> str:
+        eta = self.eta()
+        return (f'Files scanned: {self.scanned}, parsed: {self.parsed}/{self.total}\n'
+                f'Notes added: {self.notes}, media imported: {self.media}\n'
+                f'ETA: {f"{eta:.0f}s" if eta is not None else "-"}')
+
+    def due(self) -> bool:
+        """
+        Check if it's time to update the progress window
+        """
+        now = time.monotonic()
+        if now - self.last_update < self.UPDATE_INTERVAL:
+            return False
+        self.last_update = now
+        return True
+
+
+class JoinTask:
+    """
+    A join running in background, which can be cancelled at file boundary.
+    """
+
+    # How many parsed files could wait for the main thread at most
+    MAX_IN_FLIGHT: int = 32
+
+    # the running task, only one join at a time
+    running: 'JoinTask' = None
+
+    def __init__(self, zk: ZettelKasten, joints: list, test_mode: bool = False, force_rescan: bool = False,
+                 paths: list[str] = None, quiet: bool = False, update: bool = None, dry_run: bool = False):
+        """
+        :param zk: The ZK to join
+        :param joints: The joints to join with, in order
+        :param test_mode: join to the test models
+        :param force_rescan: join every file, even if unchanged since last join
+        :param paths: Only join these files and directories of the ZK, None for the whole ZK
+        :param quiet: Show the summary as tooltip, only if any file joined (for watch mode)
+        :param update: update the imported notes whose fields differ from the MD files, None for the config
+        :param dry_run: show the plan of the join rather than join, nothing written
+        """
+        self.zk = zk
+        self.joints = joints
+        self.test_mode = test_mode
+        self.force_rescan = force_rescan
+        self.paths = paths
+        self.quiet = quiet
+        self.update = update if update is not None else get_config('update_notes')
+        self.progress = JoinProgress()
+        self.cancelled = False
+        self.error: Optional[Exception] = None
+        self.slots = threading.Semaphore(self.MAX_IN_FLIGHT)
+        self.writer: NoteWriter = None
+        self.join_report: JoinReport = None
+        self.plan: Optional[JoinPlan] = JoinPlan() if dry_run else None
+
+    def start(self) -> bool:
+        """
+        Start the join, on the main thread.
+        :return: False if another join is running
+        """
+        if JoinTask.running:
+            logger.info('ZK-join: another join is running, cancelled.')
+            tooltip('ZK-join is already running.')
+            return False
+        JoinTask.running = self
+        logger.info(f'ZK-join: Handling with ZK "{self.zk.path}" in background.\n')
+        try:
+            # all the notes are written in bulk, as a single undoable operation
+            self.join_report = JoinReport()
+            self.writer = NoteWriter(mw.col, report=self.join_report) if not self.plan else None
+            for joint in self.joints:
+                joint.prepare_join(self.zk, test_mode=self.test_mode, force_rescan=self.force_rescan,
+                                   writer=self.writer, paths=self.paths, update=self.update, report=self.join_report,
+                                   plan=self.plan)
+            QueryOp(
+                parent=mw,
+                op=self.run,
+                success=lambda _: None,
+            ).with_progress('ZK Join').run_in_background()
+        except Exception:
+            # not started, the next join is not to be blocked
+            JoinTask.running = None
+            raise
+        return True
+
+    """ ========== ========== ========== ========== ========== ========== ========== ========== ========== ==========
+    background thread
+    """
+
+    def run(self, col) -> None:
+        """
+        Scan and parse the files, and hand them to the main thread one by one.
+        :param col: The collection, never touched here
+        """
+        try:
+            # one scan for all the joints, each file dispatched to the joint of its note type
+            dispatcher = Dispatcher(self.joints)
+            jobs_of_joints = dispatcher.scan()
+            self.progress.scanned = dispatcher.scanned
+            self.progress.total = sum(len(jobs) for _, jobs in jobs_of_joints)
+            self.report_from_background()
+            for joint, jobs in jobs_of_joints:
+                if not jobs:
+                    continue
+                files = joint.parse_zk(jobs)
+                try:
+                    for file_spec in files:
+                        if self.want_cancel():
+                            break
+                        self.progress.parsed += 1
+                        # wait if the main thread falls behind
+                        self.slots.acquire()
+                        mw.taskman.run_on_main(functools.partial(self.join_file, joint, file_spec))
+                        self.report_from_background()
+                finally:
+                    files.close()
+                if self.cancelled:
+                    break
+        except Exception as e:
+            # the files handed over are still joined, finish() will show the error
+            logger.exception(f'ZK-join: error in background, {e}')
+            self.error = e
+        finally:
+            # queued after all the files, so it runs after they are joined
+            mw.taskman.run_on_main(self.finish)
+
+    def want_cancel(self) -> bool:
+        if not self.cancelled and mw.progress.want_cancel():
+            logger.info('ZK-join: cancelled by user, stop at file boundary.')
+            self.cancelled = True
+        return self.cancelled
+
+    def report_from_background(self):
+        if self.progress.due():
+            mw.taskman.run_on_main(self.report)
+
+    """ ========== ========== ========== ========== ========== ========== ========== ========== ========== ==========
+    main thread
+    """
+
+    def join_file(self, joint, file_spec: FileSpec):
+        try:
+            self.progress.notes += joint.join_file(file_spec)
+            self.progress.joined += 1
+        finally:
+            self.slots.release()
+        if self.progress.due():
+            self.report()
+
+    def report(self):
+        self.progress.media = sum(joint.media_importer.new_count for joint in self.joints)
+        mw.progress.update(label=self.progress.label(), value=self.progress.joined, max=self.progress.total)
+
+    def finish(self):
+        """
+        Write the rest of the notes, then show the summary
+        """
+        try:
+            for joint in self.joints:
+                # stopped by error, the scan may be incomplete
+                joint.finish_join(partial=self.error is not None)
+            if self.writer:
+                self.writer.finish()
+        finally:
+            JoinTask.running = None
+        if self.plan:
+            self.finish_plan()
+            return
+        self.join_report.finish()
+        self.join_report.save(root=self.zk.path)
+        new_notes_count = sum(joint.new_notes_count for joint in self.joints)
+        logger.info(f'ZK-join: Done, {new_notes_count} notes imported.\n'
+                    f'{self.join_report.summary(self.zk.path)}\n\n')
+        if not self.quiet:
+            showInfo(self.summary())
+        elif self.progress.total or self.error:
+            tooltip(self.summary().replace('\n', '<br>'), period=5000)
+        # refresh the deck browser
+        mw.deckBrowser.refresh()
+
+    def finish_plan(self):
+        """
+        Show the plan of the dry run, the details in the plan file
+        """
+        path = self.plan.save(root=self.zk.path)
+        logger.info(f'ZK-join: dry run done.\n{self.plan.summary()}\n\n')
+        lines = [self.plan.summary()]
+        if self.cancelled:
+            lines.append(f'Cancelled, {self.progress.joined} of {self.progress.total} files planned.')
+        if self.error:
+            lines.append(f'Stopped by error: {self.error}')
+        if path:
+            lines.append(f'The details: "{path}"')
+        showInfo('\n'.join(lines))
+
+    def summary(self) -> str:
+        new_notes_count = sum(joint.new_notes_count for joint in self.joints)
+        hits = sum(joint.manifest.hits for joint in self.joints)
+        misses = sum(joint.manifest.misses for joint in self.joints)
+        invalidated = sum(joint.manifest.invalidated for joint in self.joints)
+        lines = [f'ZK-join finished, with {new_notes_count} notes imported.']
+        if self.update:
+            updated_count = sum(joint.updated_notes_count for joint in self.joints)
+            lines.append(f'{updated_count} notes updated.')
+        orphan_count = sum(len(joint.orphan_note_ids) for joint in self.joints)
+        if orphan_count:
+            removed = self.update and get_config('remove_orphans')
+            lines.append(f'{orphan_count} notes whose headings have disappeared '
+                         f'{"removed" if removed else "found and tagged, see the log for their ids"}.')
+        if self.force_rescan:
+            lines.append('Full rescan, every file joined.')
+        else:
+            lines.append(f'Files: {hits} unchanged (hit), {misses} new (miss), {invalidated} modified (invalidated).')
+        if self.cancelled:
+            lines.append(f'Cancelled, {self.progress.joined} of {self.progress.total} files joined, '
+                         f'the rest will be joined next time.')
+        if self.error:
+            lines.append(f'Stopped by error: {self.error}')
+        # where the time went, the details in the report file next to the log
+        if not self.quiet and self.progress.total:
+            lines.append(self.join_report.summary(self.zk.path))
+        return '\n'.join(lines)
@@ -60,7 +60,7 @@ def remove_test_models():
     remove all the models
     """
     mm = mw.col.models
-    for j in joint.JOINTS:
+    for j in joint.get_joints(mw.col):
         mm.remove(mm.id_for_name(j.model_name + ' (test)'))
 
 
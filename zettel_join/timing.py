@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+Join timing
+Low-overhead timing spans around the stages of the join, aggregated by file and by stage,
+ to tell which file and which stage made the join slow, without a profiler.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+# The stages in the order of the join, parse stages (read ~ cloze) run in worker processes if configured
+STAGES: tuple[str, ...] = ('scan', 'read', 'frontmatter', 'standardize', 'render', 'soup', 'section', 'cloze',
+                           'media', 'note', 'write', 'write_back')
+
+# The report of the last join, next to the log file
+REPORT_FILE: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'join-report.json')
+
+# seconds of each stage
+Timings = dict[str, float]
+
+
+class Span:
+    """
+    Time a block and add the seconds to the stage:
+        with Span(timings, 'render'):
+            ...
+    """
+
+    __slots__ = ('timings', 'stage', 'start')
+
+    def __init__(self, timings: Timings, stage: str):
+        self.timings = timings
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.timings[self.stage] = self.timings.get(self.stage, 0.0) + time.perf_counter() - self.start
+
+
+class JoinReport:
+    """
+    The timings of a join, by stage and by file.
+    """
+
+    SLOWEST_COUNT: int = 10
+
+    by_stage: Timings
+    by_file: dict[str, Timings]  # absolute file path -> seconds of each stage
+    start: float
+
+    def __init__(self):
+        self.by_stage = {}
+        self.by_file = {}
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+
+    def span(self, stage: str, abs_file: str = None) -> Span:
+        """
+        Time a block of the stage, for the file if given, otherwise not attributed to a file (e.g. bulk write)
+        """
+        return Span(self.by_file.setdefault(abs_file, {}) if abs_file else self.by_stage, stage)
+
+    def add_file(self, abs_file: str, timings: Timings):
+        """
+        Add the timings of a file, e.g. of the parse stages, measured in a worker process
+        """
+        file_timings = self.by_file.setdefault(abs_file, {})
+        for stage, seconds in timings.items():
+            file_timings[stage] = file_timings.get(stage, 0.0) + seconds
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.start
+
+    def stage_totals(self) -> Timings:
+        """
+        Seconds of each stage, the files summed up
+        """
+        totals: Timings = dict(self.by_stage)
+        for timings in self.by_file.values():
+            for stage, seconds in timings.items():
+                totals[stage] = totals.get(stage, 0.0) + seconds
+        order = {stage: n for n, stage in enumerate(STAGES)}
+        return dict(sorted(totals.items(), key=lambda item: order.get(item[0], len(STAGES))))
+
+    def slowest_files(self, count: int = SLOWEST_COUNT) -> list[tuple[str, Timings]]:
+        return sorted(self.by_file.items(), key=lambda item: sum(item[1].values()), reverse=True)[:count]
+
+    def to_dict(self, root: str = None) -> dict:
+        """
+        :param root: the ZK root, which the file paths are shown relative to
+        """
+        return {
+            'elapsed': round(self.elapsed, 4),
+            'stages': {stage: round(seconds, 4) for stage, seconds in self.stage_totals().items()},
+            'slowest_files': [
+                {
+                    'file': rel_file(abs_file, root),
+                    'total': round(sum(timings.values()), 4),
+                    'stages': {stage: round(seconds, 4) for stage, seconds in timings.items()},
+                }
+                for abs_file, timings in self.slowest_files()
+            ],
+            'files': {
+                rel_file(abs_file, root): round(sum(timings.values()), 4) for abs_file, timings in self.by_file.items()
+            },
+        }
+
+    def summary(self, root: str = None, count: int = 3) -> str:
+        """
+        The text report, where the time went and the slowest files
+        """
+        totals = self.stage_totals()
+        total = sum(totals.values())
+        if not total:
+            return ''
+        stages = ', '.join(f'{stage} {seconds:.2f}s ({seconds / total:.0%})'
+                           for stage, seconds in sorted(totals.items(), key=lambda item: item[1], reverse=True)
+                           if seconds >= total * 0.01)
+        lines = [f'Time: {self.elapsed:.2f}s elapsed, {stages}.']
+        slowest = [f'"{rel_file(abs_file, root)}" {sum(timings.values()):.2f}s '
+                   f'(mostly {max(timings, key=timings.get)})'
+                   for abs_file, timings in self.slowest_files(count) if timings]
+        if slowest:
+            lines.append(f'Slowest files: {", ".join(slowest)}.')
+        return '\n'.join(lines)
+
+    def save(self, path: str = REPORT_FILE, root: str = None) -> Optional[str]:
+        """
+        Write the report as JSON
+        :return: the path written, None if failed
+        """
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.to_dict(root), f, indent=1, ensure_ascii=False)
+            logger.info(f'Join-report: written to "{path}"')
+            return path
+        except IOError as e:
+            logger.error(f'Join-report: error, {e}, report file "{path}"')
+            return None
+
+
+def rel_file(abs_file: str, root: str = None) -> str:
+    return os.path.relpath(abs_file, root).replace(os.sep, '/') if root else abs_file
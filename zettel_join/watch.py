@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+Watch mode
+Watch the opened ZK for changes, and join the changed files automatically.
+"""
+
+import logging
+import os
+from typing import Optional
+
+from aqt import mw, gui_hooks
+from aqt.qt import QFileSystemWatcher, QTimer, qconnect
+
+from .config import get_config
+from .joint import get_joints
+from .task import JoinTask
+from .zk import ZettelKasten
+
+
+logger = logging.getLogger(__name__)
+
+
+class ZkWatcher:
+    """
+    Watch the directories and MD files of a ZK with QFileSystemWatcher.
+    A burst of saves is debounced into one join of the changed paths only.
+    The directories which can't be watched (e.g. OS watch limit reached) are polled by their mtime instead.
+    """
+
+    zk: ZettelKasten
+    pending: set[str]  # changed paths waiting for the debounce timer
+    dirs: set[str]  # the known directories of the ZK
+    files: set[str]  # the known MD files of the ZK
+    polled: dict[str, int]  # directory path -> mtime_ns, for the directories not watched
+
+    def __init__(self, zk: ZettelKasten, test_mode: bool = False):
+        """
+        :param zk: The ZK to watch
+        :param test_mode: join to the test models
+        """
+        self.zk = zk
+        self.test_mode = test_mode
+        self.pending = set()
+        self.dirs = set()
+        self.files = set()
+        self.polled = {}
+        self.watcher = QFileSystemWatcher(mw)
+        qconnect(self.watcher.fileChanged, self.on_file_changed)
+        qconnect(self.watcher.directoryChanged, self.on_dir_changed)
+        # restarted on every change, so it fires once the burst of saves is over
+        self.debounce_timer = QTimer(mw)
+        self.debounce_timer.setSingleShot(True)
+        qconnect(self.debounce_timer.timeout, self.on_debounced)
+        self.poll_timer = QTimer(mw)
+        qconnect(self.poll_timer.timeout, self.poll)
+
+    def start(self):
+        self.add_tree(self.zk.path)
+        logger.info(f'ZK-watch: start watching "{self.zk.path}", {len(self.dirs)} dirs and {len(self.files)} files, '
+                    f'{len(self.polled)} dirs polled.')
+
+    def stop(self):
+        self.debounce_timer.stop()
+        self.poll_timer.stop()
+        watched = self.watcher.files() + self.watcher.directories()
+        if watched:
+            self.watcher.removePaths(watched)
+        logger.info(f'ZK-watch: stop watching "{self.zk.path}".')
+
+    def add_tree(self, top: str):
+        """
+        Watch a directory and its MD files, sub-directories included. Hidden ones are skipped.
+        :param top: absolute path of the directory
+        """
+        dirs: list[str] = []
+        files: list[str] = []
+        for root, dir_names, file_names in os.walk(top):
+            dir_names[:] = [d for d in dir_names if not d.startswith('.')]
+            dirs.append(root)
+            files += [os.path.join(root, f) for f in file_names if self.is_md(f)]
+        self.add_paths(dirs, files)
+
+    def add_paths(self, dirs: list[str], files: list[str]):
+        self.dirs.update(dirs)
+        self.files.update(files)
+        failed: list[str] = self.watcher.addPaths(dirs + files) if dirs or files else []
+        if not failed:
+            return
+        # a changed file in the polled directory is found by the directory mtime, as editors save by renaming
+        for path in failed:
+            if path in self.dirs:
+                self.polled[path] = self.mtime_ns(path)
+        logger.warning(f'ZK-watch: {len(failed)} paths failed to watch, polling {len(self.polled)} dirs instead.')
+        if self.polled and not self.poll_timer.isActive():
+            self.poll_timer.start(get_config('watch_poll_interval'))
+
+    @staticmethod
+    def is_md(name: str) -> bool:
+        return name.endswith('.md') and not name.startswith('.')
+
+    @staticmethod
+    def mtime_ns(path: str) -> int:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return -1
+
+    """ ========== ========== ========== ========== ========== ========== ========== ========== ========== ==========
+    changes
+    """
+
+    def on_file_changed(self, path: str):
+        self.pending.add(path)
+        # the file is unwatched if it's replaced by a new one (saved by renaming), watch it again
+        if not os.path.exists(path):
+            self.files.discard(path)
+        elif path not in self.watcher.files():
+            self.watcher.addPath(path)
+        self.schedule()
+
+    def on_dir_changed(self, path: str):
+        """
+        Files or sub-directories created, deleted or renamed in the directory
+        """
+        self.pending.add(path)
+        if not os.path.isdir(path):
+            # deleted, its files are left to the next full join
+            self.dirs.discard(path)
+            self.polled.pop(path, None)
+        else:
+            new_dirs: list[str] = []
+            new_files: list[str] = []
+            for entry in os.scandir(path):
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir() and entry.path not in self.dirs:
+                    new_dirs.append(entry.path)
+                elif entry.is_file() and self.is_md(entry.name) and entry.path not in self.files:
+                    new_files.append(entry.path)
+            self.add_paths([], new_files)
+            for new_dir in new_dirs:
+                self.add_tree(new_dir)
+                # join its files, with the sub-directories
+                self.pending.update(d for d in self.dirs if d == new_dir or d.startswith(new_dir + os.sep))
+        self.schedule()
+
+    def poll(self):
+        for path, mtime_ns in list(self.polled.items()):
+            if self.mtime_ns(path) != mtime_ns:
+                self.polled[path] = self.mtime_ns(path)
+                self.on_dir_changed(path)
+
+    def schedule(self):
+        self.debounce_timer.start(get_config('watch_debounce'))
+
+    def on_debounced(self):
+        # a join is running, manual or by watch, try again later
+        if JoinTask.running:
+            self.schedule()
+            return
+        paths, self.pending = sorted(self.pending), set()
+        logger.info(f'ZK-watch: {len(paths)} paths changed, join them.')
+        JoinTask(self.zk, get_joints(mw.col), test_mode=self.test_mode, paths=paths, quiet=True).start()
+
+
+watcher: Optional[ZkWatcher] = None
+
+
+def watch(path: str = None, test_mode: bool = False) -> bool:
+    """
+    Join the ZK, then keep watching it for changes.
+    :param path: ZK directory path, ask user to choose if empty
+    :param test_mode: join to the test models
+    :return: False if no ZK opened
+    """
+    global watcher
+    unwatch()
+    zk: ZettelKasten = ZettelKasten(path)
+    if not zk.path:
+        return False
+    # catch up with the changes made while not watching
+    JoinTask(zk, get_joints(mw.col), test_mode=test_mode).start()
+    watcher = ZkWatcher(zk, test_mode=test_mode)
+    watcher.start()
+    return True
+
+
+def unwatch():
+    global watcher
+    if watcher:
+        watcher.stop()
+        watcher = None
+
+
+gui_hooks.profile_will_close.append(unwatch)
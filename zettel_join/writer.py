@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright: Kyle Hwang <feathered.hwang@hotmail.com>
+# License: GNU GPL, version 3 or later; http://www.gnu.org/copyleft/gpl.html
+
+"""
+Note writer
+Collect the pending notes and write them to the collection in bulk, as a single undoable operation.
+"""
+
+import logging
+
+from anki.collection import Collection, AddNoteRequest
+from anki.decks import DeckId
+from anki.notes import Note
+
+from .timing import JoinReport
+
+
+logger = logging.getLogger(__name__)
+
+
+class NoteWriter:
+    """
+    Add and update notes in bounded chunks, with the backend's multi-note add and update.
+    Everything written between init and finish() is merged into one undo entry.
+    """
+
+    CHUNK_SIZE: int = 500
+
+    col: Collection
+    pending: list[AddNoteRequest]
+    pending_updates: list[Note]
+    callbacks: list[callable]
+    added_count: int
+    updated_count: int
+    report: JoinReport
+
+    def __init__(self, col: Collection, undo_name: str = 'ZK Join', chunk_size: int = CHUNK_SIZE,
+                 report: JoinReport = None):
+        """
+        :param col: The collection to write to
+        :param undo_name: The name of the undo entry
+        :param chunk_size: How many notes are added in one backend call
+        :param report: The timings of the join stages, the backend calls are timed as the 'write' stage
+        """
+        self.col = col
+        self.report = report if report else JoinReport()
+        self.chunk_size = chunk_size
+        self.pending = []
+        self.pending_updates = []
+        self.callbacks = []
+        self.added_count = 0
+        self.updated_count = 0
+        self.undo_entry: int = col.add_custom_undo_entry(undo_name)
+
+    def add(self, note: Note, deck_id: DeckId):
+        """
+        Queue a note, it will get assigned with id after flushed.
+        """
+        self.pending.append(AddNoteRequest(note=note, deck_id=deck_id))
+
+    def update(self, note: Note):
+        """
+        Queue a modified note to write back.
+        """
+        self.pending_updates.append(note)
+
+    def defer(self, callback: callable):
+        """
+        Run the callback as soon as the notes queued before it are written (with ids assigned).
+        :param callback: function without argument
+        """
+        if self.pending:
+            self.callbacks.append(callback)
+        else:
+            callback()
+
+    def flush_if_full(self):
+        if len(self.pending) + len(self.pending_updates) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all the pending notes, then run the deferred callbacks in order.
+        A callback failing on the file system is logged, the rest still run.
+        """
+        for i in range(0, len(self.pending_updates), self.chunk_size):
+            chunk = self.pending_updates[i:i + self.chunk_size]
+            with self.report.span('write'):
+                self.col.update_notes(chunk)
+            self.updated_count += len(chunk)
+            logger.debug('Note-write: %d notes updated, %d in total.', len(chunk), self.updated_count)
+        self.pending_updates = []
+        for i in range(0, len(self.pending), self.chunk_size):
+            chunk = self.pending[i:i + self.chunk_size]
+            with self.report.span('write'):
+                self.col.add_notes(chunk)
+            self.added_count += len(chunk)
+            logger.debug('Note-write: %d notes added, %d in total.', len(chunk), self.added_count)
+        self.pending = []
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except OSError as e:
+                logger.error(f'Note-write: deferred callback failed, {e}')
+
+    def finish(self):
+        """
+        Flush the rest, and merge the changes into the single undo entry.
+        """
+        self.flush()
+        self.col.merge_undo_entries(self.undo_entry)
+        logger.info(f'Note-write: finished, {self.added_count} notes added, {self.updated_count} notes updated.')
@@ -10,10 +10,6 @@ A ZK contains a '.root' directory
 import logging
 import os
 
-from aqt import mw
-from aqt.qt import QFileDialog
-from aqt.utils import askUser
-
 
 logger = logging.getLogger(__name__)
 
@@ -23,16 +19,25 @@ class ZettelKasten:
     ZettelKästen
     """
     path: str = None
+    profile: str = None  # the Anki profile joined to
 
-    def __init__(self, path: str = None):
-        logger.debug(f'CWD - current working directory: {os.getcwd()}')
+    def __init__(self, path: str = None, profile: str = None):
+        """
+        :param path: ZK directory path, ask user to choose if empty
+        :param profile: The Anki profile joined to. If given, the ZK is opened headless (no dialog asking user),
+         otherwise it's the profile opened in Anki
+        """
+        self.profile = profile
         self.get_zk(path)
 
     def get_zk(self, path: str = None):
         """
         Get ZK directory path
         """
-        if not path:
+        if not path and self.profile is None:
+            # imported here, the headless join works without aqt
+            from aqt import mw
+            from aqt.qt import QFileDialog
             df = os.path.expanduser("~")  # default path
             # noinspection PyTypeChecker
             path = QFileDialog.getExistingDirectory(
@@ -52,7 +57,11 @@ class ZettelKasten:
         if os.path.exists(os.path.join(path, '.root')):
             return True
         else:
+            if self.profile is not None:
+                logger.error('Open ZK: cancelled, ".root" folder missing.\n')
+                return False
             logger.info('Open ZK: ".root" folder missing, ask user to choose-again.')
+            from aqt.utils import askUser
             if askUser('ZettelKästen directory does not contain ".root" folder.\n'
                        'Choose again?'):
                 self.get_zk()
@@ -60,3 +69,14 @@ class ZettelKasten:
             else:
                 logger.info('Open ZK: cancelled, as user have choose.\n')
                 return False
+
+    def manifest_path(self, name: str) -> str:
+        """
+        Get the path of the manifest file inside '.root' folder, one manifest per model and profile.
+        :param name: The manifest name, usually the model name
+        """
+        if self.profile is None:
+            from aqt import mw
+            self.profile = mw.pm.name
+        basename = f'{name}@{self.profile}.manifest.json'.replace(' ', '-')
+        return os.path.join(self.path, '.root', basename)